@@ -0,0 +1,114 @@
+"""
+Agrupamento das mensagens enviadas em sequência ao mesmo chat
+
+Agentes costumam mandar várias mensagens curtas ao mesmo número em poucos segundos
+("Olá!", "Seu pedido foi enviado", "Rastreio: ..."). Cada uma custa uma requisição
+ao Waha e uma ficha do limite de taxa, e o destinatário recebe várias notificações.
+
+Com uma janela configurada, a primeira mensagem a um chat abre um grupo e espera
+`janela` segundos; as mensagens ao mesmo chat que chegam nesse intervalo entram no
+grupo, e o texto unido (na ordem de chegada, separado por `separador`) é enviado
+uma única vez. Cada chamada espera o envio do seu grupo e recebe o resultado dele,
+com a quantidade de mensagens agrupadas e a sua posição.
+
+Um grupo é enviado antes do fim da janela quando a próxima mensagem não cabe nele: o
+texto unido passaria de `tamanho_maximo` (0 não limita) e seria dividido em partes.
+Os grupos de um mesmo chat são enviados em ordem, cada um depois do anterior.
+
+A espera da janela acontece no loop de eventos, sem ocupar threads: só o envio de
+cada grupo (a corrotina `enviar`) usa uma thread. O envio roda numa tarefa própria do
+grupo, e uma chamada cancelada (cliente desconectado) não cancela o envio das demais.
+"""
+
+import asyncio
+
+class _Grupo:
+    def __init__(self, anterior):
+        self.anterior = anterior
+        self.mensagens = []
+        self.tamanho = 0
+        self.cheio = asyncio.Event()
+        self.tarefa = None
+
+class AgrupadorEnvios:
+    """
+    Junta as mensagens ao mesmo chat recebidas dentro de `janela` segundos num único envio
+
+    Usado apenas no loop de eventos
+    """
+
+    def __init__(self, janela=0, tamanho_maximo=4096, separador="\n"):
+        self.janela = janela
+        self.tamanho_maximo = tamanho_maximo
+        self.separador = separador
+        self._abertos = {}
+        self._ultimos = {}
+        self.envios = 0
+        self.agrupadas = 0
+
+    @property
+    def ativo(self):
+        return self.janela > 0
+
+    async def enviar(self, chat_id, mensagem, enviar):
+        """
+        Envia `mensagem` junto com as demais do mesmo chat na janela, aguardando `enviar(texto)` uma vez por grupo
+
+        Retorna (resultado de `enviar`, quantidade de mensagens no grupo, posição da mensagem no grupo)
+        """
+        grupo = self._abertos.get(chat_id)
+        if grupo is not None and not self._cabe(grupo.tamanho + len(self.separador) + len(mensagem)):
+            # Não cabe: o grupo aberto é enviado já, e esta mensagem abre outro
+            self._fechar(chat_id, grupo)
+            grupo = None
+        if grupo is None:
+            grupo = _Grupo(self._ultimos.get(chat_id))
+            self._abertos[chat_id] = grupo
+            self._ultimos[chat_id] = grupo
+            grupo.tarefa = asyncio.ensure_future(self._enviar_grupo(chat_id, grupo, enviar))
+            # Evita o aviso de exceção não lida quando todas as chamadas do grupo foram canceladas
+            grupo.tarefa.add_done_callback(lambda tarefa: tarefa.cancelled() or tarefa.exception())
+        else:
+            grupo.tamanho += len(self.separador)
+        posicao = len(grupo.mensagens)
+        grupo.mensagens.append(mensagem)
+        grupo.tamanho += len(mensagem)
+        # Sem espaço nem para o separador: não espera o fim da janela
+        if not self._cabe(grupo.tamanho + 1):
+            self._fechar(chat_id, grupo)
+        resultado = await asyncio.shield(grupo.tarefa)
+        return resultado, len(grupo.mensagens), posicao
+
+    def _cabe(self, tamanho):
+        return self.tamanho_maximo <= 0 or tamanho <= self.tamanho_maximo
+
+    def _fechar(self, chat_id, grupo):
+        grupo.cheio.set()
+        if self._abertos.get(chat_id) is grupo:
+            del self._abertos[chat_id]
+
+    async def _enviar_grupo(self, chat_id, grupo, enviar):
+        try:
+            try:
+                await asyncio.wait_for(grupo.cheio.wait(), self.janela)
+            except asyncio.TimeoutError:
+                pass
+            # A partir daqui o grupo não recebe mais mensagens
+            self._fechar(chat_id, grupo)
+            if grupo.anterior is not None:
+                await asyncio.wait([grupo.anterior.tarefa])
+            return await enviar(self.separador.join(grupo.mensagens))
+        finally:
+            grupo.anterior = None
+            self.envios += 1
+            self.agrupadas += len(grupo.mensagens)
+            if self._ultimos.get(chat_id) is grupo:
+                del self._ultimos[chat_id]
+
+    def estatisticas(self):
+        return {
+            "janela_ms": round(self.janela * 1000),
+            "envios": self.envios,
+            "mensagens": self.agrupadas,
+            "grupos_abertos": len(self._abertos),
+        }
@@ -0,0 +1,324 @@
+"""
+Registro de auditoria dos envios, em JSON lines com índice por chat e horário
+
+Cada envio (cada parte, no caso de mensagens longas) vira uma linha JSON acrescentada
+ao segmento atual (envios-AAAAMMDD-HHMMSS-<pid>.jsonl). O segmento é trocado quando passa
+de `tamanho_segmento` bytes ou de `rotacao` segundos de idade, e os segmentos antigos
+nunca são reescritos.
+
+Vários processos podem gravar no mesmo diretório: cada segmento tem um único dono, que
+o mantém travado (flock) enquanto grava, e as posições do índice vêm do próprio arquivo.
+Um processo só retoma ou recupera um segmento que consiga travar, ou seja, cujo dono
+já terminou. Sem fcntl (Windows), cada processo sempre abre um segmento novo e as
+linhas não indexadas numa queda não são recuperadas.
+
+Ao lado dos segmentos, um índice SQLite guarda, para cada linha, o chat, o horário, o
+segmento e a posição em bytes. Uma consulta ("o que foi enviado a este número em
+março?") busca no índice e lê só as linhas encontradas, com seek direto na posição,
+sem percorrer os segmentos.
+
+`registrar` só coloca o registro numa fila: uma thread grava os registros acumulados
+a cada `intervalo` segundos, com uma escrita no segmento e uma transação no índice
+por lote, sem custo perceptível para quem envia. Uma linha gravada e não indexada
+(queda do processo entre as duas etapas) é indexada na próxima abertura.
+"""
+
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+PREFIXO_SEGMENTO = "envios-"
+SUFIXO_SEGMENTO = ".jsonl"
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS segmentos (
+    nome TEXT PRIMARY KEY,
+    criado_em REAL NOT NULL,
+    tamanho INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS registros (
+    chat_id TEXT NOT NULL,
+    ts REAL NOT NULL,
+    segmento TEXT NOT NULL,
+    posicao INTEGER NOT NULL,
+    tamanho INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_registros_chat ON registros(chat_id, ts);
+CREATE INDEX IF NOT EXISTS idx_registros_ts ON registros(ts);
+"""
+
+def analisar_periodo(desde=None, ate=None):
+    """
+    Converte datas ISO (2026-03-01 ou 2026-03-01T14:30, hora local) no intervalo [desde, ate) em epoch
+
+    Uma data sem hora em `ate` inclui o dia inteiro; levanta ValueError para datas inválidas
+    """
+    def converter(valor, fim_do_dia=False):
+        if not valor:
+            return None
+        try:
+            data = datetime.fromisoformat(valor)
+        except ValueError:
+            raise ValueError(f"Data inválida: '{valor}'. Use o formato AAAA-MM-DD ou AAAA-MM-DDTHH:MM")
+        if fim_do_dia and len(valor) == 10:
+            data += timedelta(days=1)
+        return data.timestamp()
+    return converter(desde), converter(ate, fim_do_dia=True)
+
+def _travar(arquivo):
+    """
+    Trava o segmento para este processo; False se outro processo já o trava
+    """
+    if fcntl is None:
+        return False
+    try:
+        fcntl.flock(arquivo.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return False
+    return True
+
+class LogAuditoria:
+    """
+    Registro de envios somente de acréscimo, com rotação e consulta indexada
+    """
+
+    def __init__(self, diretorio, tamanho_segmento=64 * 1024 * 1024, rotacao=86400, intervalo=0.5):
+        self.diretorio = diretorio
+        self.tamanho_segmento = tamanho_segmento
+        self.rotacao = rotacao
+        self.intervalo = intervalo
+        os.makedirs(diretorio, exist_ok=True)
+        self._fila = queue.Queue(maxsize=100000)
+        self._lock = threading.Lock()
+        self._conexao = sqlite3.connect(os.path.join(diretorio, "indice.db"), check_same_thread=False)
+        self._conexao.execute("PRAGMA journal_mode=WAL")
+        self._conexao.execute("PRAGMA synchronous=NORMAL")
+        self._conexao.executescript(ESQUEMA)
+        self._segmento = None
+        self._arquivo = None
+        self._thread = None
+        self._recuperar()
+
+    def registrar(self, chat_id, texto, id_mensagem=None, status="enviada", campanha=None, erro=None):
+        """
+        Coloca o envio na fila de gravação (não faz E/S)
+        """
+        registro = {"ts": round(time.time(), 3), "chat": chat_id, "id": id_mensagem, "status": status, "texto": texto}
+        if campanha:
+            registro["campanha"] = campanha
+        if erro:
+            registro["erro"] = erro
+        # Com a fila cheia (disco travado), espera em vez de perder o registro
+        self._fila.put(registro)
+
+    def consultar(self, chat_id=None, desde=None, ate=None, limite=100):
+        """
+        Envios do chat (ou de todos) com desde <= ts < ate (epoch), do mais recente ao mais antigo
+        """
+        condicoes, parametros = [], []
+        if chat_id:
+            condicoes.append("chat_id = ?")
+            parametros.append(chat_id)
+        if desde is not None:
+            condicoes.append("ts >= ?")
+            parametros.append(desde)
+        if ate is not None:
+            condicoes.append("ts < ?")
+            parametros.append(ate)
+        where = f"WHERE {' AND '.join(condicoes)}" if condicoes else ""
+        with self._lock:
+            linhas = self._conexao.execute(
+                f"SELECT segmento, posicao, tamanho FROM registros {where} ORDER BY ts DESC, rowid DESC LIMIT ?",
+                (*parametros, limite)
+            ).fetchall()
+        por_segmento = defaultdict(list)
+        for ordem, (segmento, posicao, tamanho) in enumerate(linhas):
+            por_segmento[segmento].append((posicao, tamanho, ordem))
+        registros = [None] * len(linhas)
+        for segmento, posicoes in por_segmento.items():
+            try:
+                arquivo = open(os.path.join(self.diretorio, segmento), "rb")
+            except FileNotFoundError:
+                # Segmento antigo apagado ou movido por fora
+                continue
+            with arquivo:
+                for posicao, tamanho, ordem in sorted(posicoes):
+                    arquivo.seek(posicao)
+                    conteudo = arquivo.read(tamanho)
+                    try:
+                        registros[ordem] = json.loads(conteudo)
+                    except ValueError:
+                        logger.warning("Auditoria: entrada do índice ilegível em %s na posição %d", segmento, posicao)
+        return [r for r in registros if r is not None]
+
+    def _recuperar(self):
+        """
+        Indexa as linhas completas que ficaram fora do índice e descarta uma linha incompleta,
+        nos segmentos sem dono (os travados por outro processo são indexados por ele)
+        """
+        with self._lock:
+            segmentos = self._conexao.execute("SELECT nome, tamanho FROM segmentos").fetchall()
+        for nome, indexado in segmentos:
+            caminho = os.path.join(self.diretorio, nome)
+            if not os.path.exists(caminho) or os.path.getsize(caminho) <= indexado:
+                continue
+            with open(caminho, "rb+") as arquivo:
+                if not _travar(arquivo):
+                    continue
+                self._recuperar_segmento(nome, indexado, arquivo)
+
+    def _recuperar_segmento(self, nome, indexado, arquivo):
+        entradas = []
+        posicao = indexado
+        arquivo.seek(indexado)
+        for conteudo in arquivo:
+            if not conteudo.endswith(b"\n"):
+                break
+            try:
+                registro = json.loads(conteudo)
+                entradas.append((registro["chat"], registro["ts"], nome, posicao, len(conteudo)))
+            except (ValueError, KeyError):
+                pass
+            posicao += len(conteudo)
+        arquivo.truncate(posicao)
+        with self._lock, self._conexao:
+            self._conexao.executemany(
+                "INSERT INTO registros (chat_id, ts, segmento, posicao, tamanho) VALUES (?, ?, ?, ?, ?)", entradas
+            )
+            self._conexao.execute("UPDATE segmentos SET tamanho = ? WHERE nome = ?", (posicao, nome))
+        logger.info("Auditoria: %d envio(s) recuperado(s) em %s", len(entradas), nome)
+
+    def _retomar_segmento(self):
+        # Retoma um segmento recente, dentro dos limites e sem dono (processo anterior encerrado)
+        with self._lock:
+            linhas = self._conexao.execute(
+                "SELECT nome, criado_em, tamanho FROM segmentos WHERE criado_em > ? AND tamanho < ? "
+                "ORDER BY criado_em DESC", (time.time() - self.rotacao, self.tamanho_segmento)
+            ).fetchall()
+        for nome, criado_em, indexado in linhas:
+            caminho = os.path.join(self.diretorio, nome)
+            if not os.path.exists(caminho):
+                continue
+            arquivo = open(caminho, "ab")
+            if not _travar(arquivo):
+                arquivo.close()
+                continue
+            if os.fstat(arquivo.fileno()).st_size > indexado:
+                # Gravado pelo dono anterior depois da abertura deste processo
+                with open(caminho, "rb+") as leitura:
+                    self._recuperar_segmento(nome, indexado, leitura)
+            arquivo.seek(0, os.SEEK_END)
+            self._segmento = {"nome": nome, "criado_em": criado_em}
+            self._arquivo = arquivo
+            return True
+        return False
+
+    def _abrir_segmento(self):
+        if self._segmento is None and fcntl is not None and self._retomar_segmento():
+            return
+        if self._arquivo is not None:
+            self._arquivo.close()
+        agora = time.time()
+        carimbo = time.strftime("%Y%m%d-%H%M%S", time.localtime(agora))
+        base = f"{PREFIXO_SEGMENTO}{carimbo}-{os.getpid()}"
+        nome = f"{base}{SUFIXO_SEGMENTO}"
+        sequencia = 1
+        with self._lock, self._conexao:
+            # Mais de um segmento no mesmo segundo (segmentos pequenos ou apagados por fora)
+            while (os.path.exists(os.path.join(self.diretorio, nome))
+                   or self._conexao.execute("SELECT 1 FROM segmentos WHERE nome = ?", (nome,)).fetchone()):
+                sequencia += 1
+                nome = f"{base}-{sequencia}{SUFIXO_SEGMENTO}"
+            # Criado e travado antes de aparecer no índice, para ninguém mais retomá-lo
+            self._arquivo = open(os.path.join(self.diretorio, nome), "xb")
+            _travar(self._arquivo)
+            self._conexao.execute("INSERT INTO segmentos (nome, criado_em, tamanho) VALUES (?, ?, 0)", (nome, agora))
+        self._segmento = {"nome": nome, "criado_em": agora}
+
+    def _gravar_lote(self, registros):
+        segmento = self._segmento
+        if (segmento is None or self._arquivo.tell() >= self.tamanho_segmento
+                or time.time() - segmento["criado_em"] >= self.rotacao):
+            self._abrir_segmento()
+            segmento = self._segmento
+        linhas = [json.dumps(r, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n" for r in registros]
+        entradas = []
+        # Posição real do fim do arquivo, que só este processo estende enquanto o trava
+        posicao = self._arquivo.tell()
+        for registro, linha in zip(registros, linhas):
+            entradas.append((registro["chat"], registro["ts"], segmento["nome"], posicao, len(linha)))
+            posicao += len(linha)
+        self._arquivo.write(b"".join(linhas))
+        self._arquivo.flush()
+        with self._lock, self._conexao:
+            self._conexao.executemany(
+                "INSERT INTO registros (chat_id, ts, segmento, posicao, tamanho) VALUES (?, ?, ?, ?, ?)", entradas
+            )
+            self._conexao.execute("UPDATE segmentos SET tamanho = ? WHERE nome = ?", (posicao, segmento["nome"]))
+
+    def iniciar(self):
+        """
+        Inicia a thread de gravação
+        """
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._executar, name="auditoria-envios", daemon=True)
+        self._thread.start()
+
+    def _executar(self):
+        encerrar = False
+        while not encerrar:
+            registro = self._fila.get()
+            if registro is None:
+                break
+            lote = [registro]
+            # Junta o que chegar durante o intervalo numa única escrita
+            prazo = time.monotonic() + self.intervalo
+            while True:
+                restante = prazo - time.monotonic()
+                try:
+                    registro = self._fila.get(timeout=restante) if restante > 0 else self._fila.get_nowait()
+                except queue.Empty:
+                    break
+                if registro is None:
+                    encerrar = True
+                    break
+                lote.append(registro)
+            try:
+                self._gravar_lote(lote)
+            except Exception as e:
+                logger.error("Erro ao gravar %d registro(s) de auditoria: %s", len(lote), e)
+
+    def fechar(self, aguardar=10):
+        """
+        Grava os registros pendentes e encerra a thread (esperando até `aguardar` segundos)
+        """
+        if self._thread is not None:
+            self._fila.put(None)
+            self._thread.join(aguardar)
+            self._thread = None
+        else:
+            # Sem a thread (nunca iniciada), grava aqui o que ficou na fila
+            pendentes = []
+            while not self._fila.empty():
+                pendentes.append(self._fila.get_nowait())
+            if pendentes:
+                self._gravar_lote(pendentes)
+        with self._lock:
+            if self._arquivo is not None:
+                self._arquivo.close()
+                self._arquivo = None
+            self._conexao.close()
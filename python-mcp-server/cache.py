@@ -0,0 +1,77 @@
+"""
+Cache em memória com expiração (TTL), seguro para uso entre threads
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+class CacheTTL:
+    """
+    Cache chave/valor com expiração e limite de itens (os mais antigos saem primeiro)
+
+    `obter_ou_carregar` garante que, para cada chave, apenas uma thread consulte a
+    origem por vez; as demais aguardam e reaproveitam o valor carregado.
+    """
+
+    def __init__(self, ttl, max_itens=1000):
+        self.ttl = ttl
+        self.max_itens = max_itens
+        self._itens = OrderedDict()
+        self._lock = threading.Lock()
+        self._carregando = {}
+
+    def obter(self, chave):
+        with self._lock:
+            item = self._itens.get(chave)
+            if item is None:
+                return None
+            valor, expira = item
+            if expira < time.monotonic():
+                del self._itens[chave]
+                return None
+            self._itens.move_to_end(chave)
+            return valor
+
+    def definir(self, chave, valor):
+        with self._lock:
+            self._itens[chave] = (valor, time.monotonic() + self.ttl)
+            self._itens.move_to_end(chave)
+            while len(self._itens) > self.max_itens:
+                self._itens.popitem(last=False)
+
+    def invalidar(self, chave=None):
+        """
+        Remove uma chave, ou todo o cache quando nenhuma chave é informada
+        """
+        with self._lock:
+            if chave is None:
+                self._itens.clear()
+            else:
+                self._itens.pop(chave, None)
+
+    def invalidar_se(self, condicao):
+        """
+        Remove todas as chaves para as quais `condicao(chave)` é verdadeira
+        """
+        with self._lock:
+            for chave in [c for c in self._itens if condicao(c)]:
+                del self._itens[chave]
+
+    def obter_ou_carregar(self, chave, carregar):
+        valor = self.obter(chave)
+        if valor is not None:
+            return valor
+        with self._lock:
+            lock_chave = self._carregando.setdefault(chave, threading.Lock())
+        with lock_chave:
+            # Outra thread pode ter carregado o valor enquanto esperávamos
+            valor = self.obter(chave)
+            if valor is None:
+                valor = carregar()
+                if valor is not None:
+                    self.definir(chave, valor)
+        with self._lock:
+            if self._carregando.get(chave) is lock_chave and not lock_chave.locked():
+                del self._carregando[chave]
+        return valor
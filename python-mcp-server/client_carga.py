@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""
+Gerador de carga MCP para servidor WhatsApp
+Abre várias sessões concorrentes (SSE ou stdio) e reproduz uma mistura de operações
+em degraus de taxa, reportando o ponto de saturação e o joelho da curva de latência
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from dotenv import load_dotenv
+from mcp import ClientSession, StdioServerParameters
+from mcp.client.sse import sse_client
+from mcp.client.stdio import stdio_client
+
+# Carregar variáveis de ambiente
+load_dotenv()
+
+# Configurações
+MCP_SERVER_URL = os.getenv("MCP_SERVER_URL", "http://localhost:8000")
+
+# Um degrau é considerado saturado quando a vazão fica abaixo desta fração da taxa
+# oferecida ou quando a taxa de erros passa do limite
+FRACAO_VAZAO_MINIMA = 0.9
+TAXA_ERROS_MAXIMA = 0.05
+
+def analisar_mistura(texto):
+    """
+    Converte 'list_tools=6,read=3,send=1' em uma lista de pesos por operação
+    """
+    mistura = {}
+    for item in texto.split(","):
+        if not item.strip():
+            continue
+        nome, _, peso = item.partition("=")
+        nome = nome.strip()
+        if nome not in ("list_tools", "read", "send"):
+            raise ValueError(f"Operação desconhecida na mistura: '{nome}'")
+        mistura[nome] = float(peso or 1)
+    if not mistura or sum(mistura.values()) <= 0:
+        raise ValueError("A mistura precisa de pelo menos uma operação com peso positivo")
+    return mistura
+
+def percentil(valores, p):
+    """
+    Percentil por interpolação linear (valores já ordenados)
+    """
+    if not valores:
+        return None
+    k = (len(valores) - 1) * p
+    i = int(k)
+    j = min(i + 1, len(valores) - 1)
+    return valores[i] + (valores[j] - valores[i]) * (k - i)
+
+async def executar_operacao(session, operacao, args):
+    """
+    Executa uma operação MCP na sessão informada
+    """
+    if operacao == "list_tools":
+        await session.list_tools()
+    elif operacao == "read":
+        await session.read_resource(random.choice(args.recursos))
+    else:
+        resultado = await session.call_tool(
+            args.ferramenta_envio,
+            arguments={"numero": args.numero, "mensagem": args.mensagem}
+        )
+        if getattr(resultado, "isError", False):
+            raise RuntimeError(f"Ferramenta retornou erro: {resultado.content}")
+
+def abrir_transporte(args):
+    """
+    Retorna o gerenciador de contexto do transporte escolhido
+    """
+    if args.transporte == "stdio":
+        server_params = StdioServerParameters(
+            command="python",
+            args=[args.servidor],
+            env=None,
+        )
+        return stdio_client(server_params)
+    return sse_client(args.url)
+
+async def sessao_trabalhadora(indice, args, fila, amostras, abertura, prontas):
+    """
+    Mantém uma sessão MCP aberta e consome operações da fila até receber None
+    """
+    try:
+        async with abertura:
+            transporte = abrir_transporte(args)
+            contexto = await transporte.__aenter__()
+        try:
+            read, write = contexto
+            async with ClientSession(read, write) as session:
+                await session.initialize()
+                prontas.append(indice)
+                while True:
+                    item = await fila.get()
+                    if item is None:
+                        break
+                    degrau, operacao, agendado = item
+                    erro = None
+                    try:
+                        await asyncio.wait_for(executar_operacao(session, operacao, args), args.timeout)
+                    except Exception as e:
+                        erro = type(e).__name__
+                    # A latência é medida a partir do instante agendado, não do início da
+                    # execução, para que a espera na fila também apareça quando o servidor satura
+                    fim = time.perf_counter()
+                    amostras.append((degrau, operacao, fim - agendado, fim, erro))
+        finally:
+            await transporte.__aexit__(None, None, None)
+    except Exception as e:
+        print(f"Sessão {indice} encerrada com erro: {e}", file=sys.stderr)
+
+async def gerar_degrau(degrau, taxa, duracao, mistura, fila):
+    """
+    Enfileira operações em malha aberta (chegadas de Poisson) na taxa alvo
+    """
+    operacoes = list(mistura.keys())
+    pesos = list(mistura.values())
+    inicio = time.perf_counter()
+    proximo = inicio
+    enviados = 0
+    while True:
+        proximo += random.expovariate(taxa)
+        if proximo - inicio >= duracao:
+            break
+        espera = proximo - time.perf_counter()
+        if espera > 0:
+            await asyncio.sleep(espera)
+        fila.put_nowait((degrau, random.choices(operacoes, pesos)[0], proximo))
+        enviados += 1
+    return inicio, inicio + duracao, enviados
+
+def resumir_degraus(degraus, amostras):
+    """
+    Calcula vazão, taxa de erros e percentis de latência de cada degrau
+    """
+    resumo = []
+    for indice, (taxa, inicio, fim, enviados) in enumerate(degraus):
+        do_degrau = [a for a in amostras if a[0] == indice]
+        sucessos = sorted(a[2] for a in do_degrau if a[4] is None)
+        erros = sum(1 for a in do_degrau if a[4] is not None)
+        # Operações que terminam depois do fim do degrau alongam a janela: quando o servidor
+        # satura, o acúmulo na fila derruba a vazão medida
+        ultimo = max((a[3] for a in do_degrau), default=fim)
+        janela = max(fim, ultimo) - inicio
+        resumo.append({
+            "taxa_alvo": taxa,
+            "enviados": enviados,
+            "concluidos": len(sucessos),
+            "erros": erros,
+            "perdidos": enviados - len(do_degrau),
+            "taxa_oferecida": enviados / (fim - inicio),
+            "vazao": len(sucessos) / janela,
+            "p50_ms": _ms(percentil(sucessos, 0.50)),
+            "p95_ms": _ms(percentil(sucessos, 0.95)),
+            "p99_ms": _ms(percentil(sucessos, 0.99)),
+        })
+    return resumo
+
+def _ms(segundos):
+    return None if segundos is None else round(segundos * 1000, 1)
+
+def encontrar_saturacao(resumo):
+    """
+    Retorna o índice do primeiro degrau saturado, ou None se nenhum saturou
+    """
+    for i, d in enumerate(resumo):
+        falhas = d["erros"] + d["perdidos"]
+        if d["enviados"] and falhas / d["enviados"] > TAXA_ERROS_MAXIMA:
+            return i
+        if d["vazao"] < FRACAO_VAZAO_MINIMA * d["taxa_oferecida"]:
+            return i
+    return None
+
+def encontrar_joelho(resumo):
+    """
+    Localiza o joelho da curva taxa x p95 (método Kneedle para curva convexa crescente)
+    """
+    pontos = [(d["taxa_alvo"], d["p95_ms"]) for d in resumo if d["p95_ms"] is not None]
+    if len(pontos) < 3:
+        return None
+    xs, ys = zip(*pontos)
+    # Uma curva praticamente plana não tem joelho
+    if max(ys) < 1.5 * max(min(ys), 1):
+        return None
+    dx = (max(xs) - min(xs)) or 1
+    dy = (max(ys) - min(ys)) or 1
+    # Distância de cada ponto normalizado até a diagonal; o joelho é o ponto mais abaixo dela
+    diferencas = [(x - min(xs)) / dx - (y - min(ys)) / dy for x, y in pontos]
+    melhor = max(range(len(pontos)), key=lambda i: diferencas[i])
+    if diferencas[melhor] <= 0:
+        return None
+    return pontos[melhor][0]
+
+def imprimir_relatorio(resumo, saturacao, joelho):
+    print("\n=== Resultado por degrau ===")
+    print(f"{'taxa':>8} {'vazão':>8} {'ok':>7} {'erros':>6} {'perd.':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for d in resumo:
+        print(
+            f"{d['taxa_alvo']:>8g} {d['vazao']:>8.1f} {d['concluidos']:>7} {d['erros']:>6} {d['perdidos']:>6} "
+            f"{_fmt(d['p50_ms']):>9} {_fmt(d['p95_ms']):>9} {_fmt(d['p99_ms']):>9}"
+        )
+    print("\n=== Conclusões ===")
+    if saturacao is None:
+        print("Nenhum degrau saturou o servidor; aumente --taxas para encontrar o limite")
+    else:
+        d = resumo[saturacao]
+        print(f"Saturação a partir de {d['taxa_alvo']:g} op/s (vazão obtida: {d['vazao']:.1f} op/s)")
+        if saturacao > 0:
+            print(f"Maior taxa sustentada: {resumo[saturacao - 1]['taxa_alvo']:g} op/s")
+    if joelho is None:
+        print("Joelho da curva de latência não identificado (poucos degraus ou curva plana)")
+    else:
+        print(f"Joelho da curva de latência (p95) em {joelho:g} op/s")
+
+def _fmt(valor):
+    return "-" if valor is None else f"{valor:.1f}"
+
+async def main(args):
+    mistura = analisar_mistura(args.mix)
+    if "send" in mistura and not args.numero:
+        raise SystemExit("A mistura inclui 'send': informe --numero (mensagens reais serão enviadas)")
+
+    print(f"Abrindo {args.sessoes} sessões MCP ({args.transporte})...")
+    fila = asyncio.Queue()
+    amostras = []
+    prontas = []
+    abertura = asyncio.Semaphore(args.abertura_simultanea)
+    trabalhadoras = [
+        asyncio.create_task(sessao_trabalhadora(i, args, fila, amostras, abertura, prontas))
+        for i in range(args.sessoes)
+    ]
+
+    # Aguardar as sessões inicializarem antes do primeiro degrau
+    limite = time.perf_counter() + args.timeout_abertura
+    while len(prontas) < args.sessoes and time.perf_counter() < limite:
+        if all(t.done() for t in trabalhadoras):
+            break
+        await asyncio.sleep(0.1)
+    if not prontas:
+        raise SystemExit("Nenhuma sessão pôde ser aberta")
+    print(f"{len(prontas)} sessões prontas. Mistura: {mistura}")
+
+    degraus = []
+    for indice, taxa in enumerate(args.taxas):
+        print(f"Degrau {indice + 1}/{len(args.taxas)}: {taxa:g} op/s por {args.duracao:g}s")
+        inicio, fim, enviados = await gerar_degrau(indice, taxa, args.duracao, mistura, fila)
+        degraus.append((taxa, inicio, fim, enviados))
+        if args.pausa:
+            await asyncio.sleep(args.pausa)
+
+    # Dar tempo para as operações pendentes terminarem, sem esperar indefinidamente
+    limite = time.perf_counter() + args.timeout
+    while not fila.empty() and time.perf_counter() < limite:
+        await asyncio.sleep(0.1)
+    while not fila.empty():
+        fila.get_nowait()
+    for _ in trabalhadoras:
+        fila.put_nowait(None)
+    await asyncio.wait(trabalhadoras, timeout=args.timeout)
+
+    resumo = resumir_degraus(degraus, amostras)
+    saturacao = encontrar_saturacao(resumo)
+    joelho = encontrar_joelho(resumo)
+    imprimir_relatorio(resumo, saturacao, joelho)
+
+    if args.saida_json:
+        with open(args.saida_json, "w", encoding="utf-8") as f:
+            json.dump({
+                "sessoes": len(prontas),
+                "mistura": mistura,
+                "degraus": resumo,
+                "saturacao_op_s": None if saturacao is None else resumo[saturacao]["taxa_alvo"],
+                "joelho_op_s": joelho,
+            }, f, ensure_ascii=False, indent=2)
+        print(f"Relatório salvo em {args.saida_json}")
+
+def criar_parser():
+    parser = argparse.ArgumentParser(description="Gerador de carga para o servidor MCP WhatsApp")
+    parser.add_argument("--transporte", choices=["sse", "stdio"], default="sse")
+    parser.add_argument("--url", default=MCP_SERVER_URL.rstrip("/") + "/sse",
+                        help="Endpoint SSE do servidor (padrão: MCP_SERVER_URL + /sse)")
+    parser.add_argument("--servidor", default="server.py", help="Script do servidor stdio")
+    parser.add_argument("--sessoes", type=int, default=100, help="Número de sessões concorrentes")
+    parser.add_argument("--abertura-simultanea", type=int, default=20,
+                        help="Quantas sessões podem estar abrindo ao mesmo tempo")
+    parser.add_argument("--taxas", type=lambda s: [float(t) for t in s.split(",")],
+                        default=[10, 25, 50, 100, 200, 400], help="Taxas alvo (op/s) de cada degrau")
+    parser.add_argument("--duracao", type=float, default=20, help="Duração de cada degrau em segundos")
+    parser.add_argument("--pausa", type=float, default=2, help="Pausa entre degraus em segundos")
+    parser.add_argument("--mix", default="list_tools=7,read=3",
+                        help="Pesos das operações: list_tools, read e send (ex: list_tools=6,read=3,send=1)")
+    parser.add_argument("--recursos", type=lambda s: s.split(","),
+                        default=["waha://configuracao", "waha://status"], help="URIs lidas em 'read'")
+    parser.add_argument("--ferramenta-envio", default="enviar_mensagem_whatsapp")
+    parser.add_argument("--numero", help="Número usado nas operações 'send'")
+    parser.add_argument("--mensagem", default="Teste de carga MCP")
+    parser.add_argument("--timeout", type=float, default=30, help="Timeout por operação em segundos")
+    parser.add_argument("--timeout-abertura", type=float, default=60,
+                        help="Tempo máximo para abrir as sessões em segundos")
+    parser.add_argument("--saida-json", help="Arquivo para salvar o relatório em JSON")
+    return parser
+
+if __name__ == "__main__":
+    asyncio.run(main(criar_parser().parse_args()))
@@ -0,0 +1,130 @@
+"""
+Controle adaptativo da concorrência com o Waha (AIMD)
+
+Um limite fixo de vagas ou desperdiça capacidade quando o Waha está saudável ou
+acumula timeouts quando o navegador por trás dele fica lento. O controle observa a
+latência e os erros dos envios (POST /api/sendText) e ajusta as vagas do Despachante:
+
+- Aumento aditivo: ao fim de cada janela de amostras sem erros, com a latência
+  mediana dentro de `tolerancia` vezes a latência de referência e as vagas todas em
+  uso, o limite sobe uma vaga
+- Corte multiplicativo: um erro (timeout, falha de conexão, 5xx ou 429) ou a latência
+  mediana acima da tolerância multiplica o limite por `corte`, na hora
+
+A latência de referência é a menor mediana dos últimos `horizonte` segundos: as
+janelas com menos vagas, depois de um corte, a mantêm baixa enquanto o limite sobe e
+desce, e uma mudança duradoura na latência do Waha passa a valer depois desse prazo.
+Amostras de requisições iniciadas antes da última mudança do limite são descartadas:
+elas refletem o limite anterior, e assim uma rajada de timeouts causa um único corte,
+e não um corte por requisição.
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+class ControleAdaptativo:
+    """
+    Ajusta o limite de vagas do despachante entre `minimo` e `maximo` conforme as amostras registradas
+    """
+
+    def __init__(self, despachante, minimo=1, maximo=16, tolerancia=1.5, corte=0.7, amostras=10, horizonte=30):
+        self.despachante = despachante
+        self.minimo = max(1, minimo)
+        self.maximo = max(self.minimo, maximo)
+        self.tolerancia = tolerancia
+        self.corte = corte
+        self.amostras = amostras
+        self.horizonte = horizonte
+        self._lock = threading.Lock()
+        self._latencias = []
+        self._erros = 0
+        self._saturado = False
+        self._mudou_em = time.monotonic()
+        # (instante, mediana) das janelas sem erros, com as medianas crescentes: a primeira é a mínima
+        self._medianas = deque()
+        self.latencia_janela = None
+        self.aumentos = 0
+        self.cortes = 0
+        despachante.definir_limite(min(max(despachante.limite, self.minimo), self.maximo))
+
+    def registrar(self, inicio, latencia, erro=False):
+        """
+        Registra uma requisição iniciada em `inicio` (time.monotonic) que levou `latencia` segundos
+        """
+        saturado = self.despachante.saturado()
+        with self._lock:
+            if inicio < self._mudou_em:
+                return
+            self._latencias.append(latencia)
+            self._erros += bool(erro)
+            self._saturado = self._saturado or saturado
+            # Um erro fecha a janela na hora, para o corte não esperar as demais amostras
+            if not erro and len(self._latencias) < max(self.amostras, self.despachante.limite):
+                return
+            limite = self._avaliar(self.despachante.limite)
+            self._latencias, self._erros, self._saturado = [], 0, False
+            if limite is None:
+                return
+            self._mudou_em = time.monotonic()
+            self.despachante.definir_limite(limite)
+
+    def _avaliar(self, limite):
+        # Chamado com o lock; retorna o novo limite ou None para mantê-lo
+        latencias = sorted(self._latencias)
+        mediana = latencias[len(latencias) // 2]
+        self.latencia_janela = mediana
+        referencia = self.latencia_referencia
+        if not self._erros:
+            agora = time.monotonic()
+            while self._medianas and self._medianas[-1][1] >= mediana:
+                self._medianas.pop()
+            self._medianas.append((agora, mediana))
+            while self._medianas[0][0] < agora - self.horizonte:
+                self._medianas.popleft()
+        lenta = referencia is not None and mediana > referencia * self.tolerancia
+        if self._erros or lenta:
+            novo = max(self.minimo, min(int(limite * self.corte), limite - 1))
+            if novo == limite:
+                return None
+            self.cortes += 1
+            logger.info(
+                "Concorrência do Waha reduzida de %d para %d (%s, mediana %.0f ms)", limite, novo,
+                f"{self._erros} erro(s)" if self._erros else "latência alta", mediana * 1000
+            )
+            return novo
+        if self._saturado and limite < self.maximo:
+            self.aumentos += 1
+            logger.debug("Concorrência do Waha aumentada de %d para %d", limite, limite + 1)
+            return limite + 1
+        return None
+
+    @property
+    def latencia_referencia(self):
+        return self._medianas[0][1] if self._medianas else None
+
+    def estatisticas(self):
+        with self._lock:
+            return {
+                "limite": self.despachante.limite,
+                "minimo": self.minimo,
+                "maximo": self.maximo,
+                "latencia_referencia_ms": _ms(self.latencia_referencia),
+                "latencia_janela_ms": _ms(self.latencia_janela),
+                "aumentos": self.aumentos,
+                "cortes": self.cortes,
+            }
+
+def _ms(segundos):
+    return round(segundos * 1000, 1) if segundos is not None else None
+
+def criar_controle(despachante, minimo=1, maximo=16, tolerancia=1.5):
+    """
+    Controle adaptativo para o despachante, ou None quando desativado (maximo 0)
+    """
+    if maximo <= 0:
+        return None
+    return ControleAdaptativo(despachante, minimo, maximo, tolerancia)
@@ -0,0 +1,312 @@
+"""
+Armazenamento local de contatos (SQLite) e sincronização incremental com o Waha
+
+A agenda é lida do Waha em páginas ordenadas por ID. Cada página tem um checksum
+persistido: páginas com o mesmo checksum da sincronização anterior são descartadas
+sem tocar no banco, e nas páginas alteradas só os contatos cujo hash mudou são
+gravados. O cursor (offset da próxima página) também é persistido, de modo que uma
+sincronização interrompida continua de onde parou.
+"""
+
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from prioridades import com_prioridade
+
+logger = logging.getLogger(__name__)
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS contatos (
+    chat_id TEXT PRIMARY KEY,
+    numero TEXT NOT NULL,
+    nome TEXT,
+    origem TEXT NOT NULL,
+    hash TEXT,
+    atualizado_em REAL
+);
+CREATE INDEX IF NOT EXISTS idx_contatos_nome ON contatos(nome COLLATE NOCASE);
+CREATE TABLE IF NOT EXISTS sync_paginas (
+    pagina INTEGER PRIMARY KEY,
+    checksum TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sync_estado (
+    chave TEXT PRIMARY KEY,
+    valor TEXT
+);
+"""
+
+class ContatosStore:
+    """
+    Contatos persistidos em SQLite, com busca por nome indexada
+    """
+
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self._lock = threading.Lock()
+        self._conexao = sqlite3.connect(caminho, check_same_thread=False)
+        self._conexao.execute("PRAGMA journal_mode=WAL")
+        self._conexao.execute("PRAGMA synchronous=NORMAL")
+        self._conexao.executescript(ESQUEMA)
+
+    def buscar_por_nome(self, nome):
+        """
+        Retorna o número do contato com o nome exato (sem diferenciar maiúsculas), ou None
+        """
+        with self._lock:
+            linha = self._conexao.execute(
+                "SELECT numero FROM contatos WHERE nome = ? COLLATE NOCASE LIMIT 1", (nome,)
+            ).fetchone()
+        return linha[0] if linha else None
+
+    def pesquisar(self, termo, limite=10):
+        """
+        Contatos cujo nome começa com `termo`
+        """
+        with self._lock:
+            linhas = self._conexao.execute(
+                "SELECT nome, numero FROM contatos WHERE nome LIKE ? COLLATE NOCASE ORDER BY nome LIMIT ?",
+                (termo.replace("%", "").replace("_", "") + "%", limite)
+            ).fetchall()
+        return [{"nome": nome, "numero": numero} for nome, numero in linhas]
+
+    def total(self):
+        with self._lock:
+            return self._conexao.execute("SELECT COUNT(*) FROM contatos").fetchone()[0]
+
+    def importar(self, contatos):
+        """
+        Grava um lote de contatos importados numa única transação
+
+        Contatos já existentes só são alterados se o nome mudou e mantêm a origem; os novos
+        ficam com origem 'importacao' e não são removidos pela sincronização. Retorna
+        quantos contatos foram inseridos ou alterados
+        """
+        agora = time.time()
+        with self._lock, self._conexao:
+            antes = self._conexao.total_changes
+            self._conexao.executemany(
+                "INSERT INTO contatos (chat_id, numero, nome, origem, hash, atualizado_em) "
+                "VALUES (?, ?, ?, 'importacao', ?, ?) "
+                "ON CONFLICT(chat_id) DO UPDATE SET nome = excluded.nome, hash = excluded.hash, "
+                "atualizado_em = excluded.atualizado_em WHERE contatos.hash IS NOT excluded.hash",
+                [(c["chat_id"], c["numero"], c["nome"], c["hash"], agora) for c in contatos]
+            )
+            return self._conexao.total_changes - antes
+
+    def listar_lote(self, apos=None, limite=1000):
+        """
+        Contatos com chat_id maior que `apos`, em ordem, para percorrer o banco em lotes
+        """
+        with self._lock:
+            linhas = self._conexao.execute(
+                "SELECT chat_id, numero, nome, origem FROM contatos WHERE chat_id > ? ORDER BY chat_id LIMIT ?",
+                (apos or "", limite)
+            ).fetchall()
+        return [{"chat_id": chat_id, "numero": numero, "nome": nome, "origem": origem}
+                for chat_id, numero, nome, origem in linhas]
+
+    def obter_estado(self, chave, padrao=None):
+        with self._lock:
+            linha = self._conexao.execute("SELECT valor FROM sync_estado WHERE chave = ?", (chave,)).fetchone()
+        return linha[0] if linha else padrao
+
+    def definir_estado(self, chave, valor):
+        with self._lock, self._conexao:
+            self._conexao.execute(
+                "INSERT OR REPLACE INTO sync_estado (chave, valor) VALUES (?, ?)", (chave, str(valor))
+            )
+
+    def checksum_pagina(self, pagina):
+        with self._lock:
+            linha = self._conexao.execute("SELECT checksum FROM sync_paginas WHERE pagina = ?", (pagina,)).fetchone()
+        return linha[0] if linha else None
+
+    def aplicar_pagina(self, pagina, checksum, contatos, inicio, fim):
+        """
+        Aplica os contatos de uma página alterada, gravando apenas o que mudou
+
+        A página cobre os IDs maiores que `inicio` e até `fim`, inclusive (None = sem limite);
+        contatos sincronizados dessa faixa que não vieram na página foram removidos no Waha.
+        Retorna (inseridos, atualizados, removidos)
+        """
+        inseridos = atualizados = 0
+        agora = time.time()
+        with self._lock, self._conexao:
+            ids = [c["chat_id"] for c in contatos]
+            existentes = {}
+            for i in range(0, len(ids), 500):
+                lote = ids[i:i + 500]
+                existentes.update(self._conexao.execute(
+                    f"SELECT chat_id, hash FROM contatos WHERE chat_id IN ({','.join('?' * len(lote))})", lote
+                ).fetchall())
+            alterados = []
+            for contato in contatos:
+                anterior = existentes.get(contato["chat_id"], False)
+                if anterior == contato["hash"]:
+                    continue
+                if anterior is False:
+                    inseridos += 1
+                else:
+                    atualizados += 1
+                alterados.append((contato["chat_id"], contato["numero"], contato["nome"], contato["hash"], agora))
+            self._conexao.executemany(
+                "INSERT OR REPLACE INTO contatos (chat_id, numero, nome, origem, hash, atualizado_em) "
+                "VALUES (?, ?, ?, 'waha', ?, ?)",
+                alterados
+            )
+            removidos = self._remover_ausentes(ids, inicio, fim)
+            self._conexao.execute(
+                "INSERT OR REPLACE INTO sync_paginas (pagina, checksum) VALUES (?, ?)", (pagina, checksum)
+            )
+        return inseridos, atualizados, removidos
+
+    def finalizar_sincronizacao(self, ultima_pagina, ultimo_id):
+        """
+        Remove contatos sincronizados além do último ID recebido e checksums de páginas que deixaram de existir
+        """
+        with self._lock, self._conexao:
+            removidos = self._remover_ausentes([], ultimo_id, None)
+            self._conexao.execute("DELETE FROM sync_paginas WHERE pagina > ?", (ultima_pagina,))
+        return removidos
+
+    def _remover_ausentes(self, ids, inicio, fim):
+        condicoes = ["origem = 'waha'"]
+        parametros = []
+        if inicio is not None:
+            condicoes.append("chat_id > ?")
+            parametros.append(inicio)
+        if fim is not None:
+            condicoes.append("chat_id <= ?")
+            parametros.append(fim)
+        faixa = self._conexao.execute(
+            f"SELECT chat_id FROM contatos WHERE {' AND '.join(condicoes)}", parametros
+        ).fetchall()
+        presentes = set(ids)
+        ausentes = [(chat_id,) for (chat_id,) in faixa if chat_id not in presentes]
+        self._conexao.executemany("DELETE FROM contatos WHERE chat_id = ?", ausentes)
+        return len(ausentes)
+
+    def fechar(self):
+        with self._lock:
+            self._conexao.close()
+
+def normalizar_contato_waha(contato):
+    """
+    Reduz um contato do Waha a chat_id, número, nome e hash; retorna None para não-contatos
+    """
+    chat_id = contato.get("id")
+    if isinstance(chat_id, dict):
+        chat_id = chat_id.get("_serialized")
+    if not isinstance(chat_id, str) or not chat_id.endswith("@c.us"):
+        return None
+    numero = chat_id[:-len("@c.us")]
+    nome = contato.get("name") or contato.get("pushname") or contato.get("shortName")
+    hash_contato = hashlib.sha1(f"{numero}\x00{nome or ''}".encode("utf-8")).hexdigest()
+    return {"chat_id": chat_id, "numero": numero, "nome": nome, "hash": hash_contato}
+
+class SincronizadorContatos:
+    """
+    Sincroniza a agenda do Waha com o ContatosStore, sob demanda ou em segundo plano
+    """
+
+    def __init__(self, waha, store, tamanho_pagina=500, intervalo=0):
+        self.waha = waha
+        self.store = store
+        self.tamanho_pagina = tamanho_pagina
+        self.intervalo = intervalo
+        self._lock = threading.Lock()
+        self._parar = threading.Event()
+        self._thread = None
+
+    def sincronizar(self):
+        """
+        Executa uma sincronização completa (ou retoma a interrompida) e retorna um resumo
+        """
+        if not self._lock.acquire(blocking=False):
+            return {"em_andamento": True}
+        try:
+            return self._sincronizar()
+        finally:
+            self._lock.release()
+
+    def _sincronizar(self):
+        inicio_execucao = time.monotonic()
+        pagina = int(self.store.obter_estado("cursor_pagina", 0))
+        retomada = pagina > 0
+        ultimo_id = (self.store.obter_estado("cursor_ultimo_id") or None) if retomada else None
+        resumo = {"paginas": 0, "paginas_alteradas": 0, "inseridos": 0, "atualizados": 0, "removidos": 0}
+        while True:
+            response = self.waha.get("/api/contacts/all", params={
+                "session": self.waha.session_id,
+                "limit": self.tamanho_pagina,
+                "offset": pagina * self.tamanho_pagina,
+                "sortBy": "id",
+                "sortOrder": "asc",
+            })
+            response.raise_for_status()
+            recebidos = response.json() or []
+            contatos = [c for c in map(normalizar_contato_waha, recebidos) if c]
+            contatos.sort(key=lambda c: c["chat_id"])
+            checksum = hashlib.sha1(
+                json.dumps([(c["chat_id"], c["hash"]) for c in contatos]).encode("utf-8")
+            ).hexdigest()
+            resumo["paginas"] += 1
+            ultimo_da_pagina = contatos[-1]["chat_id"] if contatos else ultimo_id
+            ultima = len(recebidos) < self.tamanho_pagina
+
+            if checksum != self.store.checksum_pagina(pagina):
+                # A faixa da página vai do ID seguinte ao da página anterior até o seu último ID;
+                # a última página cobre tudo o que vem depois
+                fim = None if ultima else ultimo_da_pagina
+                inseridos, atualizados, removidos = self.store.aplicar_pagina(
+                    pagina, checksum, contatos, ultimo_id, fim
+                )
+                resumo["paginas_alteradas"] += 1
+                resumo["inseridos"] += inseridos
+                resumo["atualizados"] += atualizados
+                resumo["removidos"] += removidos
+
+            ultimo_id = ultimo_da_pagina
+            if ultima or self._parar.is_set():
+                break
+            pagina += 1
+            self.store.definir_estado("cursor_pagina", pagina)
+            self.store.definir_estado("cursor_ultimo_id", ultimo_id or "")
+
+        if ultima:
+            resumo["removidos"] += self.store.finalizar_sincronizacao(pagina, ultimo_id)
+            self.store.definir_estado("cursor_pagina", 0)
+            self.store.definir_estado("ultima_sincronizacao", time.strftime("%Y-%m-%dT%H:%M:%S"))
+        resumo["total"] = self.store.total()
+        resumo["duracao_s"] = round(time.monotonic() - inicio_execucao, 3)
+        logger.info("Sincronização de contatos: %s", resumo)
+        return resumo
+
+    def iniciar(self):
+        """
+        Inicia a sincronização periódica em segundo plano (se `intervalo` > 0)
+        """
+        if self.intervalo <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._executar, name="sincronizador-contatos", daemon=True)
+        self._thread.start()
+
+    def parar(self, aguardar=0):
+        """
+        Interrompe a thread em segundo plano, esperando até `aguardar` segundos que ela termine
+        """
+        self._parar.set()
+        if aguardar and self._thread is not None:
+            self._thread.join(aguardar)
+
+    def _executar(self):
+        while not self._parar.is_set():
+            try:
+                with com_prioridade("lote"):
+                    self.sincronizar()
+            except Exception as e:
+                logger.error("Erro na sincronização de contatos: %s", e)
+            self._parar.wait(self.intervalo)
@@ -0,0 +1,21 @@
+"""
+Envio de uma mesma mensagem para vários destinos com concorrência limitada
+"""
+
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+def enviar_em_lote(destinos, enviar, concorrencia=5):
+    """
+    Chama `enviar(destino)` para cada destino (sem repetições), com no máximo
+    `concorrencia` envios simultâneos
+
+    Cada envio roda com uma cópia do contexto de quem chamou (prioridade, sessão MCP).
+    Retorna a lista de pares (destino, resultado) na ordem dos destinos
+    """
+    unicos = list(dict.fromkeys(destinos))
+    if not unicos:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, min(concorrencia, len(unicos)))) as executor:
+        futuros = [executor.submit(contextvars.copy_context().run, enviar, destino) for destino in unicos]
+        return [(destino, futuro.result()) for destino, futuro in zip(unicos, futuros)]
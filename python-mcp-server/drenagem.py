@@ -0,0 +1,71 @@
+"""
+Encerramento gracioso: recusa novas chamadas de ferramentas e aguarda as em andamento
+
+Durante um deploy ou reinício, uma chamada de envio interrompida no meio deixa a
+dúvida se a mensagem saiu, e a nova tentativa pode duplicá-la. Ao receber o sinal
+de encerramento o servidor para de aceitar chamadas novas e espera as em andamento
+terminarem (até um prazo) antes de fechar as conexões.
+"""
+
+import asyncio
+import time
+from contextlib import contextmanager
+
+class ServidorEncerrando(RuntimeError):
+    """
+    Chamada recusada porque o servidor está encerrando
+    """
+
+class ControleDrenagem:
+    """
+    Conta as chamadas em andamento e coordena a drenagem no encerramento
+
+    Usado apenas a partir do loop de eventos.
+    """
+
+    def __init__(self):
+        self.aceitando = True
+        self._em_andamento = 0
+        # Criado apenas na drenagem, já dentro do loop de eventos
+        self._ocioso = None
+
+    @property
+    def em_andamento(self):
+        return self._em_andamento
+
+    @contextmanager
+    def chamada(self):
+        """
+        Registra uma chamada em andamento; levanta ServidorEncerrando durante a drenagem
+        """
+        if not self.aceitando:
+            raise ServidorEncerrando("Servidor em encerramento; tente novamente em instantes")
+        self._em_andamento += 1
+        try:
+            yield
+        finally:
+            self._em_andamento -= 1
+            if self._em_andamento == 0 and self._ocioso is not None:
+                self._ocioso.set()
+
+    async def drenar(self, prazo):
+        """
+        Para de aceitar chamadas e aguarda as em andamento por até `prazo` segundos
+
+        Retorna a duração e quantas chamadas terminaram ou ficaram pendentes
+        """
+        self.aceitando = False
+        inicio = time.monotonic()
+        pendentes_no_inicio = self._em_andamento
+        self._ocioso = asyncio.Event()
+        if self._em_andamento == 0:
+            self._ocioso.set()
+        try:
+            await asyncio.wait_for(self._ocioso.wait(), timeout=prazo)
+        except asyncio.TimeoutError:
+            pass
+        return {
+            "duracao_s": round(time.monotonic() - inicio, 3),
+            "concluidas": pendentes_no_inicio - self._em_andamento,
+            "interrompidas": self._em_andamento,
+        }
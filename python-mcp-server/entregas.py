@@ -0,0 +1,224 @@
+"""
+Registro de entrega das mensagens enviadas (confirmações de recebimento/leitura)
+
+Cada mensagem enviada é gravada em SQLite com o seu ID, chat e campanha opcional.
+O estado de entrega (ack) é atualizado pelos eventos `message.ack` do webhook do Waha
+ou, como alternativa, por uma consulta periódica em lote que lê as mensagens
+recentes de cada chat com envios pendentes (uma requisição por chat, não por mensagem).
+As consultas por ID, chat e campanha usam índices (B-tree), com custo O(log n).
+"""
+
+import logging
+import sqlite3
+import threading
+import time
+from prioridades import com_prioridade
+
+logger = logging.getLogger(__name__)
+
+# Valores de ack do Waha
+ACK_ERRO = -1
+ACK_PENDENTE = 0
+ACK_SERVIDOR = 1
+ACK_ENTREGUE = 2
+ACK_LIDA = 3
+ACK_REPRODUZIDA = 4
+
+NOMES_ACK = {
+    ACK_ERRO: "ERROR",
+    ACK_PENDENTE: "PENDING",
+    ACK_SERVIDOR: "SERVER",
+    ACK_ENTREGUE: "DEVICE",
+    ACK_LIDA: "READ",
+    ACK_REPRODUZIDA: "PLAYED",
+}
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS mensagens (
+    id TEXT PRIMARY KEY,
+    chat_id TEXT NOT NULL,
+    campanha TEXT,
+    ack INTEGER NOT NULL,
+    enviado_em REAL NOT NULL,
+    atualizado_em REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_mensagens_chat ON mensagens(chat_id, enviado_em);
+CREATE INDEX IF NOT EXISTS idx_mensagens_campanha ON mensagens(campanha, ack);
+CREATE INDEX IF NOT EXISTS idx_mensagens_ack ON mensagens(ack, enviado_em);
+"""
+
+def _linha_para_dict(linha):
+    id_mensagem, chat_id, campanha, ack, enviado_em, atualizado_em = linha
+    return {
+        "id": id_mensagem,
+        "chat": chat_id,
+        "campanha": campanha,
+        "ack": NOMES_ACK.get(ack, str(ack)),
+        "enviado_em": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(enviado_em)),
+        "atualizado_em": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(atualizado_em)),
+    }
+
+class EntregasStore:
+    """
+    Mensagens enviadas e o seu estado de entrega, persistidos em SQLite
+    """
+
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self._lock = threading.Lock()
+        self._conexao = sqlite3.connect(caminho, check_same_thread=False)
+        self._conexao.execute("PRAGMA journal_mode=WAL")
+        self._conexao.execute("PRAGMA synchronous=NORMAL")
+        self._conexao.executescript(ESQUEMA)
+
+    def registrar(self, id_mensagem, chat_id, campanha=None):
+        if not id_mensagem:
+            return
+        agora = time.time()
+        with self._lock, self._conexao:
+            self._conexao.execute(
+                "INSERT OR IGNORE INTO mensagens (id, chat_id, campanha, ack, enviado_em, atualizado_em) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (id_mensagem, chat_id, campanha, ACK_SERVIDOR, agora, agora)
+            )
+
+    def atualizar_acks(self, acks):
+        """
+        Aplica uma lista de pares (id, ack); o ack só avança, exceto quando vira erro
+
+        Retorna quantas mensagens mudaram de estado
+        """
+        agora = time.time()
+        with self._lock, self._conexao:
+            antes = self._conexao.total_changes
+            self._conexao.executemany(
+                "UPDATE mensagens SET ack = ?, atualizado_em = ? WHERE id = ? AND (ack < ? OR ? = -1) AND ack != ?",
+                [(ack, agora, id_mensagem, ack, ack, ack) for id_mensagem, ack in acks]
+            )
+            return self._conexao.total_changes - antes
+
+    def consultar(self, id_mensagem):
+        with self._lock:
+            linha = self._conexao.execute(
+                "SELECT id, chat_id, campanha, ack, enviado_em, atualizado_em FROM mensagens WHERE id = ?",
+                (id_mensagem,)
+            ).fetchone()
+        return _linha_para_dict(linha) if linha else None
+
+    def por_chat(self, chat_id, limite=20):
+        """
+        Mensagens mais recentes enviadas ao chat
+        """
+        with self._lock:
+            linhas = self._conexao.execute(
+                "SELECT id, chat_id, campanha, ack, enviado_em, atualizado_em FROM mensagens "
+                "WHERE chat_id = ? ORDER BY enviado_em DESC LIMIT ?",
+                (chat_id, limite)
+            ).fetchall()
+        return [_linha_para_dict(linha) for linha in linhas]
+
+    def resumo_campanha(self, campanha):
+        """
+        Contagem por estado e taxas de entrega e leitura de uma campanha
+        """
+        with self._lock:
+            contagens = dict(self._conexao.execute(
+                "SELECT ack, COUNT(*) FROM mensagens WHERE campanha = ? GROUP BY ack", (campanha,)
+            ).fetchall())
+        total = sum(contagens.values())
+        entregues = sum(n for ack, n in contagens.items() if ack >= ACK_ENTREGUE)
+        lidas = sum(n for ack, n in contagens.items() if ack >= ACK_LIDA)
+        return {
+            "campanha": campanha,
+            "total": total,
+            "por_estado": {NOMES_ACK.get(ack, str(ack)): n for ack, n in sorted(contagens.items())},
+            "taxa_entrega": round(entregues / total, 4) if total else None,
+            "taxa_leitura": round(lidas / total, 4) if total else None,
+        }
+
+    def chats_pendentes(self, desde, limite=50):
+        """
+        Chats com mensagens ainda não lidas enviadas depois de `desde`, e quantas são
+        """
+        with self._lock:
+            return self._conexao.execute(
+                "SELECT chat_id, COUNT(*) FROM mensagens WHERE ack BETWEEN ? AND ? AND enviado_em >= ? "
+                "GROUP BY chat_id ORDER BY MIN(enviado_em) LIMIT ?",
+                (ACK_PENDENTE, ACK_ENTREGUE, desde, limite)
+            ).fetchall()
+
+    def fechar(self):
+        with self._lock:
+            self._conexao.close()
+
+def processar_evento_ack(store, evento):
+    """
+    Atualiza o store a partir de um evento `message.ack` do webhook; retorna True se era um ack
+    """
+    if evento.get("event") != "message.ack":
+        return False
+    payload = evento.get("payload") or {}
+    id_mensagem = payload.get("id")
+    if isinstance(id_mensagem, dict):
+        id_mensagem = id_mensagem.get("_serialized")
+    ack = payload.get("ack")
+    if id_mensagem and isinstance(ack, int):
+        store.atualizar_acks([(id_mensagem, ack)])
+    return True
+
+class ConsultorEntregas:
+    """
+    Consulta periódica dos acks pendentes, para quando o webhook não está configurado
+    """
+
+    def __init__(self, waha, store, intervalo=60, janela=6 * 3600):
+        self.waha = waha
+        self.store = store
+        self.intervalo = intervalo
+        self.janela = janela
+        self._parar = threading.Event()
+        self._thread = None
+
+    def consultar(self):
+        """
+        Lê as mensagens recentes de cada chat pendente e atualiza os acks; retorna quantas mudaram
+        """
+        alteradas = 0
+        for chat_id, pendentes in self.store.chats_pendentes(time.time() - self.janela):
+            response = self.waha.get(
+                self.waha.caminho_sessao("chats", chat_id, "messages"),
+                params={"limit": min(100, pendentes + 20), "downloadMedia": "false", "filter.fromMe": "true"}
+            )
+            if response.status_code != 200:
+                continue
+            acks = []
+            for mensagem in response.json() or []:
+                id_mensagem = mensagem.get("id")
+                if isinstance(id_mensagem, dict):
+                    id_mensagem = id_mensagem.get("_serialized")
+                if id_mensagem and isinstance(mensagem.get("ack"), int):
+                    acks.append((id_mensagem, mensagem["ack"]))
+            alteradas += self.store.atualizar_acks(acks)
+        return alteradas
+
+    def iniciar(self):
+        if self.intervalo <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._executar, name="consultor-entregas", daemon=True)
+        self._thread.start()
+
+    def parar(self, aguardar=0):
+        """
+        Interrompe a thread em segundo plano, esperando até `aguardar` segundos que ela termine
+        """
+        self._parar.set()
+        if aguardar and self._thread is not None:
+            self._thread.join(aguardar)
+
+    def _executar(self):
+        while not self._parar.wait(self.intervalo):
+            try:
+                with com_prioridade("lote"):
+                    self.consultar()
+            except Exception as e:
+                logger.error("Erro ao consultar confirmações de entrega: %s", e)
@@ -0,0 +1,62 @@
+"""
+Divisão de mensagens longas em partes enviadas em sequência
+
+Textos longos (comuns quando gerados por um modelo) falham ou chegam truncados num
+único /api/sendText. O texto é dividido em partes de até `limite` caracteres,
+preferindo cortar entre parágrafos, depois entre linhas, depois no fim de uma frase
+e só em último caso entre palavras (ou no meio de uma palavra enorme).
+"""
+
+import re
+
+# Fim de frase: pontuação final, opcionalmente seguida de aspas ou parênteses, e um espaço
+FIM_DE_FRASE = re.compile(r"[.!?…][\"'”’)\]»]*\s")
+
+def _ponto_de_corte(texto, limite):
+    # Cortes muito no início gerariam partes minúsculas; abaixo disso tenta-se o separador seguinte
+    minimo = limite // 3
+    for separador in ("\n\n", "\n"):
+        posicao = texto.rfind(separador, minimo, limite)
+        if posicao > 0:
+            return posicao
+    fins = [m.end() for m in FIM_DE_FRASE.finditer(texto, minimo, limite + 1)]
+    if fins:
+        return fins[-1]
+    posicao = texto.rfind(" ", minimo, limite + 1)
+    if posicao > 0:
+        return posicao
+    return limite
+
+def dividir_mensagem(texto, limite):
+    """
+    Divide o texto em partes de até `limite` caracteres, em limites de parágrafo ou frase
+
+    Com `limite` <= 0 ou texto curto, retorna o texto inteiro como parte única
+    """
+    if limite <= 0 or len(texto) <= limite:
+        return [texto]
+    partes = []
+    restante = texto
+    while len(restante) > limite:
+        corte = _ponto_de_corte(restante, limite)
+        parte = restante[:corte].rstrip()
+        if parte:
+            partes.append(parte)
+        restante = restante[corte:].lstrip()
+    if restante:
+        partes.append(restante)
+    return partes
+
+def enviar_partes(partes, enviar):
+    """
+    Envia as partes em ordem, cada uma assim que a anterior é aceita
+
+    `enviar(parte)` retorna True quando a parte foi aceita. Envios simultâneos não
+    garantem a ordem de chegada no WhatsApp, então a parte seguinte sai logo após a
+    confirmação da anterior, sem espera adicional. Para na primeira falha, já que as
+    partes seguintes perderiam o contexto; retorna quantas partes foram aceitas.
+    """
+    for indice, parte in enumerate(partes):
+        if not enviar(parte):
+            return indice
+    return len(partes)
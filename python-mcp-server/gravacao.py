@@ -0,0 +1,288 @@
+"""
+Gravação e reprodução do tráfego com o Waha
+
+No modo gravação, cada requisição ao Waha e a sua resposta (status, corpo e tempo de
+resposta, ou o erro de conexão) são gravadas numa fita em JSON lines, compactada
+com gzip quando o arquivo termina em .gz. No modo reprodução, as respostas da fita
+são servidas localmente, com a latência original dividida pela velocidade
+(0 = sem espera), sem precisar de uma sessão do WhatsApp.
+
+O corpo da resposta é gravado à medida que quem fez a requisição o lê, sem forçar a
+leitura inteira (downloads com stream=True continuam em blocos). Enquanto é lido, ele
+fica num arquivo temporário (em memória até `LIMITE_CORPO_MEMORIA` bytes) e é copiado
+para a fita em blocos, então corpos grandes, como mídias, não passam inteiros pela
+memória. Corpos que não são UTF-8 válido são gravados em base64 (campo "c") e
+reproduzidos byte a byte.
+
+Ambos são adaptadores de transporte do requests montados na sessão do WahaAPI,
+então o restante do caminho (despachante, prioridades, limites de taxa) é o real.
+"""
+
+import base64
+import codecs
+import gzip
+import json
+import tempfile
+import threading
+import time
+import requests
+from datetime import timedelta
+from http import HTTPStatus
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from urllib.parse import urlsplit
+
+VERSAO_FITA = 1
+
+# Corpos maiores passam por um arquivo temporário em disco durante a gravação
+LIMITE_CORPO_MEMORIA = 1024 * 1024
+# Bloco da cópia do corpo para a fita (múltiplo de 3, para o base64 não ter preenchimento no meio)
+BLOCO_CORPO = 48 * 1024
+
+def _abrir(caminho, modo):
+    if caminho.endswith(".gz"):
+        return gzip.open(caminho, modo + "t", encoding="utf-8")
+    return open(caminho, modo, encoding="utf-8")
+
+def _rota(url):
+    """
+    Caminho e query da URL, sem o endereço do Waha, para a fita valer com qualquer WAHA_API_URL
+    """
+    partes = urlsplit(url)
+    return f"{partes.path}?{partes.query}" if partes.query else partes.path
+
+def _frase_status(codigo):
+    try:
+        return HTTPStatus(codigo).phrase
+    except ValueError:
+        return ""
+
+def _corpo(corpo):
+    if corpo is None:
+        return None
+    if isinstance(corpo, bytes):
+        return corpo.decode("utf-8", errors="replace")
+    return str(corpo)
+
+def _ler_corpo(registro):
+    if registro.get("c") == "base64":
+        return base64.b64decode(registro["r"])
+    return registro["r"].encode("utf-8")
+
+class _CorpoGravado:
+    """
+    Envolve o `raw` de uma resposta: repassa o corpo a quem o lê, guardando uma cópia num
+    arquivo temporário, e grava o registro quando a leitura termina ou a resposta é fechada
+    """
+
+    def __init__(self, raw, registro, gravar):
+        self._raw = raw
+        self._registro = registro
+        self._gravar = gravar
+        self._corpo = tempfile.SpooledTemporaryFile(max_size=LIMITE_CORPO_MEMORIA)
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self._texto = True
+
+    def __getattr__(self, nome):
+        return getattr(self._raw, nome)
+
+    def _acumular(self, bloco):
+        if self._registro is None:
+            return
+        self._corpo.write(bloco)
+        if self._texto:
+            try:
+                self._utf8.decode(bloco)
+            except UnicodeDecodeError:
+                self._texto = False
+
+    def stream(self, *args, **kwargs):
+        for bloco in self._raw.stream(*args, **kwargs):
+            self._acumular(bloco)
+            yield bloco
+        self._finalizar()
+
+    def read(self, amt=None, *args, **kwargs):
+        bloco = self._raw.read(amt, *args, **kwargs)
+        self._acumular(bloco)
+        if not bloco or amt is None:
+            self._finalizar()
+        return bloco
+
+    def close(self):
+        self._finalizar(completo=False)
+        self._raw.close()
+
+    def release_conn(self):
+        self._finalizar(completo=False)
+        self._raw.release_conn()
+
+    def _finalizar(self, completo=True):
+        registro, self._registro = self._registro, None
+        if registro is None:
+            return
+        if not completo and not self._raw.closed:
+            # Fechada antes do fim do corpo: grava o que foi lido
+            registro["incompleto"] = True
+        if self._texto:
+            try:
+                self._utf8.decode(b"", final=True)
+            except UnicodeDecodeError:
+                self._texto = False
+        with self._corpo:
+            self._gravar(registro, self._corpo, self._texto)
+
+class AdaptadorGravacao(HTTPAdapter):
+    """
+    Adaptador HTTP normal que também grava cada requisição e resposta na fita
+    """
+
+    def __init__(self, caminho, **kwargs):
+        super().__init__(**kwargs)
+        self.caminho = caminho
+        self._lock = threading.Lock()
+        self._arquivo = _abrir(caminho, "w")
+        self._gravar({"fita": VERSAO_FITA, "gravada_em": time.strftime("%Y-%m-%dT%H:%M:%S")})
+
+    def _gravar(self, registro, corpo=None, texto=True):
+        """
+        Grava o registro numa linha; `corpo` (arquivo binário) vira o campo "r", copiado em blocos
+        """
+        linha = json.dumps(registro, ensure_ascii=False, separators=(",", ":"))
+        with self._lock:
+            if self._arquivo is None:
+                return
+            if corpo is None:
+                self._arquivo.write(linha + "\n")
+            else:
+                if not texto:
+                    linha = linha[:-1] + ',"c":"base64"}'
+                self._arquivo.write(linha[:-1] + ',"r":"')
+                self._copiar_corpo(corpo, texto)
+                self._arquivo.write('"}\n')
+            self._arquivo.flush()
+
+    def _copiar_corpo(self, corpo, texto):
+        corpo.seek(0)
+        utf8 = codecs.getincrementaldecoder("utf-8")()
+        while True:
+            bloco = corpo.read(BLOCO_CORPO)
+            if texto:
+                # Escapa o trecho como uma string JSON, sem as aspas
+                self._arquivo.write(json.dumps(utf8.decode(bloco, final=not bloco), ensure_ascii=False)[1:-1])
+            else:
+                self._arquivo.write(base64.b64encode(bloco).decode("ascii"))
+            if not bloco:
+                break
+
+    def send(self, request, **kwargs):
+        registro = {"m": request.method, "u": _rota(request.url), "b": _corpo(request.body)}
+        inicio = time.perf_counter()
+        try:
+            response = super().send(request, **kwargs)
+        except requests.RequestException as e:
+            registro.update(d=round((time.perf_counter() - inicio) * 1000, 1), e=type(e).__name__, r=str(e))
+            self._gravar(registro)
+            raise
+        registro.update(
+            d=round((time.perf_counter() - inicio) * 1000, 1),
+            s=response.status_code,
+            t=response.headers.get("Content-Type"),
+        )
+        # O corpo é gravado conforme for lido (ver _CorpoGravado)
+        response.raw = _CorpoGravado(response.raw, registro, self._gravar)
+        return response
+
+    def close(self):
+        super().close()
+        with self._lock:
+            if self._arquivo is not None:
+                self._arquivo.close()
+                self._arquivo = None
+
+class AdaptadorReproducao(BaseAdapter):
+    """
+    Serve as respostas gravadas na fita, sem acessar a rede
+
+    Cada requisição é associada às gravações com o mesmo método, caminho e corpo; na
+    falta delas, às com o mesmo método e caminho (envios com outro texto, por exemplo).
+    As gravações de cada chave são servidas na ordem em que foram feitas, recomeçando
+    do início quando se esgotam.
+    """
+
+    def __init__(self, caminho, velocidade=1.0):
+        super().__init__()
+        self.caminho = caminho
+        self.velocidade = velocidade
+        self._lock = threading.Lock()
+        self._exatas = {}
+        self._por_rota = {}
+        self._posicoes = {}
+        for registro in self._ler(caminho):
+            self._exatas.setdefault((registro["m"], registro["u"], registro.get("b")), []).append(registro)
+            self._por_rota.setdefault((registro["m"], registro["u"]), []).append(registro)
+
+    @staticmethod
+    def _ler(caminho):
+        registros = []
+        with _abrir(caminho, "r") as arquivo:
+            try:
+                for linha in arquivo:
+                    registro = json.loads(linha)
+                    if "m" in registro:
+                        registros.append(registro)
+            except (EOFError, json.JSONDecodeError):
+                # Fita de um processo interrompido: aproveita os registros completos
+                pass
+        return registros
+
+    def _proximo(self, chave, registros):
+        with self._lock:
+            posicao = self._posicoes.get(chave, 0)
+            self._posicoes[chave] = posicao + 1
+        return registros[posicao % len(registros)]
+
+    def send(self, request, **kwargs):
+        rota = _rota(request.url)
+        chave = (request.method, rota, _corpo(request.body))
+        if chave in self._exatas:
+            registro = self._proximo(chave, self._exatas[chave])
+        elif chave[:2] in self._por_rota:
+            registro = self._proximo(chave[:2], self._por_rota[chave[:2]])
+        else:
+            raise requests.ConnectionError(
+                f"Requisição não encontrada na gravação {self.caminho}: {request.method} {rota}",
+                request=request
+            )
+        if self.velocidade > 0:
+            time.sleep(registro["d"] / 1000 / self.velocidade)
+        if "e" in registro:
+            excecao = getattr(requests.exceptions, registro["e"], requests.ConnectionError)
+            raise excecao(registro["r"], request=request)
+        response = requests.Response()
+        response.status_code = registro["s"]
+        response.headers = CaseInsensitiveDict({"Content-Type": registro["t"]} if registro.get("t") else {})
+        response._content = _ler_corpo(registro)
+        # Sem raw: iter_content serve o corpo acima, também com stream=True
+        response._content_consumed = True
+        response.encoding = "utf-8"
+        response.url = request.url
+        response.request = request
+        response.reason = _frase_status(registro["s"])
+        response.elapsed = timedelta(milliseconds=registro["d"])
+        return response
+
+    def close(self):
+        pass
+
+def criar_adaptador(gravar_em=None, reproduzir_de=None, velocidade=1.0, **kwargs):
+    """
+    Adaptador para o modo configurado (WAHA_GRAVACAO ou WAHA_REPRODUCAO), ou None
+    """
+    if gravar_em and reproduzir_de:
+        raise ValueError("Use WAHA_GRAVACAO ou WAHA_REPRODUCAO, não os dois")
+    if reproduzir_de:
+        return AdaptadorReproducao(reproduzir_de, velocidade)
+    if gravar_em:
+        return AdaptadorGravacao(gravar_em, **kwargs)
+    return None
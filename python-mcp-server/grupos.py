@@ -0,0 +1,96 @@
+"""
+Metadados e participantes de grupos do WhatsApp, com cache por TTL
+
+O cache é invalidado pelos eventos de grupo enviados pelo webhook do Waha
+(group.join, group.leave, group.v2.*), além de expirar pelo TTL.
+"""
+
+from cache import CacheTTL
+
+class CacheGrupos:
+    """
+    Consulta grupos no Waha e mantém metadados e participantes em cache
+    """
+
+    def __init__(self, waha, ttl=300):
+        self.waha = waha
+        self._metadados = CacheTTL(ttl)
+        self._participantes = CacheTTL(ttl)
+
+    def metadados(self, grupo_id):
+        """
+        Retorna id, nome e quantidade de participantes do grupo
+        """
+        return self._metadados.obter_ou_carregar(grupo_id, lambda: self._carregar_metadados(grupo_id))
+
+    def participantes(self, grupo_id):
+        """
+        Retorna a lista de chatIds dos participantes do grupo
+        """
+        return self._participantes.obter_ou_carregar(grupo_id, lambda: self._carregar_participantes(grupo_id))
+
+    def invalidar(self, grupo_id=None):
+        self._metadados.invalidar(grupo_id)
+        self._participantes.invalidar(grupo_id)
+
+    def processar_evento(self, evento):
+        """
+        Invalida o cache conforme um evento de webhook do Waha
+
+        Retorna True quando o evento era de grupo
+        """
+        nome = evento.get("event", "")
+        if not nome.startswith("group."):
+            return False
+        grupo_id = _extrair_grupo_id(evento.get("payload") or {})
+        # Sem o ID do grupo no evento, invalidar tudo é a opção segura
+        self.invalidar(grupo_id)
+        return True
+
+    def _carregar_metadados(self, grupo_id):
+        response = self.waha.get(self.waha.caminho_sessao("groups", grupo_id))
+        response.raise_for_status()
+        dados = response.json() or {}
+        participantes = dados.get("participants")
+        if participantes is None:
+            participantes = (dados.get("groupMetadata") or {}).get("participants", [])
+        if participantes:
+            self._participantes.definir(grupo_id, _ids_participantes(participantes))
+        return {
+            "id": grupo_id,
+            "nome": dados.get("subject") or dados.get("name") or (dados.get("groupMetadata") or {}).get("subject"),
+            "participantes": len(participantes)
+        }
+
+    def _carregar_participantes(self, grupo_id):
+        response = self.waha.get(self.waha.caminho_sessao("groups", grupo_id, "participants"))
+        response.raise_for_status()
+        return _ids_participantes(response.json() or [])
+
+def _ids_participantes(participantes):
+    """
+    Extrai os chatIds da lista de participantes (o formato varia conforme o engine)
+    """
+    ids = []
+    for participante in participantes:
+        pid = participante.get("id") if isinstance(participante, dict) else participante
+        if isinstance(pid, dict):
+            pid = pid.get("_serialized") or pid.get("user")
+        if isinstance(pid, str) and pid.endswith("@s.whatsapp.net"):
+            # NOWEB e GOWS usam o JID do WhatsApp (com o dispositivo, às vezes): 5511999999999:12@s.whatsapp.net
+            pid = pid[:-len("@s.whatsapp.net")].split(":", 1)[0] + "@c.us"
+        if pid:
+            ids.append(pid)
+    return ids
+
+def _extrair_grupo_id(payload):
+    for chave in ("id", "chatId", "groupId"):
+        valor = payload.get(chave)
+        if isinstance(valor, dict):
+            valor = valor.get("_serialized") or valor.get("id")
+        if isinstance(valor, str) and valor.endswith("@g.us"):
+            return valor
+    grupo = payload.get("group")
+    if isinstance(grupo, dict):
+        return _extrair_grupo_id(grupo)
+    return None
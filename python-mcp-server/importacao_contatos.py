@@ -0,0 +1,206 @@
+"""
+Importação e exportação de contatos em CSV ou JSON lines
+
+Os arquivos são lidos e gravados em fluxo, registro a registro, com memória constante:
+cada registro é validado e normalizado ao passar, e os válidos são gravados no
+ContatosStore em lotes, um lote por transação. A gravação de um lote acontece numa
+thread à parte enquanto o próximo é lido (no máximo dois lotes em memória). A exportação percorre o banco em lotes
+ordenados pelo chat_id, sem carregar todos os contatos.
+
+Os arquivos ficam num diretório configurado (CONTATOS_ARQUIVOS_DIR); caminhos fora
+dele são recusados. Arquivos terminados em .gz são lidos e gravados com gzip.
+"""
+
+import csv
+import gzip
+import hashlib
+import json
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+FORMATOS = {".csv": "csv", ".jsonl": "jsonl", ".ndjson": "jsonl", ".json": "jsonl"}
+
+# Nomes de coluna (CSV) ou chave (JSON) aceitos para cada campo
+COLUNAS_NUMERO = ("numero", "número", "telefone", "celular", "whatsapp", "phone", "number", "chat_id")
+COLUNAS_NOME = ("nome", "name", "contato")
+
+NOME_TAMANHO_MAXIMO = 256
+MAXIMO_ERROS_LISTADOS = 20
+PADRAO_NAO_DIGITOS = re.compile(r"[\s()+.-]")
+
+def resolver_arquivo(diretorio, arquivo):
+    """
+    Caminho de `arquivo` dentro de `diretorio`; levanta ValueError para caminhos fora dele
+    """
+    raiz = os.path.realpath(diretorio)
+    caminho = os.path.realpath(os.path.join(raiz, arquivo))
+    if os.path.commonpath([raiz, caminho]) != raiz or caminho == raiz:
+        raise ValueError(f"Arquivo inválido: '{arquivo}'. Use um caminho dentro do diretório de arquivos de contatos")
+    return caminho
+
+def detectar_formato(caminho, formato=None):
+    if formato:
+        if formato not in ("csv", "jsonl"):
+            raise ValueError(f"Formato inválido: '{formato}'. Use csv ou jsonl")
+        return formato
+    raiz = caminho[:-len(".gz")] if caminho.endswith(".gz") else caminho
+    formato = FORMATOS.get(os.path.splitext(raiz)[1].lower())
+    if not formato:
+        raise ValueError(f"Não foi possível deduzir o formato de '{os.path.basename(caminho)}'. Informe csv ou jsonl")
+    return formato
+
+def _abrir(caminho, modo, compactado=None):
+    if caminho.endswith(".gz") if compactado is None else compactado:
+        return gzip.open(caminho, modo + "t", encoding="utf-8", newline="")
+    return open(caminho, modo, encoding="utf-8", newline="")
+
+def _campo(registro, nomes):
+    for nome in nomes:
+        valor = registro.get(nome)
+        if valor not in (None, ""):
+            return valor
+    return None
+
+def normalizar_contato(numero, nome=None):
+    """
+    Valida número e nome de um registro importado e os converte no formato do ContatosStore
+
+    Aceita números com DDI em qualquer formatação (+55 (11) 99999-9999) ou chatIds …@c.us;
+    levanta ValueError com o motivo quando o registro é inválido
+    """
+    if numero in (None, ""):
+        raise ValueError("Número ausente")
+    numero = str(numero)
+    if not numero.isdigit():
+        if numero.endswith("@c.us"):
+            numero = numero[:-len("@c.us")]
+        numero = PADRAO_NAO_DIGITOS.sub("", numero)
+    if not numero.isdigit() or not 10 <= len(numero) <= 15:
+        raise ValueError(f"Número inválido: '{numero}'. Use o número completo com DDI (10 a 15 dígitos)")
+    nome = " ".join(str(nome).split())[:NOME_TAMANHO_MAXIMO] if nome else None
+    hash_contato = hashlib.sha1(f"{numero}\x00{nome or ''}".encode("utf-8")).hexdigest()
+    return {"chat_id": f"{numero}@c.us", "numero": numero, "nome": nome or None, "hash": hash_contato}
+
+def _ler_csv(arquivo):
+    """
+    (linha, número, nome) de cada linha do CSV; as colunas são localizadas pelo cabeçalho
+    """
+    cabecalho = arquivo.readline()
+    try:
+        dialeto = csv.Sniffer().sniff(cabecalho, delimiters=",;\t")
+    except csv.Error:
+        dialeto = csv.excel
+    colunas = [c.strip().lower() for c in next(csv.reader([cabecalho], dialeto), [])]
+    indice_numero = next((colunas.index(c) for c in COLUNAS_NUMERO if c in colunas), None)
+    if indice_numero is None:
+        raise ValueError(f"Coluna de número não encontrada no cabeçalho. Use uma de: {', '.join(COLUNAS_NUMERO)}")
+    indice_nome = next((colunas.index(c) for c in COLUNAS_NOME if c in colunas), None)
+    leitor = csv.reader(arquivo, dialeto)
+    try:
+        for valores in leitor:
+            if not valores:
+                continue
+            numero = valores[indice_numero] if indice_numero < len(valores) else None
+            nome = valores[indice_nome] if indice_nome is not None and indice_nome < len(valores) else None
+            yield leitor.line_num + 1, numero, nome
+    except csv.Error as e:
+        raise ValueError(f"CSV inválido na linha {leitor.line_num + 1}: {e}")
+
+def _ler_jsonl(arquivo):
+    """
+    (linha, número, nome) de cada objeto; linhas inválidas trazem o ValueError no lugar do número
+    """
+    for linha_numero, linha in enumerate(arquivo, 1):
+        if not linha.strip():
+            continue
+        try:
+            registro = json.loads(linha)
+        except json.JSONDecodeError as e:
+            yield linha_numero, ValueError(f"JSON inválido: {e.msg}"), None
+            continue
+        if not isinstance(registro, dict):
+            yield linha_numero, ValueError("Registro não é um objeto"), None
+            continue
+        yield linha_numero, _campo(registro, COLUNAS_NUMERO), _campo(registro, COLUNAS_NOME)
+
+def importar_contatos(store, caminho, formato=None, tamanho_lote=5000):
+    """
+    Lê o arquivo em fluxo e grava os contatos válidos em lotes; retorna um resumo da importação
+    """
+    inicio = time.monotonic()
+    formato = detectar_formato(caminho, formato)
+    resumo = {"lidos": 0, "gravados": 0, "inalterados": 0, "invalidos": 0, "erros": []}
+    lote = []
+    pendente = None
+
+    def contabilizar():
+        quantidade, gravados = pendente.result()
+        resumo["gravados"] += gravados
+        resumo["inalterados"] += quantidade - gravados
+
+    def gravar(lote):
+        return len(lote), store.importar(lote)
+
+    with _abrir(caminho, "r") as arquivo, ThreadPoolExecutor(max_workers=1) as gravacao:
+        registros = _ler_csv(arquivo) if formato == "csv" else _ler_jsonl(arquivo)
+        for linha, numero, nome in registros:
+            resumo["lidos"] += 1
+            try:
+                if isinstance(numero, ValueError):
+                    raise numero
+                lote.append(normalizar_contato(numero, nome))
+            except ValueError as e:
+                resumo["invalidos"] += 1
+                if len(resumo["erros"]) < MAXIMO_ERROS_LISTADOS:
+                    resumo["erros"].append({"linha": linha, "erro": str(e)})
+                continue
+            if len(lote) >= tamanho_lote:
+                if pendente:
+                    contabilizar()
+                pendente, lote = gravacao.submit(gravar, lote), []
+        if pendente:
+            contabilizar()
+        if lote:
+            pendente = gravacao.submit(gravar, lote)
+            contabilizar()
+    resumo["total"] = store.total()
+    resumo["duracao_s"] = round(time.monotonic() - inicio, 3)
+    return resumo
+
+def exportar_contatos(store, caminho, formato=None, tamanho_lote=5000):
+    """
+    Grava todos os contatos do store no arquivo, em lotes; retorna a quantidade exportada
+
+    O arquivo é escrito ao lado e só substitui o destino quando completo
+    """
+    inicio = time.monotonic()
+    formato = detectar_formato(caminho, formato)
+    os.makedirs(os.path.dirname(caminho), exist_ok=True)
+    temporario = f"{caminho}.parcial"
+    exportados = 0
+    try:
+        with _abrir(temporario, "w", caminho.endswith(".gz")) as arquivo:
+            escritor = csv.writer(arquivo) if formato == "csv" else None
+            if escritor:
+                escritor.writerow(("numero", "nome", "origem"))
+            apos = None
+            while True:
+                contatos = store.listar_lote(apos, tamanho_lote)
+                if not contatos:
+                    break
+                if escritor:
+                    escritor.writerows((c["numero"], c["nome"] or "", c["origem"]) for c in contatos)
+                else:
+                    arquivo.writelines(
+                        json.dumps({"numero": c["numero"], "nome": c["nome"], "origem": c["origem"]}, ensure_ascii=False) + "\n"
+                        for c in contatos
+                    )
+                exportados += len(contatos)
+                apos = contatos[-1]["chat_id"]
+        os.replace(temporario, caminho)
+    finally:
+        if os.path.exists(temporario):
+            os.remove(temporario)
+    return {"exportados": exportados, "formato": formato, "duracao_s": round(time.monotonic() - inicio, 3)}
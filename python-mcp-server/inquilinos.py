@@ -0,0 +1,343 @@
+"""
+Vários inquilinos (clientes) num único servidor SSE
+
+Cada inquilino tem a sua própria configuração do Waha (URL e sessão), pool de conexões,
+despachante com limites de concorrência e taxa, cache de grupos e bancos de contatos
+e de entregas. O inquilino de cada requisição é escolhido pelo caminho (/t/<nome>/sse)
+ou pelo token no cabeçalho Authorization e fica em `inquilino_atual` durante a
+requisição; a sessão MCP aberta pela conexão SSE herda esse contexto.
+
+As configurações vêm de um arquivo JSON lido sob demanda (relido quando muda), e cada
+inquilino só é montado na primeira requisição. Inquilinos sem requisições abertas há
+mais de `ocioso` segundos são desmontados: pool fechado, threads paradas e bancos
+fechados. Alterações na configuração de um inquilino montado valem a partir da
+próxima montagem.
+
+A escolha do inquilino e a sua montagem rodam numa thread, fora do loop de eventos, e
+a montagem de um inquilino não bloqueia as requisições dos demais. Um inquilino
+barulhento não esgota os demais: as requisições ao Waha ocupam vagas do despachante
+do próprio inquilino, e o trabalho bloqueante das ferramentas roda num número
+limitado de threads por inquilino (`limitador`), e não no limite global do anyio.
+"""
+
+import contextvars
+import hashlib
+import hmac
+import json
+import logging
+import os
+import re
+import threading
+import time
+import anyio
+from starlette.responses import JSONResponse
+from waha_api import WahaAPI
+from prioridades import Despachante, analisar_pesos
+from grupos import CacheGrupos
+from contatos_store import ContatosStore, SincronizadorContatos
+from entregas import EntregasStore, ConsultorEntregas
+from gravacao import criar_adaptador
+from concorrencia import criar_controle
+from mensagens import LeitorMensagens
+from midia import CacheMidia
+from auditoria import LogAuditoria
+from agrupamento import AgrupadorEnvios
+
+logger = logging.getLogger(__name__)
+
+INQUILINO_PADRAO = "padrao"
+PADRAO_NOME = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+PREFIXO_CAMINHO = "/t/"
+
+# Inquilino da requisição atual (e das sessões MCP abertas por ela)
+inquilino_atual = contextvars.ContextVar("inquilino_atual")
+
+def nome_inquilino_atual():
+    """
+    Nome do inquilino da requisição atual, ou None fora de uma requisição
+    """
+    inquilino = inquilino_atual.get(None)
+    return inquilino.nome if inquilino is not None else None
+
+# Configurações que, no modo com vários inquilinos, ganham um arquivo próprio por inquilino
+ARQUIVOS_POR_INQUILINO = ("contatos_db", "entregas_db", "waha_gravacao", "contatos_arquivos_dir", "midia_dir", "auditoria_dir")
+
+def caminho_por_inquilino(caminho, nome):
+    """
+    contatos.db -> contatos-<nome>.db
+    """
+    raiz, extensao = os.path.splitext(caminho)
+    if extensao == ".gz":
+        raiz, anterior = os.path.splitext(raiz)
+        extensao = anterior + extensao
+    return f"{raiz}-{nome}{extensao}"
+
+def _resumo_token(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+class Inquilino:
+    """
+    Recursos de um inquilino: cliente Waha, despachante, caches (grupos, mensagens, mídia), bancos e threads
+
+    `configuracao` usa os nomes das variáveis de ambiente em minúsculas (waha_api_url,
+    waha_session_id, waha_concorrencia...)
+    """
+
+    def __init__(self, nome, configuracao):
+        c = configuracao
+        self.nome = nome
+        self.configuracao = c
+        self.despachante = Despachante(
+            int(c["waha_concorrencia"]), float(c["waha_taxa_maxima"]), analisar_pesos(c["waha_pesos_prioridade"])
+        )
+        self.waha = WahaAPI(
+            c["waha_api_url"], c["waha_session_id"], despachante=self.despachante,
+            adaptador=criar_adaptador(c["waha_gravacao"], c["waha_reproducao"], float(c["waha_reproducao_velocidade"])),
+            controle=criar_controle(
+                self.despachante, int(c["waha_concorrencia_minima"]), int(c["waha_concorrencia_maxima"]),
+                float(c["waha_latencia_tolerancia"])
+            )
+        )
+        self.grupos = CacheGrupos(self.waha, int(c["grupos_cache_ttl"]))
+        self.mensagens = LeitorMensagens(self.waha, int(c["mensagens_cache_ttl"]))
+        self.agrupador = AgrupadorEnvios(int(c["mensagem_agrupamento_ms"]) / 1000, int(c["mensagem_tamanho_maximo"]))
+        self.midia = CacheMidia(self.waha, c["midia_dir"], int(c["midia_cache_mb"]) * 1024 * 1024)
+        self.contatos_store = ContatosStore(c["contatos_db"])
+        self.sincronizador = SincronizadorContatos(
+            self.waha, self.contatos_store, int(c["contatos_sync_pagina"]), int(c["contatos_sync_intervalo"])
+        )
+        self.entregas = EntregasStore(c["entregas_db"])
+        self.consultor_entregas = ConsultorEntregas(self.waha, self.entregas, int(c["entregas_poll_intervalo"]))
+        self.auditoria = LogAuditoria(
+            c["auditoria_dir"], int(c["auditoria_segmento_mb"]) * 1024 * 1024, int(c["auditoria_rotacao"])
+        )
+        self.requisicoes = 0
+        self.ultimo_uso = time.monotonic()
+        self._limitador = None
+
+    @property
+    def limitador(self):
+        """
+        Limite de threads para o trabalho bloqueante das ferramentas deste inquilino
+        """
+        # Criado na primeira chamada, já dentro do loop de eventos
+        if self._limitador is None:
+            self._limitador = anyio.CapacityLimiter(int(self.configuracao["mcp_inquilino_threads"]))
+        return self._limitador
+
+    def iniciar(self):
+        self.sincronizador.iniciar()
+        self.consultor_entregas.iniciar()
+        self.auditoria.iniciar()
+
+    def fechar(self):
+        self.sincronizador.parar(aguardar=5)
+        self.consultor_entregas.parar(aguardar=5)
+        self.waha.fechar()
+        self.contatos_store.fechar()
+        self.entregas.fechar()
+        self.midia.fechar()
+        self.auditoria.fechar()
+
+    def estatisticas(self):
+        return {
+            "requisicoes_abertas": self.requisicoes,
+            "ocioso_s": round(time.monotonic() - self.ultimo_uso, 1) if not self.requisicoes else 0,
+            "waha": self.despachante.estatisticas(),
+            "concorrencia": self.waha.controle.estatisticas() if self.waha.controle else None,
+            "midia": self.midia.estatisticas(),
+            "agrupamento": self.agrupador.estatisticas() if self.agrupador.ativo else None,
+        }
+
+class RegistroInquilinos:
+    """
+    Monta os inquilinos sob demanda a partir do arquivo de configuração e desmonta os ociosos
+
+    Sem arquivo (`caminho` vazio) há um único inquilino, INQUILINO_PADRAO, com as
+    configurações do ambiente, como num servidor sem inquilinos.
+    """
+
+    def __init__(self, caminho, padroes, ocioso=600):
+        self.caminho = caminho
+        self.padroes = padroes
+        self.ocioso = ocioso
+        self._lock = threading.Lock()
+        self._ativos = {}
+        self._montando = {}
+        self._configuracoes = {} if caminho else {INQUILINO_PADRAO: {}}
+        self._tokens = {}
+        self._modificado_em = None
+
+    @property
+    def varios(self):
+        return bool(self.caminho)
+
+    def _carregar_configuracoes(self):
+        # Chamado com o lock; só relê o arquivo quando ele muda
+        if not self.caminho:
+            return
+        modificado_em = os.stat(self.caminho).st_mtime
+        if modificado_em == self._modificado_em:
+            return
+        with open(self.caminho, "r", encoding="utf-8") as f:
+            configuracoes = json.load(f)
+        invalidos = [nome for nome in configuracoes if not PADRAO_NOME.match(nome)]
+        if invalidos:
+            raise ValueError(f"Nomes de inquilino inválidos em {self.caminho}: {', '.join(invalidos)}")
+        self._configuracoes = configuracoes
+        self._tokens = {
+            _resumo_token(c["token"]): nome for nome, c in configuracoes.items() if c.get("token")
+        }
+        self._modificado_em = modificado_em
+
+    def _configuracao(self, nome):
+        configuracao = {**self.padroes, **self._configuracoes[nome]}
+        if self.varios:
+            for chave in ARQUIVOS_POR_INQUILINO:
+                if configuracao.get(chave) and chave not in self._configuracoes[nome]:
+                    configuracao[chave] = caminho_por_inquilino(configuracao[chave], nome)
+        return configuracao
+
+    def entrar(self, nome):
+        """
+        Inquilino `nome` (montado se preciso) com uma requisição aberta a mais, ou None se não existe
+
+        Bloqueante (lê o arquivo de configuração e, na montagem, abre bancos e inicia threads)
+        """
+        with self._lock:
+            inquilino = self._ativos.get(nome)
+            if inquilino is not None:
+                inquilino.requisicoes += 1
+                return inquilino
+            self._carregar_configuracoes()
+            if nome not in self._configuracoes:
+                return None
+            configuracao = self._configuracao(nome)
+            montagem = self._montando.setdefault(nome, threading.Lock())
+        # A montagem acontece fora do lock geral, para não atrasar os demais inquilinos;
+        # requisições simultâneas ao mesmo inquilino esperam uma única montagem
+        with montagem:
+            with self._lock:
+                inquilino = self._ativos.get(nome)
+                if inquilino is not None:
+                    inquilino.requisicoes += 1
+                    return inquilino
+            inquilino = Inquilino(nome, configuracao)
+            inquilino.iniciar()
+            with self._lock:
+                self._ativos[nome] = inquilino
+                inquilino.requisicoes += 1
+                if self._montando.get(nome) is montagem:
+                    del self._montando[nome]
+        logger.info("Inquilino %s carregado", nome)
+        return inquilino
+
+    def sair(self, inquilino):
+        with self._lock:
+            inquilino.requisicoes -= 1
+            inquilino.ultimo_uso = time.monotonic()
+
+    def nome_por_token(self, token):
+        with self._lock:
+            self._carregar_configuracoes()
+            return self._tokens.get(_resumo_token(token))
+
+    def token_aceito(self, nome, token):
+        """
+        Inquilinos sem token configurado aceitam qualquer requisição pelo caminho
+        """
+        with self._lock:
+            self._carregar_configuracoes()
+            esperado = (self._configuracoes.get(nome) or {}).get("token")
+        return not esperado or hmac.compare_digest(_resumo_token(esperado), _resumo_token(token or ""))
+
+    def despejar_ociosos(self):
+        """
+        Desmonta os inquilinos sem requisições abertas há mais de `ocioso` segundos
+        """
+        limite = time.monotonic() - self.ocioso
+        with self._lock:
+            ociosos = [i for i in self._ativos.values() if i.requisicoes == 0 and i.ultimo_uso < limite]
+            for inquilino in ociosos:
+                del self._ativos[inquilino.nome]
+        for inquilino in ociosos:
+            inquilino.fechar()
+            logger.info("Inquilino %s descarregado por inatividade", inquilino.nome)
+        return len(ociosos)
+
+    def fechar_todos(self):
+        with self._lock:
+            ativos = list(self._ativos.values())
+            self._ativos.clear()
+        for inquilino in ativos:
+            inquilino.fechar()
+
+    def estatisticas(self):
+        with self._lock:
+            return {nome: inquilino.estatisticas() for nome, inquilino in self._ativos.items()}
+
+def _token_bearer(scope):
+    for chave, valor in scope.get("headers", []):
+        if chave == b"authorization":
+            valor = valor.decode("latin-1")
+            if valor.startswith("Bearer "):
+                return valor[len("Bearer "):]
+    return None
+
+class MiddlewareInquilinos:
+    """
+    Middleware ASGI que escolhe o inquilino de cada requisição e o define em inquilino_atual
+
+    /t/<nome>/... seleciona o inquilino pelo caminho (o restante do caminho é roteado
+    normalmente); sem prefixo, vale o inquilino dono do token Bearer ou, sem arquivo
+    de inquilinos, o inquilino padrão. Caminhos em `livres` não têm inquilino.
+    """
+
+    def __init__(self, app, registro, livres=("/admin/",)):
+        self.app = app
+        self.registro = registro
+        self.livres = tuple(livres)
+
+    def _selecionar(self, caminho, token):
+        """
+        (inquilino com uma requisição aberta a mais, None) ou (None, resposta de erro)
+        """
+        if caminho.startswith(PREFIXO_CAMINHO):
+            nome = caminho[len(PREFIXO_CAMINHO):].split("/", 1)[0]
+            if not self.registro.token_aceito(nome, token):
+                return None, JSONResponse({"status": "error", "error": "Token inválido para o inquilino"}, status_code=401)
+        elif token and self.registro.varios:
+            nome = self.registro.nome_por_token(token)
+        else:
+            nome = None if self.registro.varios else INQUILINO_PADRAO
+        inquilino = self.registro.entrar(nome) if nome else None
+        if inquilino is None:
+            return None, JSONResponse(
+                {"status": "error", "error": "Inquilino não encontrado (use /t/<nome>/ ou um token válido)"},
+                status_code=404
+            )
+        return inquilino, None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(self.livres):
+            await self.app(scope, receive, send)
+            return
+        caminho = scope["path"]
+        # Consultar o arquivo de configuração e montar um inquilino bloqueiam (disco, bancos,
+        # threads): numa thread, para um inquilino carregando não parar os demais. Protegido
+        # de cancelamento, para a requisição aberta em `entrar` sempre chegar ao `sair` abaixo
+        with anyio.CancelScope(shield=True):
+            inquilino, erro = await anyio.to_thread.run_sync(self._selecionar, caminho, _token_bearer(scope))
+        if erro is not None:
+            await erro(scope, receive, send)
+            return
+        if caminho.startswith(PREFIXO_CAMINHO):
+            # O prefixo vira parte do root_path, como num Mount do Starlette
+            nome = caminho[len(PREFIXO_CAMINHO):].split("/", 1)[0]
+            scope = dict(scope, root_path=scope.get("root_path", "") + PREFIXO_CAMINHO + nome)
+        marcador = inquilino_atual.set(inquilino)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            inquilino_atual.reset(marcador)
+            self.registro.sair(inquilino)
@@ -0,0 +1,263 @@
+"""
+Logs estruturados em JSON, gravados fora do loop de eventos
+
+Os handlers do logging escrevem no stderr de forma síncrona, na thread que gerou o
+log, o que sob carga disputa tempo com o atendimento das requisições. Aqui os
+registros vão para uma fila limitada (QueueHandler) e uma thread própria
+(QueueListener) formata e escreve. A formatação da mensagem também só acontece nessa
+thread, então chamadas como logger.info("Enviado para %s", destino) custam apenas
+enfileirar o registro. Com a fila cheia, o registro é descartado e contado, em vez
+de bloquear quem gerou o log.
+
+- Eventos de sucesso de alto volume (extra={"amostrar": True}) podem ser amostrados;
+  erros e avisos nunca são descartados pela amostragem
+- Campos passados em `extra` viram chaves do JSON
+- Números de telefone e corpos de mensagens podem ser mascarados (LOG_REDIGIR)
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import re
+import sys
+import threading
+import time
+
+# Telefones (10 a 15 dígitos) em chatIds (…@c.us, …@s.whatsapp.net) ou com o "+" do DDI. Números
+# soltos no texto (timestamps, durações, IDs) não são afetados; os telefones passados como
+# argumento do log ou em CAMPOS_TELEFONE são mascarados pelo valor inteiro
+PADRAO_TELEFONE = re.compile(
+    r"(?<!\w)(\+\d{2}|\d{2}(?=\d{8,13}@(?:c\.us|s\.whatsapp\.net)))(\d{4,9})(\d{4})(?!\d)"
+)
+
+# Campos de `extra` que guardam um número de telefone
+CAMPOS_TELEFONE = ("numero", "telefone", "destino", "chat", "chat_id")
+
+# Campos de `extra` tratados como corpo de mensagem
+CAMPOS_CORPO = ("mensagem", "texto", "corpo", "resposta")
+
+# Atributos próprios do LogRecord (e a versão colorida que o uvicorn acrescenta), que não são campos de `extra`
+ATRIBUTOS_PADRAO = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {
+    "message", "asctime", "amostrar", "color_message"
+}
+
+# Loggers de terceiros com um registro INFO por requisição, sujeitos à amostragem
+LOGGERS_AMOSTRAVEIS = ("uvicorn.access", "mcp.server.lowlevel.server")
+
+def mascarar_telefones(texto):
+    """
+    5511999999999@c.us -> 55*******9999@c.us
+    """
+    return PADRAO_TELEFONE.sub(lambda m: m.group(1) + "*" * len(m.group(2)) + m.group(3), texto)
+
+def mascarar_numero(valor):
+    """
+    Mascara o valor inteiro quando ele é um telefone ('5511999999999' -> '55*******9999')
+    """
+    if isinstance(valor, str) and valor.isdigit() and 10 <= len(valor) <= 15:
+        return valor[:2] + "*" * (len(valor) - 6) + valor[-4:]
+    return valor
+
+def analisar_redacao(texto):
+    """
+    Converte 'telefones,corpos' (variável LOG_REDIGIR) no conjunto de redações ativas
+    """
+    redacoes = {item.strip() for item in (texto or "").split(",") if item.strip()}
+    invalidas = redacoes - {"telefones", "corpos"}
+    if invalidas:
+        raise ValueError(f"LOG_REDIGIR inválido: {', '.join(sorted(invalidas))}. Use telefones e/ou corpos")
+    return redacoes
+
+class Redator:
+    """
+    Aplica as redações configuradas à mensagem e aos campos de um registro
+    """
+
+    def __init__(self, redacoes):
+        self.telefones = "telefones" in redacoes
+        self.corpos = "corpos" in redacoes
+
+    def texto(self, texto):
+        return mascarar_telefones(texto) if self.telefones else texto
+
+    def mensagem(self, record):
+        """
+        Mensagem formatada do registro, com os argumentos que são telefones mascarados
+        """
+        if not self.telefones or not isinstance(record.args, tuple) or not record.args:
+            return self.texto(record.getMessage())
+        return self.texto(str(record.msg) % tuple(mascarar_numero(arg) for arg in record.args))
+
+    def campo(self, nome, valor):
+        if self.corpos and nome in CAMPOS_CORPO and isinstance(valor, str):
+            return f"<{len(valor)} caracteres>"
+        if self.telefones and nome in CAMPOS_TELEFONE:
+            valor = mascarar_numero(valor)
+        if isinstance(valor, str):
+            return self.texto(valor)
+        return valor
+
+class FormatadorJSON(logging.Formatter):
+    """
+    Uma linha JSON por registro: ts, nivel, logger, msg, os campos de `extra` e a exceção
+    """
+
+    def __init__(self, redator):
+        super().__init__()
+        self.redator = redator
+
+    def format(self, record):
+        dados = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)) + f".{int(record.msecs):03d}",
+            "nivel": record.levelname,
+            "logger": record.name,
+            "msg": self.redator.mensagem(record),
+        }
+        for nome, valor in vars(record).items():
+            if nome not in ATRIBUTOS_PADRAO and not nome.startswith("_"):
+                dados[nome] = self.redator.campo(nome, valor)
+        if record.exc_info:
+            dados["exc"] = self.redator.texto(self.formatException(record.exc_info))
+        return json.dumps(dados, ensure_ascii=False, separators=(",", ":"), default=str)
+
+class FormatadorTexto(logging.Formatter):
+    """
+    Formato de texto tradicional, com as mesmas redações do JSON
+    """
+
+    def __init__(self, redator):
+        super().__init__('[%(asctime)s] %(levelname)s: %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+        self.redator = redator
+
+    def format(self, record):
+        record = logging.makeLogRecord({**vars(record), "msg": self.redator.mensagem(record), "args": None})
+        return self.redator.texto(super().format(record))
+
+class FiltroAmostragem(logging.Filter):
+    """
+    Mantém só uma fração `taxa` dos registros INFO/DEBUG marcados com amostrar=True ou
+    gerados pelos loggers em `loggers` (ex: o log de acesso do uvicorn)
+
+    Os registros mantidos levam o campo `amostragem` com a taxa, para reescalar contagens
+    """
+
+    def __init__(self, taxa, loggers=()):
+        super().__init__()
+        self.taxa = taxa
+        self.loggers = tuple(loggers)
+
+    def filter(self, record):
+        if self.taxa >= 1 or record.levelno > logging.INFO:
+            return True
+        if not getattr(record, "amostrar", False) and record.name not in self.loggers:
+            return True
+        if random.random() >= self.taxa:
+            return False
+        record.amostragem = self.taxa
+        return True
+
+class FiltroContexto(logging.Filter):
+    """
+    Acrescenta ao registro campos lidos do contexto de quem gerou o log (ex: o inquilino)
+    """
+
+    def __init__(self, campos):
+        super().__init__()
+        self.campos = campos
+
+    def filter(self, record):
+        for nome, obter in self.campos.items():
+            if not hasattr(record, nome):
+                valor = obter()
+                if valor is not None:
+                    setattr(record, nome, valor)
+        return True
+
+class HandlerFila(logging.handlers.QueueHandler):
+    """
+    Enfileira os registros sem formatá-los e sem bloquear; com a fila cheia, descarta e conta
+    """
+
+    def __init__(self, fila):
+        super().__init__(fila)
+        self.descartados = 0
+        self._lock = threading.Lock()
+
+    def prepare(self, record):
+        # A fila é do próprio processo: o registro segue como está e a mensagem só é
+        # formatada na thread de escrita (o QueueHandler padrão formataria aqui)
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._lock:
+                self.descartados += 1
+
+    def coletar_descartados(self):
+        with self._lock:
+            descartados, self.descartados = self.descartados, 0
+        return descartados
+
+class _HandlerEscrita(logging.StreamHandler):
+    """
+    Handler da thread de escrita; informa periodicamente os registros descartados
+    """
+
+    def __init__(self, stream, handler_fila, intervalo=10):
+        super().__init__(stream)
+        self.handler_fila = handler_fila
+        self.intervalo = intervalo
+        self._proximo_aviso = time.monotonic() + intervalo
+
+    def handle(self, record):
+        agora = time.monotonic()
+        if agora >= self._proximo_aviso:
+            self._proximo_aviso = agora + self.intervalo
+            descartados = self.handler_fila.coletar_descartados()
+            if descartados:
+                aviso = logging.LogRecord(__name__, logging.WARNING, __file__, 0,
+                                          "%d registros de log descartados com a fila cheia", (descartados,), None)
+                super().handle(aviso)
+        return super().handle(record)
+
+class _ListenerFila(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        # Com a fila cheia, espera a thread de escrita abrir espaço em vez de falhar no encerramento
+        self.queue.put(self._sentinel)
+
+    def stop(self):
+        # Pode ser chamado pelo encerramento da aplicação e de novo pelo atexit
+        if self._thread is not None:
+            super().stop()
+
+def configurar_logs(nivel="INFO", formato="json", amostragem=1.0, redigir="telefones,corpos",
+                    tamanho_fila=10000, contexto=None, amostraveis=LOGGERS_AMOSTRAVEIS, stream=None):
+    """
+    Substitui os handlers do logger raiz pela fila e inicia a thread de escrita
+
+    Retorna o QueueListener, encerrado automaticamente na saída do processo
+    """
+    redator = Redator(analisar_redacao(redigir))
+    if formato not in ("json", "texto"):
+        raise ValueError(f"LOG_FORMATO inválido: '{formato}'. Use json ou texto")
+    fila = queue.Queue(maxsize=max(1, tamanho_fila))
+    handler_fila = HandlerFila(fila)
+    handler_fila.addFilter(FiltroAmostragem(amostragem, amostraveis))
+    if contexto:
+        handler_fila.addFilter(FiltroContexto(contexto))
+    escrita = _HandlerEscrita(stream or sys.stderr, handler_fila)
+    escrita.setFormatter(FormatadorJSON(redator) if formato == "json" else FormatadorTexto(redator))
+    raiz = logging.getLogger()
+    for handler in list(raiz.handlers):
+        raiz.removeHandler(handler)
+    raiz.addHandler(handler_fila)
+    raiz.setLevel(nivel)
+    listener = _ListenerFila(fila, escrita, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
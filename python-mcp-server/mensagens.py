@@ -0,0 +1,132 @@
+"""
+Leitura paginada das mensagens de um chat, com cache das páginas recentes
+
+Cada leitura é uma requisição pequena ao Waha (GET /api/{sessão}/chats/{chat}/messages
+com `limit`), nunca o histórico inteiro. A paginação usa um cursor com o timestamp da
+última mensagem lida e os IDs das mensagens com esse mesmo timestamp, de modo que
+mensagens novas não deslocam as páginas seguintes (como aconteceria com offset).
+
+As páginas ficam em cache por chat. Mensagens novas só mudam a primeira página, que
+é invalidada pelos eventos `message`/`message.any` do webhook e pelos envios do
+próprio servidor; edições e mensagens apagadas invalidam todas as páginas do chat.
+"""
+
+import base64
+from cache import CacheTTL
+from resultados import projetar
+
+EVENTOS_NOVAS = ("message", "message.any")
+EVENTOS_ALTERADAS = ("message.revoked", "message.edited")
+
+def _id_mensagem(mensagem):
+    id_mensagem = mensagem.get("id")
+    if isinstance(id_mensagem, dict):
+        return id_mensagem.get("_serialized") or id_mensagem.get("id")
+    return id_mensagem
+
+def codificar_cursor(timestamp, ids):
+    texto = f"{timestamp}:{','.join(ids)}"
+    return base64.urlsafe_b64encode(texto.encode()).decode().rstrip("=")
+
+def decodificar_cursor(cursor):
+    """
+    Levanta ValueError quando o cursor não foi gerado por codificar_cursor
+    """
+    try:
+        texto = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        timestamp, _, ids = texto.partition(":")
+        return int(timestamp), [i for i in ids.split(",") if i]
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError(f"Cursor inválido: '{cursor}'")
+
+def resumir_mensagem(mensagem, campos=None):
+    """
+    Reduz a mensagem do Waha a id, remetente, horário, texto e indicação de mídia, mais os campos pedidos
+    """
+    item = {
+        "id": _id_mensagem(mensagem),
+        "de": mensagem.get("from"),
+        "eu": bool(mensagem.get("fromMe")),
+        "timestamp": mensagem.get("timestamp"),
+        "texto": mensagem.get("body"),
+    }
+    if mensagem.get("hasMedia"):
+        item["midia"] = True
+    if campos:
+        item.update(projetar(mensagem, campos))
+    return item
+
+class LeitorMensagens:
+    """
+    Lê páginas de mensagens de um chat, da mais recente para a mais antiga
+    """
+
+    def __init__(self, waha, ttl=60, max_itens=200):
+        self.waha = waha
+        # Chave: (chat_id, cursor, tamanho); o cursor é None na primeira página
+        self._paginas = CacheTTL(ttl, max_itens)
+
+    def ler(self, chat_id, cursor=None, tamanho=20):
+        """
+        Retorna as mensagens da página (mais recentes primeiro) e o cursor da próxima, ou None no fim
+
+        Levanta ValueError para cursores inválidos e requests.HTTPError para erros do Waha
+        """
+        borda = decodificar_cursor(cursor) if cursor else None
+        return self._paginas.obter_ou_carregar(
+            (chat_id, cursor, tamanho), lambda: self._carregar(chat_id, borda, tamanho)
+        )
+
+    def _carregar(self, chat_id, borda, tamanho):
+        vistos = set()
+        params = {
+            "limit": tamanho,
+            "downloadMedia": "false",
+            "sortBy": "timestamp",
+            "sortOrder": "desc",
+        }
+        if borda:
+            timestamp, ids = borda
+            vistos = set(ids)
+            # As mensagens com o timestamp da borda já lidas voltam na resposta e são descartadas
+            params["limit"] = tamanho + len(vistos)
+            params["filter.timestamp.lte"] = timestamp
+        response = self.waha.get(self.waha.caminho_sessao("chats", chat_id, "messages"), params=params)
+        response.raise_for_status()
+        recebidas = response.json() or []
+        pagina = [m for m in recebidas if _id_mensagem(m) not in vistos][:tamanho]
+        proximo = None
+        if len(recebidas) >= params["limit"] and pagina:
+            ultimo = pagina[-1].get("timestamp")
+            mesmos = [_id_mensagem(m) for m in pagina if m.get("timestamp") == ultimo]
+            if borda and borda[0] == ultimo:
+                mesmos = borda[1] + mesmos
+            proximo = codificar_cursor(ultimo, mesmos)
+        return {"chat": chat_id, "mensagens": pagina, "proximo_cursor": proximo}
+
+    def invalidar_chat(self, chat_id, apenas_recentes=True):
+        """
+        Descarta a primeira página do chat ou, com apenas_recentes=False, todas as páginas dele
+        """
+        if apenas_recentes:
+            self._paginas.invalidar_se(lambda chave: chave[0] == chat_id and chave[1] is None)
+        else:
+            self._paginas.invalidar_se(lambda chave: chave[0] == chat_id)
+
+    def processar_evento(self, evento):
+        """
+        Invalida as páginas conforme um evento de mensagem do webhook; retorna True se era um
+        """
+        nome = evento.get("event", "")
+        if nome not in EVENTOS_NOVAS and nome not in EVENTOS_ALTERADAS:
+            return False
+        payload = evento.get("payload") or {}
+        chat_id = payload.get("to") if payload.get("fromMe") else payload.get("from")
+        apenas_recentes = nome in EVENTOS_NOVAS
+        if chat_id:
+            self.invalidar_chat(chat_id, apenas_recentes)
+        elif apenas_recentes:
+            self._paginas.invalidar_se(lambda chave: chave[1] is None)
+        else:
+            self._paginas.invalidar()
+        return True
@@ -0,0 +1,226 @@
+"""
+Cache em disco das mídias recebidas (imagens, áudios, documentos)
+
+A mídia de uma mensagem é baixada do Waha uma única vez: o arquivo é gravado em
+blocos, sem passar inteiro pela memória, e guardado pelo SHA-256 do conteúdo
+(objetos/ab/abcdef...), de modo que a mesma mídia encaminhada em várias mensagens
+ocupa o disco uma vez. Um índice SQLite liga cada mensagem ao seu conteúdo e guarda
+o tamanho e o último acesso de cada arquivo; quando o total passa de
+`tamanho_maximo`, os arquivos acessados há mais tempo são apagados (LRU).
+
+Leituras repetidas vêm do disco, inteiras ou por faixa de bytes (`ler`), e downloads
+simultâneos da mesma mensagem esperam um único download.
+"""
+
+import hashlib
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS objetos (
+    hash TEXT PRIMARY KEY,
+    tamanho INTEGER NOT NULL,
+    acessado_em REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_objetos_acesso ON objetos(acessado_em);
+CREATE TABLE IF NOT EXISTS mensagens (
+    chave TEXT PRIMARY KEY,
+    hash TEXT NOT NULL,
+    mimetype TEXT,
+    nome TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_mensagens_hash ON mensagens(hash);
+"""
+
+class MidiaIndisponivel(ValueError):
+    """
+    A mensagem não tem mídia, o Waha não conseguiu baixá-la ou ela excede o tamanho do cache
+    """
+
+class CacheMidia:
+    """
+    Mídias das mensagens num diretório, endereçadas pelo conteúdo e limitadas por tamanho total
+    """
+
+    def __init__(self, waha, diretorio, tamanho_maximo=512 * 1024 * 1024, bloco=64 * 1024):
+        self.waha = waha
+        self.diretorio = diretorio
+        self.tamanho_maximo = tamanho_maximo
+        self.bloco = bloco
+        os.makedirs(os.path.join(diretorio, "objetos"), exist_ok=True)
+        self._lock = threading.Lock()
+        self._baixando = {}
+        self._conexao = sqlite3.connect(os.path.join(diretorio, "indice.db"), check_same_thread=False)
+        self._conexao.execute("PRAGMA journal_mode=WAL")
+        self._conexao.execute("PRAGMA synchronous=NORMAL")
+        self._conexao.executescript(ESQUEMA)
+        self._total = self._conexao.execute("SELECT COALESCE(SUM(tamanho), 0) FROM objetos").fetchone()[0]
+        self.acertos = 0
+        self.downloads = 0
+
+    def _caminho_objeto(self, hash_conteudo):
+        return os.path.join(self.diretorio, "objetos", hash_conteudo[:2], hash_conteudo)
+
+    def obter(self, chat_id, id_mensagem):
+        """
+        Mídia da mensagem no cache (baixada do Waha se preciso): caminho, tamanho, mimetype, nome e hash
+
+        Levanta MidiaIndisponivel quando não há mídia e requests.RequestException para erros do Waha
+        """
+        chave = f"{chat_id}/{id_mensagem}"
+        midia = self._consultar(chave)
+        if midia is not None:
+            return midia
+        with self._lock:
+            lock_chave = self._baixando.setdefault(chave, threading.Lock())
+        try:
+            with lock_chave:
+                # Outra thread pode ter baixado a mídia enquanto esperávamos
+                midia = self._consultar(chave)
+                if midia is None:
+                    midia = self._baixar(chat_id, id_mensagem, chave)
+        finally:
+            with self._lock:
+                if self._baixando.get(chave) is lock_chave and not lock_chave.locked():
+                    del self._baixando[chave]
+        return midia
+
+    def ler(self, midia, inicio=0, tamanho=None):
+        """
+        Bytes da mídia a partir de `inicio` (até `tamanho` bytes, ou até o fim)
+        """
+        with open(midia["caminho"], "rb") as arquivo:
+            arquivo.seek(max(0, inicio))
+            return arquivo.read(-1 if tamanho is None else max(0, tamanho))
+
+    def _consultar(self, chave):
+        with self._lock, self._conexao:
+            linha = self._conexao.execute(
+                "SELECT m.hash, m.mimetype, m.nome, o.tamanho FROM mensagens m "
+                "JOIN objetos o ON o.hash = m.hash WHERE m.chave = ?", (chave,)
+            ).fetchone()
+            if linha is None:
+                return None
+            hash_conteudo, mimetype, nome, tamanho = linha
+            caminho = self._caminho_objeto(hash_conteudo)
+            if not os.path.exists(caminho):
+                # Arquivo apagado por fora do cache: baixa de novo
+                self._remover_objetos([(hash_conteudo, tamanho)])
+                return None
+            self._conexao.execute("UPDATE objetos SET acessado_em = ? WHERE hash = ?", (time.time(), hash_conteudo))
+            self.acertos += 1
+        return {"caminho": caminho, "tamanho": tamanho, "mimetype": mimetype, "nome": nome, "hash": hash_conteudo}
+
+    def _baixar(self, chat_id, id_mensagem, chave):
+        response = self.waha.get(
+            self.waha.caminho_sessao("chats", chat_id, "messages", id_mensagem), params={"downloadMedia": "true"}
+        )
+        response.raise_for_status()
+        mensagem = response.json() or {}
+        info = mensagem.get("media") or {}
+        if not info.get("url"):
+            raise MidiaIndisponivel(info.get("error") or f"A mensagem '{id_mensagem}' não tem mídia")
+        url = urlsplit(info["url"])
+        if url.path.startswith("/api/"):
+            # Arquivos servidos pelo próprio Waha: o endereço público dele pode diferir de WAHA_API_URL
+            caminho = f"{url.path}?{url.query}" if url.query else url.path
+            download = self.waha.get(caminho, stream=True)
+        else:
+            download = self.waha.http.get(info["url"], stream=True, timeout=self.waha.timeout)
+        with download:
+            download.raise_for_status()
+            hash_conteudo, tamanho = self._gravar(download)
+        with self._lock, self._conexao:
+            if self._conexao.execute("SELECT 1 FROM objetos WHERE hash = ?", (hash_conteudo,)).fetchone():
+                self._conexao.execute("UPDATE objetos SET acessado_em = ? WHERE hash = ?", (time.time(), hash_conteudo))
+            else:
+                self._conexao.execute(
+                    "INSERT INTO objetos (hash, tamanho, acessado_em) VALUES (?, ?, ?)", (hash_conteudo, tamanho, time.time())
+                )
+                self._total += tamanho
+            self._conexao.execute(
+                "INSERT OR REPLACE INTO mensagens (chave, hash, mimetype, nome) VALUES (?, ?, ?, ?)",
+                (chave, hash_conteudo, info.get("mimetype"), info.get("filename"))
+            )
+            self.downloads += 1
+            self._despejar(protegido=hash_conteudo)
+        return {
+            "caminho": self._caminho_objeto(hash_conteudo), "tamanho": tamanho,
+            "mimetype": info.get("mimetype"), "nome": info.get("filename"), "hash": hash_conteudo,
+        }
+
+    def _gravar(self, download):
+        """
+        Grava o corpo do download em blocos num arquivo temporário e o move para o endereço do conteúdo
+        """
+        declarado = int(download.headers.get("Content-Length") or 0)
+        if declarado > self.tamanho_maximo:
+            raise MidiaIndisponivel(f"Mídia de {declarado} bytes excede o tamanho do cache ({self.tamanho_maximo} bytes)")
+        resumo = hashlib.sha256()
+        tamanho = 0
+        descritor, temporario = tempfile.mkstemp(dir=os.path.join(self.diretorio, "objetos"), suffix=".parcial")
+        try:
+            with os.fdopen(descritor, "wb") as destino:
+                for bloco in download.iter_content(self.bloco):
+                    tamanho += len(bloco)
+                    if tamanho > self.tamanho_maximo:
+                        raise MidiaIndisponivel(f"Mídia excede o tamanho do cache ({self.tamanho_maximo} bytes)")
+                    resumo.update(bloco)
+                    destino.write(bloco)
+            hash_conteudo = resumo.hexdigest()
+            caminho = self._caminho_objeto(hash_conteudo)
+            os.makedirs(os.path.dirname(caminho), exist_ok=True)
+            os.replace(temporario, caminho)
+        finally:
+            if os.path.exists(temporario):
+                os.remove(temporario)
+        return hash_conteudo, tamanho
+
+    def _despejar(self, protegido=None):
+        # Chamado com o lock, dentro da transação
+        if self._total <= self.tamanho_maximo:
+            return
+        excesso = self._total - self.tamanho_maximo
+        removidos = []
+        for hash_conteudo, tamanho in self._conexao.execute("SELECT hash, tamanho FROM objetos ORDER BY acessado_em"):
+            if excesso <= 0:
+                break
+            if hash_conteudo != protegido:
+                removidos.append((hash_conteudo, tamanho))
+                excesso -= tamanho
+        self._remover_objetos(removidos)
+        logger.info("Cache de mídia: %d arquivo(s) removido(s), %d bytes em uso", len(removidos), self._total)
+
+    def _remover_objetos(self, objetos):
+        # Chamado com o lock, dentro da transação. Quem está lendo um arquivo removido continua
+        # lendo normalmente: o sistema só libera o espaço quando o arquivo é fechado
+        for hash_conteudo, tamanho in objetos:
+            try:
+                os.remove(self._caminho_objeto(hash_conteudo))
+            except FileNotFoundError:
+                pass
+            self._total -= tamanho
+        hashes = [(hash_conteudo,) for hash_conteudo, _ in objetos]
+        self._conexao.executemany("DELETE FROM mensagens WHERE hash = ?", hashes)
+        self._conexao.executemany("DELETE FROM objetos WHERE hash = ?", hashes)
+
+    def estatisticas(self):
+        with self._lock:
+            return {
+                "bytes": self._total,
+                "tamanho_maximo": self.tamanho_maximo,
+                "arquivos": self._conexao.execute("SELECT COUNT(*) FROM objetos").fetchone()[0],
+                "acertos": self.acertos,
+                "downloads": self.downloads,
+            }
+
+    def fechar(self):
+        with self._lock:
+            self._conexao.close()
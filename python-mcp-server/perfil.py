@@ -0,0 +1,242 @@
+"""
+Perfilamento sob demanda das chamadas de ferramentas MCP
+
+Uma captura cobre as próximas N chamadas de ferramentas ou uma janela de tempo e é
+gravada em disco em formato padrão:
+
+- modo "cprofile": cProfile na thread do loop de eventos e nas threads de trabalho
+  onde as ferramentas rodam o trabalho bloqueante (via `envolver`), somados num único
+  .prof (pstats; abra com `python -m pstats` ou snakeviz)
+- modo "amostragem": amostras periódicas das pilhas de todas as threads, incluindo as
+  threads de trabalho dos envios, gravadas em .speedscope.json (https://speedscope.app)
+
+Sem captura ativa nada é instalado: o handler normal de chamadas de ferramentas fica
+intacto e nenhuma thread de amostragem existe, então o custo é zero.
+"""
+
+import asyncio
+import cProfile
+import json
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+MODOS = ("cprofile", "amostragem")
+
+def analisar_configuracao(texto):
+    """
+    Converte 'chamadas:50' ou 'segundos:30' (variável MCP_PERFIL) em argumentos de iniciar
+    """
+    if not texto:
+        return None
+    tipo, _, valor = texto.partition(":")
+    if tipo not in ("chamadas", "segundos") or not valor:
+        raise ValueError(f"MCP_PERFIL inválido: '{texto}'. Use chamadas:N ou segundos:N")
+    return {tipo: float(valor) if tipo == "segundos" else int(valor)}
+
+class _Amostrador:
+    """
+    Amostra as pilhas de todas as threads em intervalos fixos, no formato do speedscope
+    """
+
+    def __init__(self, intervalo=0.005):
+        self.intervalo = intervalo
+        self._frames = []
+        self._indices = {}
+        self._amostras = {}
+        self._parar = threading.Event()
+        self._thread = threading.Thread(target=self._executar, name="perfil-amostrador", daemon=True)
+        self._inicio = None
+
+    def iniciar(self):
+        self._inicio = time.perf_counter()
+        self._thread.start()
+
+    def parar(self):
+        self._parar.set()
+        self._thread.join()
+
+    def _indice_frame(self, codigo):
+        chave = (codigo.co_name, codigo.co_filename, codigo.co_firstlineno)
+        indice = self._indices.get(chave)
+        if indice is None:
+            indice = self._indices[chave] = len(self._frames)
+            self._frames.append({"name": codigo.co_name, "file": codigo.co_filename, "line": codigo.co_firstlineno})
+        return indice
+
+    def _executar(self):
+        proprio = threading.get_ident()
+        nomes = {}
+        anterior = time.perf_counter()
+        while not self._parar.wait(self.intervalo):
+            agora = time.perf_counter()
+            peso = agora - anterior
+            anterior = agora
+            for ident, frame in sys._current_frames().items():
+                if ident == proprio:
+                    continue
+                pilha = []
+                while frame is not None:
+                    pilha.append(self._indice_frame(frame.f_code))
+                    frame = frame.f_back
+                pilha.reverse()
+                if ident not in nomes:
+                    nomes = {t.ident: t.name for t in threading.enumerate()}
+                amostras, pesos = self._amostras.setdefault(nomes.get(ident, str(ident)), ([], []))
+                amostras.append(pilha)
+                pesos.append(peso)
+
+    def gravar(self, caminho):
+        duracao = time.perf_counter() - self._inicio
+        perfis = [{
+            "type": "sampled",
+            "name": nome,
+            "unit": "seconds",
+            "startValue": 0,
+            "endValue": duracao,
+            "samples": amostras,
+            "weights": pesos,
+        } for nome, (amostras, pesos) in self._amostras.items()]
+        with open(caminho, "w", encoding="utf-8") as f:
+            json.dump({
+                "$schema": "https://www.speedscope.app/file-format-schema.json",
+                "shared": {"frames": self._frames},
+                "profiles": perfis,
+                "name": os.path.basename(caminho),
+                "exporter": "mcp-whatsapp-server",
+            }, f)
+
+class Perfilador:
+    """
+    Controla as capturas de perfil de um servidor FastMCP
+    """
+
+    def __init__(self, mcp, diretorio, chamar_ferramenta=None):
+        self.mcp = mcp
+        self.diretorio = diretorio
+        # Handler de chamadas de ferramentas restaurado ao fim de cada captura
+        self.chamar_ferramenta = chamar_ferramenta or mcp.call_tool
+        self._captura = None
+        self.ultimo_arquivo = None
+
+    def estado(self):
+        if self._captura is None:
+            return {"ativo": False, "ultimo_arquivo": self.ultimo_arquivo}
+        c = self._captura
+        return {
+            "ativo": True,
+            "modo": c["modo"],
+            "chamadas_restantes": c["restantes"],
+            "segundos_decorridos": round(time.perf_counter() - c["inicio"], 1),
+            "ultimo_arquivo": self.ultimo_arquivo,
+        }
+
+    def iniciar(self, chamadas=None, segundos=None, modo="cprofile"):
+        """
+        Inicia uma captura das próximas `chamadas` chamadas de ferramentas ou de `segundos` segundos
+
+        Deve ser chamado de dentro do loop de eventos, cuja thread é a perfilada pelo cProfile
+        (as threads de trabalho são perfiladas pelas funções passadas por `envolver`)
+        """
+        if self._captura is not None:
+            raise RuntimeError("Já existe uma captura de perfil em andamento")
+        if modo not in MODOS:
+            raise ValueError(f"Modo inválido: '{modo}'. Use um de {', '.join(MODOS)}")
+        if not chamadas and not segundos:
+            raise ValueError("Informe o número de chamadas ou a duração em segundos")
+        os.makedirs(self.diretorio, exist_ok=True)
+        captura = {"modo": modo, "restantes": chamadas, "inicio": time.perf_counter(), "coletor": None, "threads": []}
+        self._captura = captura
+        if modo == "amostragem":
+            captura["coletor"] = _Amostrador()
+            captura["coletor"].iniciar()
+        elif segundos:
+            captura["coletor"] = cProfile.Profile()
+            captura["coletor"].enable()
+        if chamadas:
+            # No modo cprofile por chamadas, o cProfile é ligado na primeira chamada interceptada
+            self._registrar_handler(self._chamar_ferramenta_perfilada)
+        if segundos:
+            asyncio.get_running_loop().call_later(segundos, self._encerrar_se, captura)
+        logger.info("Captura de perfil iniciada: modo=%s chamadas=%s segundos=%s", modo, chamadas, segundos)
+        return self.estado()
+
+    def envolver(self, funcao):
+        """
+        Devolve `funcao` perfilada na thread em que rodar, se houver uma captura cprofile coletando
+
+        Usado ao mandar trabalho bloqueante para as threads de trabalho, que o cProfile
+        da thread do loop não enxerga
+        """
+        captura = self._captura
+        if captura is None or not isinstance(captura["coletor"], cProfile.Profile):
+            return funcao
+
+        def perfilada(*args):
+            perfil = cProfile.Profile()
+            try:
+                perfil.enable()
+            except ValueError:
+                # Python 3.12+: só um cProfile fica ativo, e o do loop já vê todas as threads
+                return funcao(*args)
+            try:
+                return funcao(*args)
+            finally:
+                perfil.disable()
+                captura["threads"].append(perfil)
+        return perfilada
+
+    async def _chamar_ferramenta_perfilada(self, name, arguments):
+        captura = self._captura
+        if captura is not None and captura["coletor"] is None:
+            captura["coletor"] = cProfile.Profile()
+            captura["coletor"].enable()
+        try:
+            return await self.chamar_ferramenta(name, arguments)
+        finally:
+            if captura is not None and captura["restantes"] is not None:
+                captura["restantes"] -= 1
+                if captura["restantes"] <= 0:
+                    self._encerrar_se(captura)
+
+    def _encerrar_se(self, captura):
+        if self._captura is captura:
+            self.encerrar()
+
+    def encerrar(self):
+        """
+        Finaliza a captura atual, grava o arquivo e restaura o handler original
+        """
+        captura = self._captura
+        if captura is None:
+            return None
+        self._captura = None
+        if captura["restantes"] is not None:
+            self._registrar_handler(self.chamar_ferramenta)
+        coletor = captura["coletor"]
+        if coletor is None:
+            return None
+        nome = time.strftime("perfil-%Y%m%d-%H%M%S")
+        if isinstance(coletor, cProfile.Profile):
+            coletor.disable()
+            caminho = os.path.join(self.diretorio, f"{nome}.prof")
+            estatisticas = pstats.Stats(coletor)
+            for perfil in list(captura["threads"]):
+                estatisticas.add(perfil)
+            estatisticas.dump_stats(caminho)
+        else:
+            coletor.parar()
+            caminho = os.path.join(self.diretorio, f"{nome}.speedscope.json")
+            coletor.gravar(caminho)
+        self.ultimo_arquivo = caminho
+        logger.info("Perfil gravado em %s (%.1fs de captura)", caminho, time.perf_counter() - captura['inicio'])
+        return caminho
+
+    def _registrar_handler(self, funcao):
+        # Reaproveita o decorator do servidor de baixo nível, como o FastMCP faz em _setup_handlers
+        self.mcp._mcp_server.call_tool(validate_input=False)(funcao)
@@ -0,0 +1,164 @@
+"""
+Filas de prioridade para as chamadas ao Waha
+
+Toda requisição ao Waha ocupa uma vaga do Despachante. Quando não há vaga livre, as
+requisições esperam em uma fila por classe de prioridade (interativa, normal, lote) e
+as vagas liberadas são distribuídas por escalonamento justo ponderado (stride
+scheduling): cada classe recebe uma fração das vagas proporcional ao seu peso. Assim
+um envio interativo passa à frente de um lote longo, mas o lote continua com uma
+fração mínima garantida (peso do lote / soma dos pesos).
+
+A classe da chamada atual é definida com `com_prioridade`, que vale para a thread ou
+tarefa atual e para as threads criadas a partir de uma cópia do seu contexto.
+"""
+
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+PESOS_PADRAO = {"interativa": 8, "normal": 3, "lote": 1}
+
+prioridade_atual = ContextVar("prioridade_waha", default="normal")
+
+@contextmanager
+def com_prioridade(prioridade):
+    """
+    Define a classe de prioridade das chamadas ao Waha feitas dentro do bloco
+    """
+    if prioridade not in PESOS_PADRAO:
+        raise ValueError(f"Prioridade inválida: '{prioridade}'. Use uma de {', '.join(PESOS_PADRAO)}")
+    token = prioridade_atual.set(prioridade)
+    try:
+        yield
+    finally:
+        prioridade_atual.reset(token)
+
+def analisar_pesos(texto):
+    """
+    Converte 'interativa=8,normal=3,lote=1' em um dicionário de pesos
+    """
+    pesos = dict(PESOS_PADRAO)
+    for item in (texto or "").split(","):
+        if "=" in item:
+            nome, valor = item.split("=", 1)
+            if nome.strip() in pesos:
+                pesos[nome.strip()] = max(float(valor), 0.001)
+    return pesos
+
+class _Espera:
+    __slots__ = ("concedida",)
+
+    def __init__(self):
+        self.concedida = False
+
+class Despachante:
+    """
+    Limita as chamadas simultâneas ao Waha e a taxa de envios, repartindo as vagas
+    entre as classes de prioridade por peso
+    """
+
+    def __init__(self, concorrencia=4, taxa_maxima=0, pesos=None):
+        self.limite = max(1, concorrencia)
+        self.taxa_maxima = taxa_maxima
+        self.pesos = dict(pesos or PESOS_PADRAO)
+        self._cond = threading.Condition()
+        self._em_uso = 0
+        self._filas = {nome: deque() for nome in self.pesos}
+        # Tempo virtual de cada classe: avança 1/peso a cada vaga concedida
+        self._passe = {nome: 0.0 for nome in self.pesos}
+        self._relogio_virtual = 0.0
+        self._concedidas = {nome: 0 for nome in self.pesos}
+        self._proximo_envio = 0.0
+
+    @contextmanager
+    def vaga(self, prioridade=None, consumir_taxa=False):
+        """
+        Ocupa uma vaga durante o bloco; `consumir_taxa` aplica também o limite de envios por segundo
+        """
+        self.adquirir(prioridade)
+        try:
+            if consumir_taxa:
+                self._aguardar_taxa()
+            yield
+        finally:
+            self.liberar()
+
+    def adquirir(self, prioridade=None):
+        prioridade = prioridade or prioridade_atual.get()
+        if prioridade not in self._filas:
+            prioridade = "normal"
+        with self._cond:
+            if self._em_uso < self.limite and not any(self._filas.values()):
+                self._conceder_direto(prioridade)
+                return
+            fila = self._filas[prioridade]
+            if not fila:
+                # Uma classe ociosa não acumula crédito: volta a competir a partir do relógio atual
+                self._passe[prioridade] = max(self._passe[prioridade], self._relogio_virtual)
+            espera = _Espera()
+            fila.append(espera)
+            while not espera.concedida:
+                self._cond.wait()
+
+    def liberar(self):
+        with self._cond:
+            self._em_uso -= 1
+            self._distribuir()
+
+    def definir_limite(self, limite):
+        """
+        Altera o número de vagas (usado pelo controle adaptativo de concorrência)
+        """
+        with self._cond:
+            self.limite = max(1, int(limite))
+            self._distribuir()
+
+    def saturado(self):
+        """
+        Indica se todas as vagas estão em uso ou há requisições esperando
+        """
+        with self._cond:
+            return self._em_uso >= self.limite or any(self._filas.values())
+
+    def estatisticas(self):
+        with self._cond:
+            return {
+                "limite": self.limite,
+                "em_uso": self._em_uso,
+                "aguardando": {nome: len(fila) for nome, fila in self._filas.items()},
+                "concedidas": dict(self._concedidas),
+            }
+
+    def _conceder_direto(self, prioridade):
+        self._em_uso += 1
+        self._concedidas[prioridade] += 1
+        self._passe[prioridade] = max(self._passe[prioridade], self._relogio_virtual) + 1 / self.pesos[prioridade]
+
+    def _distribuir(self):
+        concedeu = False
+        while self._em_uso < self.limite:
+            ativas = [nome for nome, fila in self._filas.items() if fila]
+            if not ativas:
+                break
+            nome = min(ativas, key=lambda n: self._passe[n])
+            self._relogio_virtual = self._passe[nome]
+            self._passe[nome] += 1 / self.pesos[nome]
+            self._filas[nome].popleft().concedida = True
+            self._concedidas[nome] += 1
+            self._em_uso += 1
+            concedeu = True
+        if concedeu:
+            self._cond.notify_all()
+
+    def _aguardar_taxa(self):
+        if self.taxa_maxima <= 0:
+            return
+        # Reserva o próximo instante livre; as reservas seguem a ordem de concessão das vagas
+        with self._cond:
+            agora = time.monotonic()
+            instante = max(agora, self._proximo_envio)
+            self._proximo_envio = instante + 1 / self.taxa_maxima
+        if instante > agora:
+            time.sleep(instante - agora)
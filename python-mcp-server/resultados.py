@@ -0,0 +1,80 @@
+"""
+Formatação compacta dos resultados das ferramentas e recursos MCP
+
+Por padrão as ferramentas devolvem um esquema pequeno e fixo. Campos extras da
+resposta do Waha podem ser pedidos pelo argumento `campos`, usando caminhos
+separados por ponto (ex: "id.remote", "me.pushName"); "*" devolve tudo.
+"""
+
+# Tamanho máximo do corpo de erro do Waha incluído nos resultados
+LIMITE_TEXTO_ERRO = 200
+
+def _obter_caminho(dados, partes):
+    """
+    Percorre `dados` seguindo as chaves de `partes`; listas são percorridas item a item
+    """
+    for i, parte in enumerate(partes):
+        if isinstance(dados, list):
+            return [_obter_caminho(item, partes[i:]) for item in dados]
+        if not isinstance(dados, dict) or parte not in dados:
+            return None
+        dados = dados[parte]
+    return dados
+
+def projetar(dados, campos):
+    """
+    Retorna apenas os campos pedidos de `dados`, preservando a estrutura aninhada
+    """
+    if not campos:
+        return {}
+    if "*" in campos:
+        return dados
+    resultado = {}
+    for campo in campos:
+        partes = [p for p in campo.split(".") if p]
+        if not partes:
+            continue
+        valor = _obter_caminho(dados, partes)
+        if valor is None:
+            continue
+        destino = resultado
+        for parte in partes[:-1]:
+            destino = destino.setdefault(parte, {})
+        destino[partes[-1]] = valor
+    return resultado
+
+def extrair_id_mensagem(dados):
+    """
+    Extrai o ID da mensagem enviada, cujo formato varia conforme o engine do Waha
+    """
+    if not isinstance(dados, dict):
+        return None
+    id_mensagem = dados.get("id")
+    if isinstance(id_mensagem, dict):
+        return id_mensagem.get("_serialized") or id_mensagem.get("id")
+    if isinstance(id_mensagem, str):
+        return id_mensagem
+    chave = dados.get("key")
+    if isinstance(chave, dict):
+        return chave.get("id")
+    return None
+
+def resumir_sessoes(sessions, campos=None):
+    """
+    Reduz a lista de sessões do Waha a nome e status, mais os campos pedidos
+    """
+    resumo = []
+    for sessao in sessions:
+        item = {"name": sessao.get("name"), "status": sessao.get("status")}
+        if campos:
+            item.update(projetar(sessao, campos))
+        resumo.append(item)
+    return resumo
+
+def truncar(texto, limite=LIMITE_TEXTO_ERRO):
+    """
+    Limita textos longos (ex: corpos de erro do Waha) ao tamanho informado
+    """
+    if len(texto) <= limite:
+        return texto
+    return texto[:limite] + f"... (+{len(texto) - limite} caracteres)"
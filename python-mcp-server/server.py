@@ -5,11 +5,28 @@ Versão stdio para uso com Claude Desktop
 """
 
 import os
+import base64
 import asyncio
 import requests
 import json
+from typing import List, Optional
 from dotenv import load_dotenv
 from mcp.server.fastmcp import FastMCP
+from resultados import projetar, extrair_id_mensagem, resumir_sessoes, truncar
+from waha_api import WahaAPI, normalizar_chat_id, rotulo_chat
+from prioridades import Despachante, analisar_pesos, com_prioridade
+from grupos import CacheGrupos
+from distribuicao import enviar_em_lote
+from contatos_store import ContatosStore, SincronizadorContatos
+from importacao_contatos import resolver_arquivo, importar_contatos as importar_arquivo, exportar_contatos as exportar_arquivo
+from entregas import EntregasStore, ConsultorEntregas
+from fragmentacao import dividir_mensagem, enviar_partes
+from gravacao import criar_adaptador
+from concorrencia import criar_controle
+from mensagens import LeitorMensagens, resumir_mensagem
+from midia import CacheMidia
+from auditoria import LogAuditoria, analisar_periodo
+from agrupamento import AgrupadorEnvios
 
 # Carregar variáveis de ambiente
 load_dotenv()
@@ -18,17 +35,75 @@ load_dotenv()
 WAHA_API_URL = os.getenv("WAHA_API_URL", "http://localhost:3000")
 SESSION_ID = os.getenv("WAHA_SESSION_ID", "default")
 CONTATOS_FILE = os.getenv("CONTATOS_FILE", os.path.join(os.path.dirname(__file__), "contatos.json"))
+GRUPOS_CACHE_TTL = int(os.getenv("GRUPOS_CACHE_TTL", 300))
+ENVIO_LOTE_CONCORRENCIA = int(os.getenv("ENVIO_LOTE_CONCORRENCIA", 5))
+WAHA_CONCORRENCIA = int(os.getenv("WAHA_CONCORRENCIA", 4))
+WAHA_CONCORRENCIA_MINIMA = int(os.getenv("WAHA_CONCORRENCIA_MINIMA", 1))
+WAHA_CONCORRENCIA_MAXIMA = int(os.getenv("WAHA_CONCORRENCIA_MAXIMA", 16))
+WAHA_LATENCIA_TOLERANCIA = float(os.getenv("WAHA_LATENCIA_TOLERANCIA", 1.5))
+WAHA_TAXA_MAXIMA = float(os.getenv("WAHA_TAXA_MAXIMA", 0))
+WAHA_PESOS_PRIORIDADE = analisar_pesos(os.getenv("WAHA_PESOS_PRIORIDADE"))
+CONTATOS_DB = os.getenv("CONTATOS_DB", os.path.join(os.path.dirname(__file__), "contatos.db"))
+CONTATOS_SYNC_INTERVALO = int(os.getenv("CONTATOS_SYNC_INTERVALO", 900))
+CONTATOS_SYNC_PAGINA = int(os.getenv("CONTATOS_SYNC_PAGINA", 500))
+CONTATOS_ARQUIVOS_DIR = os.getenv("CONTATOS_ARQUIVOS_DIR", os.path.join(os.path.dirname(__file__), "arquivos"))
+ENTREGAS_DB = os.getenv("ENTREGAS_DB", os.path.join(os.path.dirname(__file__), "entregas.db"))
+ENTREGAS_POLL_INTERVALO = int(os.getenv("ENTREGAS_POLL_INTERVALO", 60))
+MENSAGEM_TAMANHO_MAXIMO = int(os.getenv("MENSAGEM_TAMANHO_MAXIMO", 4096))
+MENSAGEM_AGRUPAMENTO_MS = int(os.getenv("MENSAGEM_AGRUPAMENTO_MS", 0))
+MENSAGENS_PAGINA = int(os.getenv("MENSAGENS_PAGINA", 20))
+MENSAGENS_CACHE_TTL = int(os.getenv("MENSAGENS_CACHE_TTL", 60))
+MIDIA_DIR = os.getenv("MIDIA_DIR", os.path.join(os.path.dirname(__file__), "midia"))
+MIDIA_CACHE_MB = int(os.getenv("MIDIA_CACHE_MB", 512))
+MIDIA_PAGINA = int(os.getenv("MIDIA_PAGINA", 262144))
+AUDITORIA_DIR = os.getenv("AUDITORIA_DIR", os.path.join(os.path.dirname(__file__), "auditoria-stdio"))
+AUDITORIA_SEGMENTO_MB = int(os.getenv("AUDITORIA_SEGMENTO_MB", 64))
+AUDITORIA_ROTACAO = int(os.getenv("AUDITORIA_ROTACAO", 86400))
+WAHA_GRAVACAO = os.getenv("WAHA_GRAVACAO")
+WAHA_REPRODUCAO = os.getenv("WAHA_REPRODUCAO")
+WAHA_REPRODUCAO_VELOCIDADE = float(os.getenv("WAHA_REPRODUCAO_VELOCIDADE", 1))
 
 # Criar o servidor MCP
 mcp = FastMCP("WhatsApp Server")
 
-def verificar_status_waha():
+# Cliente Waha com pool de conexões, filas de prioridade e cache de grupos
+despachante = Despachante(WAHA_CONCORRENCIA, WAHA_TAXA_MAXIMA, WAHA_PESOS_PRIORIDADE)
+waha = WahaAPI(
+    WAHA_API_URL, SESSION_ID, despachante=despachante,
+    adaptador=criar_adaptador(WAHA_GRAVACAO, WAHA_REPRODUCAO, WAHA_REPRODUCAO_VELOCIDADE),
+    controle=criar_controle(despachante, WAHA_CONCORRENCIA_MINIMA, WAHA_CONCORRENCIA_MAXIMA, WAHA_LATENCIA_TOLERANCIA)
+)
+grupos = CacheGrupos(waha, GRUPOS_CACHE_TTL)
+
+# Páginas recentes das conversas, invalidadas pelos envios
+mensagens = LeitorMensagens(waha, MENSAGENS_CACHE_TTL)
+
+# Mensagens em sequência ao mesmo chat, unidas num único envio (desativado com janela 0)
+agrupador = AgrupadorEnvios(MENSAGEM_AGRUPAMENTO_MS / 1000, MENSAGEM_TAMANHO_MAXIMO)
+
+# Mídias recebidas, baixadas uma vez e lidas do disco
+midia = CacheMidia(waha, MIDIA_DIR, MIDIA_CACHE_MB * 1024 * 1024)
+
+# Contatos sincronizados da agenda do WhatsApp
+contatos_store = ContatosStore(CONTATOS_DB)
+sincronizador = SincronizadorContatos(waha, contatos_store, CONTATOS_SYNC_PAGINA, CONTATOS_SYNC_INTERVALO)
+
+# Confirmações de entrega das mensagens enviadas
+entregas = EntregasStore(ENTREGAS_DB)
+consultor_entregas = ConsultorEntregas(waha, entregas, ENTREGAS_POLL_INTERVALO)
+
+# Registro de auditoria de todos os envios
+auditoria = LogAuditoria(AUDITORIA_DIR, AUDITORIA_SEGMENTO_MB * 1024 * 1024, AUDITORIA_ROTACAO)
+
+def verificar_status_waha(campos=None):
     """
     Verifica se a API Waha está online e autenticada no WhatsApp
+
+    As sessões são resumidas a nome e status; `campos` pede atributos extras de cada sessão
     """
     try:
         # Verificar se a API está online
-        response = requests.get(f"{WAHA_API_URL}/api/sessions")
+        response = waha.get("/api/sessions")
         response.raise_for_status()
         
         # Verificar se há uma sessão ativa
@@ -45,7 +120,7 @@ def verificar_status_waha():
         return {
             "status": "success",
             "mensagem": f"Waha API está respondendo com {len(sessions)} sessões",
-            "sessions": sessions
+            "sessions": resumir_sessoes(sessions, campos)
         }
     except Exception as e:
         return {
@@ -53,72 +128,203 @@ def verificar_status_waha():
             "mensagem": f"Erro ao verificar status do Waha: {str(e)}"
         }
 
-def enviar_mensagem_waha(numero, mensagem):
+def enviar_mensagem_waha(numero, mensagem, campos=None):
     """
     Envia uma mensagem via WhatsApp usando a API Waha
+
+    Retorna apenas o ID da mensagem; `campos` projeta campos extras da resposta do Waha
     """
-    try:
-        # Verificar formato do número de telefone
-        if not numero.isdigit():
-            return {
-                "sucesso": False,
-                "erro": "Formato de número inválido",
-                "mensagem": f"O número '{numero}' deve conter apenas dígitos (ex: 5511999999999)"
-            }
-        
-        # Verificar se a API está acessível
-        status = verificar_status_waha()
-        if status.get("status") == "error":
-            return {
-                "sucesso": False,
-                "erro": "API Waha não acessível",
-                "mensagem": status.get("mensagem")
-            }
-        
-        # Enviar mensagem com parâmetros completos
-        response = requests.post(
-            f"{WAHA_API_URL}/api/sendText",
-            json={
-                "chatId": f"{numero}@c.us", 
-                "reply_to": None, 
-                "text": mensagem, 
-                "linkPreview": True, 
-                "linkPreviewHighQuality": False, 
-                "session": SESSION_ID
-            },
-            timeout=10
-        )
-        
+    # Verificar formato do número de telefone
+    if not numero.isdigit():
+        return {
+            "sucesso": False,
+            "erro": "Formato de número inválido",
+            "mensagem": f"O número '{numero}' deve conter apenas dígitos (ex: 5511999999999)"
+        }
+    
+    # Verificar se a API está acessível
+    status = verificar_status_waha()
+    if status.get("status") == "error":
+        return {
+            "sucesso": False,
+            "erro": "API Waha não acessível",
+            "mensagem": status.get("mensagem")
+        }
+    
+    return enviar_para_chat(f"{numero}@c.us", mensagem, campos)
+
+def enviar_para_chat(chat_id, mensagem, campos=None, campanha=None):
+    """
+    Envia uma mensagem para um chatId já validado (contato, grupo ou lista de transmissão)
+
+    Mensagens maiores que MENSAGEM_TAMANHO_MAXIMO são divididas em partes enviadas em
+    ordem, com um único resultado. O ID de cada mensagem enviada é registrado para
+    acompanhar a entrega (opcionalmente por campanha)
+    """
+    destino = rotulo_chat(chat_id)
+    partes = dividir_mensagem(mensagem, MENSAGEM_TAMANHO_MAXIMO)
+    enviadas = []
+    falha = {}
+
+    def enviar_parte(parte):
+        try:
+            response = waha.enviar_texto(chat_id, parte)
+        except requests.RequestException as e:
+            auditoria.registrar(chat_id, parte, status="falhou", campanha=campanha, erro=str(e))
+            raise
         # Verificar resposta - códigos 200 e 201 são ambos considerados sucesso
         # 200 = OK, 201 = Created (mensagem criada com sucesso)
-        if response.status_code in [200, 201]:
-            return {
+        if response.status_code not in [200, 201]:
+            falha["response"] = response
+            auditoria.registrar(chat_id, parte, status="falhou", campanha=campanha, erro=f"HTTP {response.status_code}")
+            return False
+        dados = response.json()
+        id_mensagem = extrair_id_mensagem(dados)
+        auditoria.registrar(chat_id, parte, id_mensagem, campanha=campanha)
+        entregas.registrar(id_mensagem, chat_id, campanha)
+        mensagens.invalidar_chat(chat_id)
+        enviadas.append((id_mensagem, dados))
+        return True
+
+    def com_partes(resultado):
+        if len(partes) > 1:
+            resultado["partes"] = len(partes)
+            resultado["partes_enviadas"] = len(enviadas)
+            resultado["ids"] = [id_mensagem for id_mensagem, _ in enviadas]
+        return resultado
+
+    try:
+        if enviar_partes(partes, enviar_parte) == len(partes):
+            mensagem_sucesso = f"Mensagem enviada com sucesso para {destino}"
+            if len(partes) > 1:
+                mensagem_sucesso += f" em {len(partes)} partes"
+            resultado = com_partes({
                 "sucesso": True,
-                "resposta": response.json(),
-                "mensagem": f"Mensagem enviada com sucesso para {numero}"
-            }
+                "id": enviadas[0][0],
+                "mensagem": mensagem_sucesso
+            })
+            if campos:
+                if len(partes) > 1:
+                    resultado["resposta"] = [projetar(dados, campos) for _, dados in enviadas]
+                else:
+                    resultado["resposta"] = projetar(enviadas[0][1], campos)
+            return resultado
         
         # Se chegou aqui, temos um erro real
-        return {
+        response = falha["response"]
+        mensagem_erro = f"Falha ao enviar mensagem para {destino}: Código {response.status_code}"
+        if len(partes) > 1:
+            mensagem_erro = f"Falha ao enviar a parte {len(enviadas) + 1} de {len(partes)} para {destino}: Código {response.status_code}"
+        return com_partes({
             "sucesso": False,
-            "erro": f"Erro na API Waha: {response.status_code} - {response.text}",
-            "mensagem": f"Falha ao enviar mensagem para {numero}: Código {response.status_code}"
-        }
+            "erro": f"Erro na API Waha: {response.status_code} - {truncar(response.text)}",
+            "mensagem": mensagem_erro
+        })
     except requests.RequestException as e:
         # Erro específico de requisição HTTP
-        return {
+        return com_partes({
             "sucesso": False,
             "erro": str(e),
-            "mensagem": f"Falha ao enviar mensagem para {numero}: {str(e)}",
+            "mensagem": f"Falha ao enviar mensagem para {destino}: {str(e)}",
             "solucao": "Verifique se a API Waha está em execução em " + WAHA_API_URL
-        }
+        })
     except Exception as e:
         # Outros erros
+        return com_partes({
+            "sucesso": False,
+            "erro": str(e),
+            "mensagem": f"Falha ao enviar mensagem para {destino}: {str(e)}"
+        })
+
+async def enviar_agrupado(numero, mensagem, campos=None):
+    """
+    Envia pela janela de agrupamento (MENSAGEM_AGRUPAMENTO_MS), quando ativa
+
+    Mensagens ao mesmo chat em sequência saem num único envio; cada chamada recebe o
+    resultado do envio do seu grupo, com `agrupamento` indicando quantas mensagens
+    foram unidas e a sua posição
+    """
+    if not agrupador.ativo or not numero.isdigit():
+        return await asyncio.to_thread(enviar_mensagem_waha, numero, mensagem, campos)
+    # A janela é esperada no loop de eventos e só o envio do grupo ocupa uma thread. A resposta
+    # completa do Waha é pedida uma vez e projetada com os campos de cada chamada
+    resultado, quantidade, posicao = await agrupador.enviar(
+        f"{numero}@c.us", mensagem, lambda texto: asyncio.to_thread(enviar_mensagem_waha, numero, texto, ["*"])
+    )
+    resultado = dict(resultado)
+    resposta = resultado.pop("resposta", None)
+    if campos and resposta is not None:
+        if isinstance(resposta, list):
+            resultado["resposta"] = [projetar(dados, campos) for dados in resposta]
+        else:
+            resultado["resposta"] = projetar(resposta, campos)
+    if quantidade > 1:
+        resultado["agrupamento"] = {"mensagens": quantidade, "posicao": posicao + 1}
+    return resultado
+
+def enviar_mensagem_lote(destinos, mensagem, campanha=None):
+    """
+    Envia a mesma mensagem para vários destinos, com concorrência limitada
+
+    Retorna um resumo único com a contagem de envios e apenas os destinos que falharam
+    """
+    chat_ids = []
+    falhas = []
+    for destino in destinos:
+        try:
+            chat_ids.append(normalizar_chat_id(destino))
+        except ValueError as e:
+            falhas.append({"destino": destino, "erro": str(e)})
+    
+    # Verificar o status uma única vez para todo o lote
+    status = verificar_status_waha()
+    if status.get("status") == "error":
+        return {
+            "sucesso": False,
+            "erro": "API Waha não acessível",
+            "mensagem": status.get("mensagem")
+        }
+    
+    with com_prioridade("lote"):
+        resultados = enviar_em_lote(
+            chat_ids, lambda chat_id: enviar_para_chat(chat_id, mensagem, campanha=campanha), ENVIO_LOTE_CONCORRENCIA
+        )
+    enviados = sum(1 for _, r in resultados if r["sucesso"])
+    falhas += [{"destino": rotulo_chat(c), "erro": r["erro"]} for c, r in resultados if not r["sucesso"]]
+    total = enviados + len(falhas)
+    return {
+        "sucesso": not falhas,
+        "total": total,
+        "enviados": enviados,
+        "falhas": falhas,
+        "mensagem": f"Mensagem enviada para {enviados} de {total} destinos"
+    }
+
+def grupo_chat_id(grupo):
+    """
+    Aceita o ID do grupo com ou sem o sufixo @g.us; levanta ValueError para outros chats (contatos, listas)
+    """
+    grupo = grupo.strip()
+    chat_id = normalizar_chat_id(grupo if "@" in grupo else f"{grupo}@g.us")
+    if not chat_id.endswith("@g.us"):
+        raise ValueError(f"ID de grupo inválido: '{grupo}'. Use o ID do grupo, terminado em @g.us")
+    return chat_id
+
+def enviar_mensagem_participantes(grupo, mensagem, campanha=None):
+    """
+    Envia a mensagem individualmente para cada participante do grupo
+    """
+    try:
+        participantes = grupos.participantes(grupo_chat_id(grupo))
+    except ValueError as e:
+        return {"sucesso": False, "erro": str(e)}
+    except requests.RequestException as e:
         return {
             "sucesso": False,
             "erro": str(e),
-            "mensagem": f"Falha ao enviar mensagem para {numero}: {str(e)}"
+            "mensagem": f"Falha ao obter os participantes do grupo {grupo}: {str(e)}"
         }
+    return enviar_mensagem_lote(participantes, mensagem, campanha)
 
 def carregar_contatos():
     """
@@ -144,6 +350,16 @@ def configuracao_waha():
         "sessionId": SESSION_ID
     }
 
+@mcp.resource("waha://estatisticas")
+def estatisticas_waha():
+    """Ocupação das filas, limite de concorrência atual e uso dos caches"""
+    return {
+        "waha": despachante.estatisticas(),
+        "concorrencia": waha.controle.estatisticas() if waha.controle else None,
+        "midia": midia.estatisticas(),
+        "agrupamento": agrupador.estatisticas() if agrupador.ativo else None,
+    }
+
 @mcp.resource("waha://status")
 def status_waha():
     """Status da conexão com o WhatsApp"""
@@ -158,38 +374,48 @@ def contatos_waha():
         "name": "Contatos WhatsApp",
         "mimeType": "application/json",
         "description": "Mapeamento de nomes para números de telefone no WhatsApp",
-        "data": contatos
+        "data": contatos,
+        "sincronizados": {
+            "total": contatos_store.total(),
+            "ultimaSincronizacao": contatos_store.obter_estado("ultima_sincronizacao")
+        }
     }
 
 @mcp.tool()
-def enviar_mensagem_whatsapp(numero: str, mensagem: str):
+async def enviar_mensagem_whatsapp(numero: str, mensagem: str, campos: Optional[List[str]] = None):
     """
     Envia uma mensagem de texto via WhatsApp usando a API Waha
     
     Args:
         numero: Número de telefone completo com código do país (sem '+' ou espaços, ex: 5511999999999)
         mensagem: Conteúdo da mensagem a ser enviada
+        campos: Campos extras da resposta do Waha a incluir (ex: ["timestamp", "id.remote"]; "*" para todos)
     
     Returns:
         dict: Resultado da operação
     """
-    return enviar_mensagem_waha(numero, mensagem)
+    # Numa thread, para não travar o loop de eventos (e chamadas simultâneas ao mesmo chat poderem ser agrupadas)
+    with com_prioridade("interativa"):
+        return await enviar_agrupado(numero, mensagem, campos)
 
 @mcp.tool()
-def enviar_mensagem_por_nome(nome: str, mensagem: str):
+async def enviar_mensagem_por_nome(nome: str, mensagem: str, campos: Optional[List[str]] = None):
     """
     Envia uma mensagem de texto via WhatsApp para um contato pelo nome
     
     Args:
         nome: Nome do contato cadastrado no sistema
         mensagem: Conteúdo da mensagem a ser enviada
+        campos: Campos extras da resposta do Waha a incluir (ex: ["timestamp"]; "*" para todos)
     
     Returns:
         dict: Resultado da operação
     """
     contatos = carregar_contatos()
-    if nome in contatos:
-        return enviar_mensagem_waha(contatos[nome], mensagem)
+    numero = contatos.get(nome) or contatos_store.buscar_por_nome(nome)
+    if numero:
+        with com_prioridade("interativa"):
+            return await enviar_agrupado(numero, mensagem, campos)
     else:
         return {
             "sucesso": False,
@@ -197,10 +423,362 @@ def enviar_mensagem_por_nome(nome: str, mensagem: str):
             "mensagem": f"O contato '{nome}' não está cadastrado no sistema"
         }
 
+def enviar_mensagem_para_grupo(grupo_id, mensagem):
+    """
+    Envia uma mensagem diretamente no chat de um grupo
+    """
+    status = verificar_status_waha()
+    if status.get("status") == "error":
+        return {
+            "sucesso": False,
+            "erro": "API Waha não acessível",
+            "mensagem": status.get("mensagem")
+        }
+    return enviar_para_chat(grupo_id, mensagem)
+
+@mcp.tool()
+async def enviar_mensagem_grupo(grupo: str, mensagem: str):
+    """
+    Envia uma mensagem de texto diretamente no chat de um grupo do WhatsApp
+    
+    Args:
+        grupo: ID do grupo (ex: 120363012345678901@g.us; o sufixo @g.us é opcional)
+        mensagem: Conteúdo da mensagem a ser enviada
+    
+    Returns:
+        dict: Resultado da operação
+    """
+    try:
+        grupo_id = grupo_chat_id(grupo)
+    except ValueError as e:
+        return {"sucesso": False, "erro": str(e)}
+    with com_prioridade("interativa"):
+        return await asyncio.to_thread(enviar_mensagem_para_grupo, grupo_id, mensagem)
+
+@mcp.tool()
+async def enviar_mensagem_participantes_grupo(grupo: str, mensagem: str, campanha: Optional[str] = None):
+    """
+    Envia a mensagem individualmente para cada participante de um grupo
+    
+    Args:
+        grupo: ID do grupo (ex: 120363012345678901@g.us; o sufixo @g.us é opcional)
+        mensagem: Conteúdo da mensagem a ser enviada
+        campanha: Nome da campanha, para consultar depois a taxa de entrega (opcional)
+    
+    Returns:
+        dict: Resumo com o total de envios e os participantes que falharam
+    """
+    # Numa thread, para o lote não travar o loop de eventos: as chamadas interativas
+    # continuam sendo atendidas e passam à frente nas filas do despachante
+    with com_prioridade("lote"):
+        return await asyncio.to_thread(enviar_mensagem_participantes, grupo, mensagem, campanha)
+
+@mcp.tool()
+async def enviar_mensagem_lista(destinos: List[str], mensagem: str, campanha: Optional[str] = None):
+    """
+    Envia a mesma mensagem para uma lista de destinos (lista de transmissão)
+    
+    Args:
+        destinos: Números (ex: 5511999999999) ou IDs de chat (…@c.us, …@g.us, …@broadcast)
+        mensagem: Conteúdo da mensagem a ser enviada
+        campanha: Nome da campanha, para consultar depois a taxa de entrega (opcional)
+    
+    Returns:
+        dict: Resumo com o total de envios e os destinos que falharam
+    """
+    with com_prioridade("lote"):
+        return await asyncio.to_thread(enviar_mensagem_lote, destinos, mensagem, campanha)
+
+def consultar_metadados_grupo(grupo_id, incluir_participantes=False):
+    """
+    Metadados do grupo (do cache) e, opcionalmente, a lista de participantes
+    """
+    try:
+        resultado = dict(grupos.metadados(grupo_id))
+        if incluir_participantes:
+            resultado["lista_participantes"] = grupos.participantes(grupo_id)
+        return {"sucesso": True, "grupo": resultado}
+    except requests.RequestException as e:
+        return {
+            "sucesso": False,
+            "erro": str(e),
+            "mensagem": f"Falha ao consultar o grupo {grupo_id}: {str(e)}"
+        }
+
+@mcp.tool()
+async def consultar_grupo(grupo: str, incluir_participantes: bool = False):
+    """
+    Retorna nome e quantidade de participantes de um grupo do WhatsApp
+    
+    Args:
+        grupo: ID do grupo (ex: 120363012345678901@g.us; o sufixo @g.us é opcional)
+        incluir_participantes: Incluir a lista de participantes no resultado
+    
+    Returns:
+        dict: Metadados do grupo
+    """
+    try:
+        grupo_id = grupo_chat_id(grupo)
+    except ValueError as e:
+        return {"sucesso": False, "erro": str(e)}
+    return await asyncio.to_thread(consultar_metadados_grupo, grupo_id, incluir_participantes)
+
+@mcp.tool()
+async def sincronizar_contatos():
+    """
+    Sincroniza agora a agenda do WhatsApp com os contatos locais
+    
+    Apenas as alterações desde a última sincronização são gravadas
+    
+    Returns:
+        dict: Resumo com páginas lidas e contatos inseridos, atualizados e removidos
+    """
+    try:
+        with com_prioridade("lote"):
+            resumo = await asyncio.to_thread(sincronizador.sincronizar)
+        return {"sucesso": True, "sincronizacao": resumo}
+    except requests.RequestException as e:
+        return {
+            "sucesso": False,
+            "erro": str(e),
+            "mensagem": f"Falha ao sincronizar contatos: {str(e)}"
+        }
+
+@mcp.tool()
+async def importar_contatos(arquivo: str, formato: Optional[str] = None):
+    """
+    Importa contatos de um arquivo CSV ou JSON lines, gravando em lotes sem carregar o arquivo inteiro
+    
+    Cada registro precisa de um número com DDI (coluna/chave numero, telefone, phone...) e pode
+    ter um nome (nome, name); registros inválidos são contados e ignorados
+    
+    Args:
+        arquivo: Caminho do arquivo dentro do diretório de arquivos de contatos (ex: clientes.csv, clientes.jsonl.gz)
+        formato: csv ou jsonl (padrão: deduzido da extensão)
+    
+    Returns:
+        dict: Resumo com registros lidos, gravados, inalterados e inválidos (com as primeiras linhas inválidas)
+    """
+    try:
+        caminho = resolver_arquivo(CONTATOS_ARQUIVOS_DIR, arquivo)
+        resumo = await asyncio.to_thread(importar_arquivo, contatos_store, caminho, formato)
+        return {"sucesso": True, "importacao": resumo}
+    except (ValueError, OSError) as e:
+        return {
+            "sucesso": False,
+            "erro": str(e),
+            "mensagem": f"Falha ao importar contatos de {arquivo}"
+        }
+
+@mcp.tool()
+async def exportar_contatos(arquivo: str, formato: Optional[str] = None):
+    """
+    Exporta todos os contatos locais (sincronizados e importados) para um arquivo CSV ou JSON lines
+    
+    Args:
+        arquivo: Caminho do arquivo dentro do diretório de arquivos de contatos (ex: contatos.csv, contatos.jsonl.gz)
+        formato: csv ou jsonl (padrão: deduzido da extensão)
+    
+    Returns:
+        dict: Quantidade de contatos exportados
+    """
+    try:
+        caminho = resolver_arquivo(CONTATOS_ARQUIVOS_DIR, arquivo)
+        resumo = await asyncio.to_thread(exportar_arquivo, contatos_store, caminho, formato)
+        return {"sucesso": True, "exportacao": resumo}
+    except (ValueError, OSError) as e:
+        return {
+            "sucesso": False,
+            "erro": str(e),
+            "mensagem": f"Falha ao exportar contatos para {arquivo}"
+        }
+
+@mcp.tool()
+def buscar_contato(nome: str, limite: int = 10):
+    """
+    Busca contatos sincronizados do WhatsApp pelo início do nome
+    
+    Args:
+        nome: Nome ou início do nome do contato
+        limite: Quantidade máxima de resultados
+    
+    Returns:
+        dict: Contatos encontrados (nome e número)
+    """
+    return {"sucesso": True, "contatos": contatos_store.pesquisar(nome, min(limite, 50))}
+
+def ler_mensagens_chat(chat_id, cursor=None, tamanho=MENSAGENS_PAGINA, campos=None):
+    """
+    Uma página das mensagens do chat, da mais recente para a mais antiga
+    """
+    try:
+        pagina = mensagens.ler(chat_id, cursor, max(1, min(tamanho, 100)))
+    except ValueError as e:
+        return {"sucesso": False, "erro": str(e)}
+    except requests.RequestException as e:
+        return {
+            "sucesso": False,
+            "erro": str(e),
+            "mensagem": f"Falha ao ler as mensagens de {rotulo_chat(chat_id)}"
+        }
+    return {
+        "sucesso": True,
+        "chat": rotulo_chat(chat_id),
+        "mensagens": [resumir_mensagem(m, campos) for m in pagina["mensagens"]],
+        "proximo_cursor": pagina["proximo_cursor"]
+    }
+
+@mcp.tool()
+async def ler_mensagens(chat: str, cursor: Optional[str] = None, tamanho: int = MENSAGENS_PAGINA,
+                        campos: Optional[List[str]] = None):
+    """
+    Lê as mensagens de um chat em páginas, da mais recente para a mais antiga
+    
+    Args:
+        chat: Número (ex: 5511999999999) ou ID do chat (…@c.us, …@g.us)
+        cursor: Valor de proximo_cursor retornado pela página anterior (omita para a página mais recente)
+        tamanho: Quantidade de mensagens por página (máximo 100)
+        campos: Campos extras de cada mensagem do Waha a incluir (ex: ["ack", "replyTo"]; "*" para todos)
+    
+    Returns:
+        dict: Mensagens da página e o cursor da próxima (None ao chegar ao início da conversa)
+    """
+    try:
+        chat_id = normalizar_chat_id(chat)
+    except ValueError as e:
+        return {"sucesso": False, "erro": str(e)}
+    with com_prioridade("interativa"):
+        return await asyncio.to_thread(ler_mensagens_chat, chat_id, cursor, tamanho, campos)
+
+def ler_midia_chat(chat_id, id_mensagem, inicio=0, tamanho=MIDIA_PAGINA):
+    """
+    Uma faixa de bytes da mídia da mensagem, lida do cache em disco
+    """
+    try:
+        arquivo = midia.obter(chat_id, id_mensagem)
+        dados = midia.ler(arquivo, inicio, max(0, min(tamanho, 1048576)))
+    except ValueError as e:
+        return {"sucesso": False, "erro": str(e)}
+    except (requests.RequestException, OSError) as e:
+        return {
+            "sucesso": False,
+            "erro": str(e),
+            "mensagem": f"Falha ao baixar a mídia da mensagem {id_mensagem}"
+        }
+    fim = max(0, inicio) + len(dados)
+    return {
+        "sucesso": True,
+        "mimetype": arquivo["mimetype"],
+        "nome": arquivo["nome"],
+        "tamanho": arquivo["tamanho"],
+        "inicio": max(0, inicio),
+        "proximo": fim if fim < arquivo["tamanho"] else None,
+        "dados": base64.b64encode(dados).decode("ascii")
+    }
+
+@mcp.tool()
+async def ler_midia(chat: str, id_mensagem: str, inicio: int = 0, tamanho: int = MIDIA_PAGINA):
+    """
+    Lê a mídia (imagem, áudio, documento) de uma mensagem recebida, por faixa de bytes
+    
+    A mídia é baixada do Waha uma vez e as leituras seguintes vêm do cache em disco
+    
+    Args:
+        chat: Número ou ID do chat da mensagem
+        id_mensagem: ID da mensagem com mídia (campo id de ler_mensagens)
+        inicio: Posição, em bytes, a partir da qual ler
+        tamanho: Quantidade máxima de bytes a ler (máximo 1048576)
+    
+    Returns:
+        dict: Tipo, nome e tamanho total da mídia, os bytes lidos em base64 e a posição da próxima leitura (None no fim)
+    """
+    try:
+        chat_id = normalizar_chat_id(chat)
+    except ValueError as e:
+        return {"sucesso": False, "erro": str(e)}
+    with com_prioridade("interativa"):
+        return await asyncio.to_thread(ler_midia_chat, chat_id, id_mensagem, inicio, tamanho)
+
+@mcp.tool()
+def status_mensagem(id_mensagem: Optional[str] = None, chat: Optional[str] = None, limite: int = 20):
+    """
+    Consulta o estado de entrega (SERVER, DEVICE, READ...) de mensagens enviadas
+    
+    Args:
+        id_mensagem: ID retornado no envio da mensagem
+        chat: Número ou ID do chat, para listar as mensagens mais recentes enviadas a ele
+        limite: Quantidade máxima de mensagens ao consultar por chat
+    
+    Returns:
+        dict: Estado de entrega das mensagens
+    """
+    if id_mensagem:
+        registro = entregas.consultar(id_mensagem)
+        if registro is None:
+            return {
+                "sucesso": False,
+                "erro": "Mensagem não encontrada",
+                "mensagem": f"Nenhum envio registrado com o ID '{id_mensagem}'"
+            }
+        return {"sucesso": True, "mensagens": [registro]}
+    if chat:
+        try:
+            chat_id = normalizar_chat_id(chat)
+        except ValueError as e:
+            return {"sucesso": False, "erro": str(e)}
+        return {"sucesso": True, "mensagens": entregas.por_chat(chat_id, min(limite, 100))}
+    return {
+        "sucesso": False,
+        "erro": "Parâmetros ausentes",
+        "mensagem": "Informe id_mensagem ou chat"
+    }
+
+@mcp.tool()
+def consultar_envios(chat: Optional[str] = None, desde: Optional[str] = None, ate: Optional[str] = None,
+                     limite: int = 50):
+    """
+    Consulta o registro de auditoria dos envios (texto, horário e resultado de cada mensagem enviada)
+    
+    Args:
+        chat: Número ou ID do chat (omita para todos os chats)
+        desde: Data ou data e hora inicial, no horário local (ex: 2026-03-01 ou 2026-03-01T14:30)
+        ate: Data final (inclui o dia inteiro) ou data e hora final (exclusiva)
+        limite: Quantidade máxima de envios retornados (máximo 500)
+    
+    Returns:
+        dict: Envios encontrados, do mais recente ao mais antigo
+    """
+    try:
+        chat_id = normalizar_chat_id(chat) if chat else None
+        inicio, fim = analisar_periodo(desde, ate)
+    except ValueError as e:
+        return {"sucesso": False, "erro": str(e)}
+    return {"sucesso": True, "envios": auditoria.consultar(chat_id, inicio, fim, max(1, min(limite, 500)))}
+
+@mcp.tool()
+def taxa_entrega_campanha(campanha: str):
+    """
+    Retorna a contagem por estado e as taxas de entrega e leitura de uma campanha
+    
+    Args:
+        campanha: Nome da campanha usado nos envios em lote
+    
+    Returns:
+        dict: Resumo de entrega da campanha
+    """
+    return {"sucesso": True, "entrega": entregas.resumo_campanha(campanha)}
+
 if __name__ == "__main__":
     # Verificar status do Waha ao iniciar
     status = verificar_status_waha()
     print(f"Status do WhatsApp: {status['mensagem']}")
+    sincronizador.iniciar()
+    consultor_entregas.iniciar()
+    auditoria.iniciar()
     
     print("Servidor MCP Waha iniciado. Aguardando comandos...")
-    mcp.run() 
\ No newline at end of file
+    try:
+        mcp.run()
+    finally:
+        waha.fechar()
+        auditoria.fechar()
@@ -5,23 +5,41 @@ Versão SSE (Server-Sent Events) com servidor web
 """
 
 import os
+import base64
+import asyncio
+import contextlib
+import hashlib
+import hmac
 import logging
 import uuid
+import anyio
 import requests
+from typing import List, Optional
 from dotenv import load_dotenv
 from mcp.server.fastmcp import FastMCP
 import uvicorn
+from sse_starlette.sse import AppStatus
 from starlette.applications import Starlette
-from starlette.routing import Mount
+from starlette.requests import Request
+from starlette.responses import FileResponse, JSONResponse
+from starlette.routing import Mount, Route
 from starlette.middleware import Middleware
 from starlette.middleware.cors import CORSMiddleware
+from resultados import projetar, extrair_id_mensagem, resumir_sessoes, truncar
+from waha_api import normalizar_chat_id, rotulo_chat
+from prioridades import com_prioridade
+from distribuicao import enviar_em_lote
+from entregas import processar_evento_ack
+from perfil import Perfilador, analisar_configuracao
+from drenagem import ControleDrenagem
+from fragmentacao import dividir_mensagem, enviar_partes
+from importacao_contatos import resolver_arquivo, importar_contatos as importar_arquivo, exportar_contatos as exportar_arquivo
+from mensagens import resumir_mensagem
+from midia import MidiaIndisponivel
+from auditoria import analisar_periodo
+from inquilinos import RegistroInquilinos, MiddlewareInquilinos, INQUILINO_PADRAO, inquilino_atual, nome_inquilino_atual
+from logs_estruturados import configurar_logs
 
-# Configurar logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='[%(asctime)s] %(levelname)s: %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
-)
 logger = logging.getLogger(__name__)
 
 # Carregar variáveis de ambiente
@@ -31,17 +49,165 @@ load_dotenv()
 WAHA_API_URL = os.getenv("WAHA_API_URL", "http://localhost:3000")
 MCP_PORT = int(os.getenv("MCP_PORT", 8000))
 SESSION_ID = os.getenv("WAHA_SESSION_ID", "default")
+GRUPOS_CACHE_TTL = int(os.getenv("GRUPOS_CACHE_TTL", 300))
+ENVIO_LOTE_CONCORRENCIA = int(os.getenv("ENVIO_LOTE_CONCORRENCIA", 5))
+WAHA_CONCORRENCIA = int(os.getenv("WAHA_CONCORRENCIA", 4))
+WAHA_CONCORRENCIA_MINIMA = int(os.getenv("WAHA_CONCORRENCIA_MINIMA", 1))
+WAHA_CONCORRENCIA_MAXIMA = int(os.getenv("WAHA_CONCORRENCIA_MAXIMA", 16))
+WAHA_LATENCIA_TOLERANCIA = float(os.getenv("WAHA_LATENCIA_TOLERANCIA", 1.5))
+WAHA_TAXA_MAXIMA = float(os.getenv("WAHA_TAXA_MAXIMA", 0))
+WAHA_PESOS_PRIORIDADE = os.getenv("WAHA_PESOS_PRIORIDADE")
+CONTATOS_DB = os.getenv("CONTATOS_DB", os.path.join(os.path.dirname(__file__), "contatos.db"))
+CONTATOS_SYNC_INTERVALO = int(os.getenv("CONTATOS_SYNC_INTERVALO", 900))
+CONTATOS_SYNC_PAGINA = int(os.getenv("CONTATOS_SYNC_PAGINA", 500))
+CONTATOS_ARQUIVOS_DIR = os.getenv("CONTATOS_ARQUIVOS_DIR", os.path.join(os.path.dirname(__file__), "arquivos"))
+ENTREGAS_DB = os.getenv("ENTREGAS_DB", os.path.join(os.path.dirname(__file__), "entregas.db"))
+ENTREGAS_POLL_INTERVALO = int(os.getenv("ENTREGAS_POLL_INTERVALO", 60))
+WAHA_WEBHOOK_HMAC_KEY = os.getenv("WAHA_WEBHOOK_HMAC_KEY")
+MCP_ADMIN_TOKEN = os.getenv("MCP_ADMIN_TOKEN")
+MCP_PERFIL = os.getenv("MCP_PERFIL")
+MCP_PERFIL_MODO = os.getenv("MCP_PERFIL_MODO", "cprofile")
+MCP_PERFIL_DIR = os.getenv("MCP_PERFIL_DIR", os.path.join(os.path.dirname(__file__), "perfis"))
+MCP_DRENAGEM_TIMEOUT = float(os.getenv("MCP_DRENAGEM_TIMEOUT", 30))
+MENSAGEM_TAMANHO_MAXIMO = int(os.getenv("MENSAGEM_TAMANHO_MAXIMO", 4096))
+MENSAGEM_AGRUPAMENTO_MS = int(os.getenv("MENSAGEM_AGRUPAMENTO_MS", 0))
+MENSAGENS_PAGINA = int(os.getenv("MENSAGENS_PAGINA", 20))
+MENSAGENS_CACHE_TTL = int(os.getenv("MENSAGENS_CACHE_TTL", 60))
+MIDIA_DIR = os.getenv("MIDIA_DIR", os.path.join(os.path.dirname(__file__), "midia"))
+MIDIA_CACHE_MB = int(os.getenv("MIDIA_CACHE_MB", 512))
+MIDIA_PAGINA = int(os.getenv("MIDIA_PAGINA", 262144))
+AUDITORIA_DIR = os.getenv("AUDITORIA_DIR", os.path.join(os.path.dirname(__file__), "auditoria"))
+AUDITORIA_SEGMENTO_MB = int(os.getenv("AUDITORIA_SEGMENTO_MB", 64))
+AUDITORIA_ROTACAO = int(os.getenv("AUDITORIA_ROTACAO", 86400))
+WAHA_GRAVACAO = os.getenv("WAHA_GRAVACAO")
+WAHA_REPRODUCAO = os.getenv("WAHA_REPRODUCAO")
+WAHA_REPRODUCAO_VELOCIDADE = float(os.getenv("WAHA_REPRODUCAO_VELOCIDADE", 1))
+MCP_INQUILINOS = os.getenv("MCP_INQUILINOS")
+MCP_INQUILINO_OCIOSO = int(os.getenv("MCP_INQUILINO_OCIOSO", 600))
+MCP_INQUILINO_THREADS = int(os.getenv("MCP_INQUILINO_THREADS", 8))
+LOG_NIVEL = os.getenv("LOG_NIVEL", "INFO").upper()
+LOG_FORMATO = os.getenv("LOG_FORMATO", "json")
+LOG_AMOSTRAGEM_SUCESSO = float(os.getenv("LOG_AMOSTRAGEM_SUCESSO", 1))
+LOG_REDIGIR = os.getenv("LOG_REDIGIR", "telefones,corpos")
+LOG_FILA = int(os.getenv("LOG_FILA", 10000))
+
+# Configurar logging: fila não bloqueante, escrita em JSON por uma thread própria
+configurar_logs(
+    LOG_NIVEL, LOG_FORMATO, LOG_AMOSTRAGEM_SUCESSO, LOG_REDIGIR, LOG_FILA,
+    contexto={"inquilino": nome_inquilino_atual} if MCP_INQUILINOS else None
+)
 
 # Criar o servidor MCP
 mcp = FastMCP("WhatsApp Server SSE")
 
-def verificar_status_waha():
+# Inquilinos, cada um com cliente Waha (pool de conexões, filas de prioridade), cache de
+# grupos, contatos sincronizados e confirmações de entrega próprios. Sem MCP_INQUILINOS
+# há um único inquilino com as configurações abaixo; com ele, estas são os valores padrão
+registro_inquilinos = RegistroInquilinos(MCP_INQUILINOS, {
+    "waha_api_url": WAHA_API_URL,
+    "waha_session_id": SESSION_ID,
+    "waha_concorrencia": WAHA_CONCORRENCIA,
+    "waha_concorrencia_minima": WAHA_CONCORRENCIA_MINIMA,
+    "waha_concorrencia_maxima": WAHA_CONCORRENCIA_MAXIMA,
+    "waha_latencia_tolerancia": WAHA_LATENCIA_TOLERANCIA,
+    "waha_taxa_maxima": WAHA_TAXA_MAXIMA,
+    "waha_pesos_prioridade": WAHA_PESOS_PRIORIDADE,
+    "waha_gravacao": WAHA_GRAVACAO,
+    "waha_reproducao": WAHA_REPRODUCAO,
+    "waha_reproducao_velocidade": WAHA_REPRODUCAO_VELOCIDADE,
+    "waha_webhook_hmac_key": WAHA_WEBHOOK_HMAC_KEY,
+    "grupos_cache_ttl": GRUPOS_CACHE_TTL,
+    "mensagens_cache_ttl": MENSAGENS_CACHE_TTL,
+    "mensagem_tamanho_maximo": MENSAGEM_TAMANHO_MAXIMO,
+    "mensagem_agrupamento_ms": MENSAGEM_AGRUPAMENTO_MS,
+    "midia_dir": MIDIA_DIR,
+    "midia_cache_mb": MIDIA_CACHE_MB,
+    "auditoria_dir": AUDITORIA_DIR,
+    "auditoria_segmento_mb": AUDITORIA_SEGMENTO_MB,
+    "auditoria_rotacao": AUDITORIA_ROTACAO,
+    "contatos_db": CONTATOS_DB,
+    "contatos_sync_intervalo": CONTATOS_SYNC_INTERVALO,
+    "contatos_sync_pagina": CONTATOS_SYNC_PAGINA,
+    "contatos_arquivos_dir": CONTATOS_ARQUIVOS_DIR,
+    "entregas_db": ENTREGAS_DB,
+    "entregas_poll_intervalo": ENTREGAS_POLL_INTERVALO,
+    "mcp_inquilino_threads": MCP_INQUILINO_THREADS,
+}, MCP_INQUILINO_OCIOSO)
+
+def atual():
+    """
+    Inquilino da requisição ou sessão MCP atual (ver inquilinos.MiddlewareInquilinos)
+    """
+    return inquilino_atual.get()
+
+async def em_thread(funcao, *args):
+    """
+    Roda uma função bloqueante fora do loop de eventos, nas threads do inquilino atual
+
+    Durante uma captura de perfil cprofile, a função é perfilada na thread em que roda
+    """
+    return await anyio.to_thread.run_sync(perfilador.envolver(funcao), *args, limiter=atual().limitador)
+
+# Chamadas de ferramentas em andamento, aguardadas no encerramento do servidor
+drenagem = ControleDrenagem()
+
+async def chamar_ferramenta(name, arguments):
+    """
+    Handler das chamadas de ferramentas: recusa chamadas novas durante o encerramento
+    e contabiliza as em andamento
+    """
+    with drenagem.chamada():
+        return await mcp.call_tool(name, arguments)
+
+mcp._mcp_server.call_tool(validate_input=False)(chamar_ferramenta)
+
+# Perfilamento sob demanda das chamadas de ferramentas (inativo até ser acionado)
+perfilador = Perfilador(mcp, MCP_PERFIL_DIR, chamar_ferramenta)
+
+# Notificações agendadas e ainda não entregues aos clientes
+notificacoes_pendentes = set()
+
+def notificar(nivel, mensagem):
+    """
+    Envia uma notificação de log ao cliente MCP da chamada de ferramenta atual
+
+    Fora de uma chamada (ou em threads sem o contexto da chamada) a notificação é
+    descartada; o evento já foi registrado no log
+    """
+    try:
+        session = mcp.get_context().session
+    except ValueError:
+        return
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        # Thread de trabalho do anyio: agendar a notificação no loop de eventos
+        try:
+            anyio.from_thread.run_sync(_agendar_notificacao, session, nivel, mensagem)
+        except RuntimeError:
+            pass
+        return
+    _agendar_notificacao(session, nivel, mensagem)
+
+def _agendar_notificacao(session, nivel, mensagem):
+    tarefa = asyncio.ensure_future(session.send_log_message(level=nivel, data=mensagem))
+    notificacoes_pendentes.add(tarefa)
+    tarefa.add_done_callback(_concluir_notificacao)
+
+def _concluir_notificacao(tarefa):
+    notificacoes_pendentes.discard(tarefa)
+    if not tarefa.cancelled() and tarefa.exception() is not None:
+        logger.debug("Falha ao entregar notificação: %s", tarefa.exception())
+
+def verificar_status_waha(campos=None):
     """
     Verifica se a API Waha está online e autenticada no WhatsApp
+
+    As sessões são resumidas a nome e status; `campos` pede atributos extras de cada sessão
     """
     try:
         # Verificar se a API está online
-        response = requests.get(f"{WAHA_API_URL}/api/sessions")
+        response = atual().waha.get("/api/sessions")
         response.raise_for_status()
         
         # Verificar se há uma sessão ativa
@@ -55,145 +221,805 @@ def verificar_status_waha():
         
         # Verificar se alguma sessão existe - muitas vezes a API funciona mesmo se a sessão
         # não estiver marcada como "CONNECTED" explicitamente
-        logger.info(f"Waha API está respondendo com {len(sessions)} sessões")
+        logger.info("Waha API está respondendo com %d sessões", len(sessions), extra={"amostrar": True})
         return {
             "status": "success",
             "mensagem": f"Waha API está respondendo com {len(sessions)} sessões",
-            "sessions": sessions
+            "sessions": resumir_sessoes(sessions, campos)
         }
     except Exception as e:
-        logger.error(f"Erro ao verificar status do Waha: {str(e)}")
+        logger.error("Erro ao verificar status do Waha: %s", e)
         return {
             "status": "error",
             "mensagem": f"Erro ao verificar status do Waha: {str(e)}"
         }
 
-def enviar_mensagem_waha(numero, mensagem):
+def enviar_mensagem_waha(numero, mensagem, campos=None):
     """
     Envia uma mensagem via WhatsApp usando a API Waha
+
+    Retorna apenas o ID da mensagem; `campos` projeta campos extras da resposta do Waha
     """
-    try:
-        # Verificar formato do número de telefone
-        if not numero.isdigit():
-            error_msg = f"Formato de número inválido: '{numero}'"
-            logger.error(error_msg)
-            mcp.notify("error", error_msg)
-            return {
-                "status": "error",
-                "error": "Formato de número inválido",
-                "message": f"O número '{numero}' deve conter apenas dígitos (ex: 5511999999999)"
-            }
-        
-        # Verificar se a API está acessível
-        status = verificar_status_waha()
-        if status.get("status") == "error":
-            error_msg = f"API Waha não acessível: {status.get('mensagem')}"
-            logger.error(error_msg)
-            mcp.notify("error", error_msg)
-            return {
-                "status": "error",
-                "error": "API Waha não acessível",
-                "message": status.get("mensagem")
-            }
-        
-        logger.info(f"Enviando mensagem para {numero}")
-        
-        # Enviar mensagem com parâmetros completos
-        response = requests.post(
-            f"{WAHA_API_URL}/api/sendText",
-            json={
-                "chatId": f"{numero}@c.us", 
-                "reply_to": None, 
-                "text": mensagem, 
-                "linkPreview": True, 
-                "linkPreviewHighQuality": False, 
-                "session": SESSION_ID
-            },
-            timeout=10
-        )
-        
+    # Verificar formato do número de telefone
+    if not numero.isdigit():
+        error_msg = f"Formato de número inválido: '{numero}'"
+        logger.error("Formato de número inválido: '%s'", numero)
+        notificar("error", error_msg)
+        return {
+            "status": "error",
+            "error": "Formato de número inválido",
+            "message": f"O número '{numero}' deve conter apenas dígitos (ex: 5511999999999)"
+        }
+    
+    # Verificar se a API está acessível
+    status = verificar_status_waha()
+    if status.get("status") == "error":
+        error_msg = f"API Waha não acessível: {status.get('mensagem')}"
+        logger.error("API Waha não acessível: %s", status.get('mensagem'))
+        notificar("error", error_msg)
+        return {
+            "status": "error",
+            "error": "API Waha não acessível",
+            "message": status.get("mensagem")
+        }
+    
+    return enviar_para_chat(f"{numero}@c.us", mensagem, campos)
+
+def enviar_para_chat(chat_id, mensagem, campos=None, campanha=None):
+    """
+    Envia uma mensagem para um chatId já validado (contato, grupo ou lista de transmissão)
+
+    Mensagens maiores que MENSAGEM_TAMANHO_MAXIMO são divididas em partes enviadas em
+    ordem, com um único resultado. O ID de cada mensagem enviada é registrado para
+    acompanhar a entrega (opcionalmente por campanha)
+    """
+    inquilino = atual()
+    destino = rotulo_chat(chat_id)
+    partes = dividir_mensagem(mensagem, int(inquilino.configuracao["mensagem_tamanho_maximo"]))
+    enviadas = []
+    falha = {}
+
+    def enviar_parte(parte):
+        try:
+            response = inquilino.waha.enviar_texto(chat_id, parte)
+        except requests.RequestException as e:
+            inquilino.auditoria.registrar(chat_id, parte, status="falhou", campanha=campanha, erro=str(e))
+            raise
         # Verificar resposta - códigos 200 e 201 são ambos considerados sucesso
         # 200 = OK, 201 = Created (mensagem criada com sucesso)
-        if response.status_code in [200, 201]:
-            success_msg = f"Mensagem enviada com sucesso para {numero}"
-            logger.info(success_msg)
+        if response.status_code not in [200, 201]:
+            falha["response"] = response
+            inquilino.auditoria.registrar(chat_id, parte, status="falhou", campanha=campanha, erro=f"HTTP {response.status_code}")
+            return False
+        dados = response.json()
+        id_mensagem = extrair_id_mensagem(dados)
+        inquilino.auditoria.registrar(chat_id, parte, id_mensagem, campanha=campanha)
+        inquilino.entregas.registrar(id_mensagem, chat_id, campanha)
+        inquilino.mensagens.invalidar_chat(chat_id)
+        enviadas.append((id_mensagem, dados))
+        return True
+
+    def com_partes(resultado):
+        if len(partes) > 1:
+            resultado["partes"] = len(partes)
+            resultado["partes_enviadas"] = len(enviadas)
+            resultado["ids"] = [id_mensagem for id_mensagem, _ in enviadas]
+        return resultado
+
+    try:
+        logger.info("Enviando mensagem para %s", destino, extra={"partes": len(partes), "amostrar": True})
+        
+        if enviar_partes(partes, enviar_parte) == len(partes):
+            success_msg = f"Mensagem enviada com sucesso para {destino}"
+            if len(partes) > 1:
+                success_msg += f" em {len(partes)} partes"
+            logger.info("Mensagem enviada com sucesso para %s", destino,
+                        extra={"id": enviadas[0][0], "partes": len(partes), "amostrar": True})
             
             # Enviar notificação
-            mcp.notify("info", success_msg)
+            notificar("info", success_msg)
             
-            return {
+            resultado = com_partes({
                 "status": "success",
-                "data": response.json(),
+                "id": enviadas[0][0],
                 "message": success_msg
-            }
+            })
+            if campos:
+                if len(partes) > 1:
+                    resultado["data"] = [projetar(dados, campos) for _, dados in enviadas]
+                else:
+                    resultado["data"] = projetar(enviadas[0][1], campos)
+            return resultado
         
         # Se chegou aqui, temos um erro real
-        error_msg = f"Erro na API Waha: {response.status_code} - {response.text}"
-        logger.error(error_msg)
-        mcp.notify("error", error_msg)
-        return {
+        response = falha["response"]
+        error_msg = f"Erro na API Waha: {response.status_code} - {truncar(response.text)}"
+        logger.error("Erro na API Waha ao enviar para %s: %d", destino, response.status_code,
+                     extra={"parte": len(enviadas) + 1, "resposta": truncar(response.text)})
+        notificar("error", error_msg)
+        message = f"Falha ao enviar mensagem para {destino}: Código {response.status_code}"
+        if len(partes) > 1:
+            message = f"Falha ao enviar a parte {len(enviadas) + 1} de {len(partes)} para {destino}: Código {response.status_code}"
+        return com_partes({
             "status": "error",
             "error": error_msg,
-            "message": f"Falha ao enviar mensagem para {numero}: Código {response.status_code}"
-        }
+            "message": message
+        })
     except requests.RequestException as e:
         # Erro específico de requisição HTTP
-        error_msg = f"Falha ao enviar mensagem para {numero}: {str(e)}"
-        logger.error(error_msg)
-        mcp.notify("error", error_msg)
-        return {
+        error_msg = f"Falha ao enviar mensagem para {destino}: {str(e)}"
+        logger.error("Falha ao enviar mensagem para %s: %s", destino, e)
+        notificar("error", error_msg)
+        return com_partes({
             "status": "error",
             "error": str(e),
             "message": error_msg,
-            "solucao": "Verifique se a API Waha está em execução em " + WAHA_API_URL
-        }
+            "solucao": "Verifique se a API Waha está em execução em " + inquilino.configuracao["waha_api_url"]
+        })
     except Exception as e:
         # Outros erros
-        error_msg = f"Falha ao enviar mensagem para {numero}: {str(e)}"
-        logger.error(error_msg)
-        mcp.notify("error", error_msg)
+        error_msg = f"Falha ao enviar mensagem para {destino}: {str(e)}"
+        logger.error("Falha ao enviar mensagem para %s: %s", destino, e)
+        notificar("error", error_msg)
+        return com_partes({
+            "status": "error",
+            "error": str(e),
+            "message": error_msg
+        })
+
+async def enviar_agrupado(numero, mensagem, campos=None):
+    """
+    Envia pela janela de agrupamento (MENSAGEM_AGRUPAMENTO_MS), quando ativa
+
+    Mensagens ao mesmo chat em sequência saem num único envio; cada chamada recebe o
+    resultado do envio do seu grupo, com `agrupamento` indicando quantas mensagens
+    foram unidas e a sua posição
+    """
+    agrupador = atual().agrupador
+    if not agrupador.ativo or not numero.isdigit():
+        return await em_thread(enviar_mensagem_waha, numero, mensagem, campos)
+    # A janela é esperada no loop de eventos e só o envio do grupo ocupa uma thread. A resposta
+    # completa do Waha é pedida uma vez e projetada com os campos de cada chamada
+    resultado, quantidade, posicao = await agrupador.enviar(
+        f"{numero}@c.us", mensagem, lambda texto: em_thread(enviar_mensagem_waha, numero, texto, ["*"])
+    )
+    resultado = dict(resultado)
+    resposta = resultado.pop("data", None)
+    if campos and resposta is not None:
+        if isinstance(resposta, list):
+            resultado["data"] = [projetar(dados, campos) for dados in resposta]
+        else:
+            resultado["data"] = projetar(resposta, campos)
+    if quantidade > 1:
+        resultado["agrupamento"] = {"mensagens": quantidade, "posicao": posicao + 1}
+    return resultado
+
+def enviar_mensagem_lote(destinos, mensagem, campanha=None):
+    """
+    Envia a mesma mensagem para vários destinos, com concorrência limitada
+
+    Retorna um resumo único com a contagem de envios e apenas os destinos que falharam
+    """
+    chat_ids = []
+    falhas = []
+    for destino in destinos:
+        try:
+            chat_ids.append(normalizar_chat_id(destino))
+        except ValueError as e:
+            falhas.append({"destino": destino, "error": str(e)})
+    
+    # Verificar o status uma única vez para todo o lote
+    status = verificar_status_waha()
+    if status.get("status") == "error":
+        return {
+            "status": "error",
+            "error": "API Waha não acessível",
+            "message": status.get("mensagem")
+        }
+    
+    logger.info("Enviando mensagem em lote para %d destinos", len(chat_ids))
+    with com_prioridade("lote"):
+        resultados = enviar_em_lote(
+            chat_ids, lambda chat_id: enviar_para_chat(chat_id, mensagem, campanha=campanha), ENVIO_LOTE_CONCORRENCIA
+        )
+    enviados = sum(1 for _, r in resultados if r["status"] == "success")
+    falhas += [{"destino": rotulo_chat(c), "error": r["error"]} for c, r in resultados if r["status"] != "success"]
+    total = enviados + len(falhas)
+    message = f"Mensagem enviada para {enviados} de {total} destinos"
+    logger.info(message)
+    notificar("info" if not falhas else "warning", message)
+    return {
+        "status": "success" if not falhas else "error",
+        "total": total,
+        "enviados": enviados,
+        "falhas": falhas,
+        "message": message
+    }
+
+def grupo_chat_id(grupo):
+    """
+    Aceita o ID do grupo com ou sem o sufixo @g.us; levanta ValueError para outros chats (contatos, listas)
+    """
+    grupo = grupo.strip()
+    chat_id = normalizar_chat_id(grupo if "@" in grupo else f"{grupo}@g.us")
+    if not chat_id.endswith("@g.us"):
+        raise ValueError(f"ID de grupo inválido: '{grupo}'. Use o ID do grupo, terminado em @g.us")
+    return chat_id
+
+def enviar_mensagem_participantes(grupo, mensagem, campanha=None):
+    """
+    Envia a mensagem individualmente para cada participante do grupo
+    """
+    try:
+        participantes = atual().grupos.participantes(grupo_chat_id(grupo))
+    except ValueError as e:
+        return {"status": "error", "error": str(e)}
+    except requests.RequestException as e:
+        error_msg = f"Falha ao obter os participantes do grupo {grupo}: {str(e)}"
+        logger.error("Falha ao obter os participantes do grupo %s: %s", grupo, e)
+        return {
+            "status": "error",
+            "error": str(e),
+            "message": error_msg
+        }
+    return enviar_mensagem_lote(participantes, mensagem, campanha)
+
+def processar_webhook(evento):
+    """
+    Distribui um evento recebido do webhook do Waha para os caches interessados
+    """
+    inquilino = atual()
+    if inquilino.grupos.processar_evento(evento):
+        logger.info("Cache de grupos invalidado pelo evento %s", evento.get('event'))
+    processar_evento_ack(inquilino.entregas, evento)
+    inquilino.mensagens.processar_evento(evento)
+
+def ler_mensagens_chat(chat, cursor=None, tamanho=MENSAGENS_PAGINA, campos=None):
+    """
+    Uma página das mensagens do chat, da mais recente para a mais antiga
+    """
+    try:
+        chat_id = normalizar_chat_id(chat)
+        pagina = atual().mensagens.ler(chat_id, cursor, max(1, min(tamanho, 100)))
+    except ValueError as e:
+        return {"status": "error", "error": str(e)}
+    except requests.RequestException as e:
+        error_msg = f"Falha ao ler as mensagens de {chat}: {str(e)}"
+        logger.error("Falha ao ler as mensagens de %s: %s", chat, e)
+        return {
+            "status": "error",
+            "error": str(e),
+            "message": error_msg
+        }
+    return {
+        "status": "success",
+        "chat": rotulo_chat(chat_id),
+        "mensagens": [resumir_mensagem(m, campos) for m in pagina["mensagens"]],
+        "proximo_cursor": pagina["proximo_cursor"]
+    }
+
+def ler_midia_chat(chat, id_mensagem, inicio=0, tamanho=MIDIA_PAGINA):
+    """
+    Uma faixa de bytes da mídia da mensagem, lida do cache em disco
+    """
+    cache_midia = atual().midia
+    try:
+        arquivo = cache_midia.obter(normalizar_chat_id(chat), id_mensagem)
+        dados = cache_midia.ler(arquivo, inicio, max(0, min(tamanho, 1048576)))
+    except ValueError as e:
+        return {"status": "error", "error": str(e)}
+    except (requests.RequestException, OSError) as e:
+        error_msg = f"Falha ao baixar a mídia da mensagem {id_mensagem}: {str(e)}"
+        logger.error("Falha ao baixar a mídia da mensagem %s: %s", id_mensagem, e)
         return {
             "status": "error",
             "error": str(e),
             "message": error_msg
         }
+    fim = max(0, inicio) + len(dados)
+    return {
+        "status": "success",
+        "mimetype": arquivo["mimetype"],
+        "nome": arquivo["nome"],
+        "tamanho": arquivo["tamanho"],
+        "inicio": max(0, inicio),
+        "proximo": fim if fim < arquivo["tamanho"] else None,
+        "dados": base64.b64encode(dados).decode("ascii")
+    }
 
 @mcp.resource("waha://configuracao")
 def configuracao_waha():
     """Configurações para a API Waha"""
+    inquilino = atual()
     return {
-        "apiUrl": WAHA_API_URL,
-        "sessionId": SESSION_ID
+        "apiUrl": inquilino.configuracao["waha_api_url"],
+        "sessionId": inquilino.configuracao["waha_session_id"],
+        "inquilino": inquilino.nome
     }
 
 @mcp.resource("waha://status")
-def status_waha():
+async def status_waha():
     """Status da conexão com o WhatsApp"""
-    return verificar_status_waha()
+    return await em_thread(verificar_status_waha)
+
+@mcp.resource("waha://mensagens/{chat}")
+async def mensagens_recentes(chat: str):
+    """Mensagens mais recentes de um chat (número ou ID do chat)"""
+    return await em_thread(ler_mensagens_chat, chat)
+
+@mcp.resource("waha://midia/{chat}/{mensagem}")
+async def midia_mensagem(chat: str, mensagem: str):
+    """Tipo, nome e tamanho da mídia de uma mensagem; o conteúdo é lido com ler_midia ou em GET /midia/{chat}/{mensagem}"""
+    resultado = await em_thread(ler_midia_chat, chat, mensagem, 0, 0)
+    resultado.pop("dados", None)
+    resultado.pop("inicio", None)
+    resultado.pop("proximo", None)
+    return resultado
 
 @mcp.tool()
-def verificar_conexao_whatsapp():
+async def verificar_conexao_whatsapp(campos: Optional[List[str]] = None):
     """
     Verifica se o WhatsApp está conectado através da API Waha
     
+    Args:
+        campos: Atributos extras de cada sessão a incluir (ex: ["me.pushName", "engine"]; "*" para todos)
+    
     Returns:
         dict: Status da conexão WhatsApp
     """
-    return verificar_status_waha()
+    return await em_thread(verificar_status_waha, campos)
 
 @mcp.tool()
-def enviar_mensagem_whatsapp(numero: str, mensagem: str):
+async def enviar_mensagem_whatsapp(numero: str, mensagem: str, campos: Optional[List[str]] = None):
     """
     Envia uma mensagem de texto via WhatsApp usando a API Waha
     
     Args:
         numero: Número de telefone completo com código do país (sem '+' ou espaços, ex: 5511999999999)
         mensagem: Conteúdo da mensagem a ser enviada
+        campos: Campos extras da resposta do Waha a incluir (ex: ["timestamp", "id.remote"]; "*" para todos)
     
     Returns:
         dict: Resultado da operação
     """
-    return enviar_mensagem_waha(numero, mensagem)
+    # Envios avulsos vêm de um agente em conversa: fila interativa, fora do loop de eventos
+    with com_prioridade("interativa"):
+        return await enviar_agrupado(numero, mensagem, campos)
+
+def enviar_mensagem_para_grupo(grupo, mensagem):
+    """
+    Envia uma mensagem diretamente no chat de um grupo
+    """
+    status = verificar_status_waha()
+    if status.get("status") == "error":
+        return {
+            "status": "error",
+            "error": "API Waha não acessível",
+            "message": status.get("mensagem")
+        }
+    try:
+        grupo_id = grupo_chat_id(grupo)
+    except ValueError as e:
+        return {"status": "error", "error": str(e)}
+    return enviar_para_chat(grupo_id, mensagem)
+
+@mcp.tool()
+async def ler_mensagens(chat: str, cursor: Optional[str] = None, tamanho: int = MENSAGENS_PAGINA,
+                        campos: Optional[List[str]] = None):
+    """
+    Lê as mensagens de um chat em páginas, da mais recente para a mais antiga
+    
+    Args:
+        chat: Número (ex: 5511999999999) ou ID do chat (…@c.us, …@g.us)
+        cursor: Valor de proximo_cursor retornado pela página anterior (omita para a página mais recente)
+        tamanho: Quantidade de mensagens por página (máximo 100)
+        campos: Campos extras de cada mensagem do Waha a incluir (ex: ["ack", "replyTo"]; "*" para todos)
+    
+    Returns:
+        dict: Mensagens da página e o cursor da próxima (None ao chegar ao início da conversa)
+    """
+    with com_prioridade("interativa"):
+        return await em_thread(ler_mensagens_chat, chat, cursor, tamanho, campos)
+
+@mcp.tool()
+async def ler_midia(chat: str, id_mensagem: str, inicio: int = 0, tamanho: int = MIDIA_PAGINA):
+    """
+    Lê a mídia (imagem, áudio, documento) de uma mensagem recebida, por faixa de bytes
+    
+    A mídia é baixada do Waha uma vez e as leituras seguintes vêm do cache em disco
+    
+    Args:
+        chat: Número ou ID do chat da mensagem
+        id_mensagem: ID da mensagem com mídia (campo id de ler_mensagens)
+        inicio: Posição, em bytes, a partir da qual ler
+        tamanho: Quantidade máxima de bytes a ler (máximo 1048576)
+    
+    Returns:
+        dict: Tipo, nome e tamanho total da mídia, os bytes lidos em base64 e a posição da próxima leitura (None no fim)
+    """
+    with com_prioridade("interativa"):
+        return await em_thread(ler_midia_chat, chat, id_mensagem, inicio, tamanho)
+
+@mcp.tool()
+async def enviar_mensagem_grupo(grupo: str, mensagem: str):
+    """
+    Envia uma mensagem de texto diretamente no chat de um grupo do WhatsApp
+    
+    Args:
+        grupo: ID do grupo (ex: 120363012345678901@g.us; o sufixo @g.us é opcional)
+        mensagem: Conteúdo da mensagem a ser enviada
+    
+    Returns:
+        dict: Resultado da operação
+    """
+    with com_prioridade("interativa"):
+        return await em_thread(enviar_mensagem_para_grupo, grupo, mensagem)
+
+@mcp.tool()
+async def enviar_mensagem_participantes_grupo(grupo: str, mensagem: str, campanha: Optional[str] = None):
+    """
+    Envia a mensagem individualmente para cada participante de um grupo
+    
+    Args:
+        grupo: ID do grupo (ex: 120363012345678901@g.us; o sufixo @g.us é opcional)
+        mensagem: Conteúdo da mensagem a ser enviada
+        campanha: Nome da campanha, para consultar depois a taxa de entrega (opcional)
+    
+    Returns:
+        dict: Resumo com o total de envios e os participantes que falharam
+    """
+    # O lote roda fora do loop de eventos para não bloquear as demais sessões
+    return await em_thread(enviar_mensagem_participantes, grupo, mensagem, campanha)
+
+@mcp.tool()
+async def enviar_mensagem_lista(destinos: List[str], mensagem: str, campanha: Optional[str] = None):
+    """
+    Envia a mesma mensagem para uma lista de destinos (lista de transmissão)
+    
+    Args:
+        destinos: Números (ex: 5511999999999) ou IDs de chat (…@c.us, …@g.us, …@broadcast)
+        mensagem: Conteúdo da mensagem a ser enviada
+        campanha: Nome da campanha, para consultar depois a taxa de entrega (opcional)
+    
+    Returns:
+        dict: Resumo com o total de envios e os destinos que falharam
+    """
+    return await em_thread(enviar_mensagem_lote, destinos, mensagem, campanha)
+
+def consultar_metadados_grupo(grupo, incluir_participantes=False):
+    """
+    Metadados do grupo (do cache) e, opcionalmente, a lista de participantes
+    """
+    grupos = atual().grupos
+    try:
+        grupo_id = grupo_chat_id(grupo)
+    except ValueError as e:
+        return {"status": "error", "error": str(e)}
+    try:
+        resultado = dict(grupos.metadados(grupo_id))
+        if incluir_participantes:
+            resultado["lista_participantes"] = grupos.participantes(grupo_id)
+        return {"status": "success", "grupo": resultado}
+    except requests.RequestException as e:
+        error_msg = f"Falha ao consultar o grupo {grupo}: {str(e)}"
+        logger.error("Falha ao consultar o grupo %s: %s", grupo, e)
+        return {
+            "status": "error",
+            "error": str(e),
+            "message": error_msg
+        }
+
+@mcp.tool()
+async def consultar_grupo(grupo: str, incluir_participantes: bool = False):
+    """
+    Retorna nome e quantidade de participantes de um grupo do WhatsApp
+    
+    Args:
+        grupo: ID do grupo (ex: 120363012345678901@g.us; o sufixo @g.us é opcional)
+        incluir_participantes: Incluir a lista de participantes no resultado
+    
+    Returns:
+        dict: Metadados do grupo
+    """
+    return await em_thread(consultar_metadados_grupo, grupo, incluir_participantes)
+
+@mcp.tool()
+def status_mensagem(id_mensagem: Optional[str] = None, chat: Optional[str] = None, limite: int = 20):
+    """
+    Consulta o estado de entrega (SERVER, DEVICE, READ...) de mensagens enviadas
+    
+    Args:
+        id_mensagem: ID retornado no envio da mensagem
+        chat: Número ou ID do chat, para listar as mensagens mais recentes enviadas a ele
+        limite: Quantidade máxima de mensagens ao consultar por chat
+    
+    Returns:
+        dict: Estado de entrega das mensagens
+    """
+    if id_mensagem:
+        registro = atual().entregas.consultar(id_mensagem)
+        if registro is None:
+            return {
+                "status": "error",
+                "error": "Mensagem não encontrada",
+                "message": f"Nenhum envio registrado com o ID '{id_mensagem}'"
+            }
+        return {"status": "success", "mensagens": [registro]}
+    if chat:
+        try:
+            chat_id = normalizar_chat_id(chat)
+        except ValueError as e:
+            return {"status": "error", "error": str(e)}
+        return {"status": "success", "mensagens": atual().entregas.por_chat(chat_id, min(limite, 100))}
+    return {
+        "status": "error",
+        "error": "Parâmetros ausentes",
+        "message": "Informe id_mensagem ou chat"
+    }
+
+@mcp.tool()
+async def consultar_envios(chat: Optional[str] = None, desde: Optional[str] = None, ate: Optional[str] = None,
+                           limite: int = 50):
+    """
+    Consulta o registro de auditoria dos envios (texto, horário e resultado de cada mensagem enviada)
+    
+    Args:
+        chat: Número ou ID do chat (omita para todos os chats)
+        desde: Data ou data e hora inicial, no horário local (ex: 2026-03-01 ou 2026-03-01T14:30)
+        ate: Data final (inclui o dia inteiro) ou data e hora final (exclusiva)
+        limite: Quantidade máxima de envios retornados (máximo 500)
+    
+    Returns:
+        dict: Envios encontrados, do mais recente ao mais antigo
+    """
+    try:
+        chat_id = normalizar_chat_id(chat) if chat else None
+        inicio, fim = analisar_periodo(desde, ate)
+    except ValueError as e:
+        return {"status": "error", "error": str(e)}
+    envios = await em_thread(atual().auditoria.consultar, chat_id, inicio, fim, max(1, min(limite, 500)))
+    return {"status": "success", "envios": envios}
+
+@mcp.tool()
+def taxa_entrega_campanha(campanha: str):
+    """
+    Retorna a contagem por estado e as taxas de entrega e leitura de uma campanha
+    
+    Args:
+        campanha: Nome da campanha usado nos envios em lote
+    
+    Returns:
+        dict: Resumo de entrega da campanha
+    """
+    return {"status": "success", "entrega": atual().entregas.resumo_campanha(campanha)}
+
+async def receber_webhook(request: Request):
+    """
+    Recebe eventos do Waha (configure o webhook da sessão para http://<host>:<porta>/webhook,
+    ou http://<host>:<porta>/t/<inquilino>/webhook com vários inquilinos)
+    """
+    corpo = await request.body()
+    chave_hmac = atual().configuracao["waha_webhook_hmac_key"]
+    if chave_hmac:
+        esperado = hmac.new(chave_hmac.encode(), corpo, hashlib.sha512).hexdigest()
+        if not hmac.compare_digest(esperado, request.headers.get("X-Webhook-Hmac", "")):
+            logger.warning("Webhook rejeitado: assinatura HMAC inválida")
+            return JSONResponse({"status": "error", "error": "Assinatura inválida"}, status_code=401)
+    try:
+        evento = await request.json()
+    except ValueError:
+        return JSONResponse({"status": "error", "error": "JSON inválido"}, status_code=400)
+    processar_webhook(evento)
+    return JSONResponse({"status": "success"})
+
+async def baixar_midia(request: Request):
+    """
+    Arquivo da mídia de uma mensagem (GET /midia/<chat>/<id da mensagem>), servido do
+    cache em disco, com suporte a Range
+    """
+    try:
+        chat_id = normalizar_chat_id(request.path_params["chat"])
+        with com_prioridade("interativa"):
+            arquivo = await em_thread(atual().midia.obter, chat_id, request.path_params["mensagem"])
+    except MidiaIndisponivel as e:
+        return JSONResponse({"status": "error", "error": str(e)}, status_code=404)
+    except ValueError as e:
+        return JSONResponse({"status": "error", "error": str(e)}, status_code=400)
+    except requests.RequestException as e:
+        logger.error("Falha ao baixar a mídia da mensagem %s: %s", request.path_params['mensagem'], e)
+        return JSONResponse({"status": "error", "error": str(e)}, status_code=502)
+    return FileResponse(
+        arquivo["caminho"], media_type=arquivo["mimetype"] or "application/octet-stream", filename=arquivo["nome"]
+    )
+
+@mcp.tool()
+async def sincronizar_contatos():
+    """
+    Sincroniza agora a agenda do WhatsApp com os contatos locais
+    
+    Apenas as alterações desde a última sincronização são gravadas
+    
+    Returns:
+        dict: Resumo com páginas lidas e contatos inseridos, atualizados e removidos
+    """
+    try:
+        with com_prioridade("lote"):
+            resumo = await em_thread(atual().sincronizador.sincronizar)
+        return {"status": "success", "sincronizacao": resumo}
+    except requests.RequestException as e:
+        error_msg = f"Falha ao sincronizar contatos: {str(e)}"
+        logger.error("Falha ao sincronizar contatos: %s", e)
+        return {
+            "status": "error",
+            "error": str(e),
+            "message": error_msg
+        }
+
+@mcp.tool()
+async def importar_contatos(arquivo: str, formato: Optional[str] = None):
+    """
+    Importa contatos de um arquivo CSV ou JSON lines, gravando em lotes sem carregar o arquivo inteiro
+    
+    Cada registro precisa de um número com DDI (coluna/chave numero, telefone, phone...) e pode
+    ter um nome (nome, name); registros inválidos são contados e ignorados
+    
+    Args:
+        arquivo: Caminho do arquivo dentro do diretório de arquivos de contatos (ex: clientes.csv, clientes.jsonl.gz)
+        formato: csv ou jsonl (padrão: deduzido da extensão)
+    
+    Returns:
+        dict: Resumo com registros lidos, gravados, inalterados e inválidos (com as primeiras linhas inválidas)
+    """
+    inquilino = atual()
+    try:
+        caminho = resolver_arquivo(inquilino.configuracao["contatos_arquivos_dir"], arquivo)
+        resumo = await em_thread(importar_arquivo, inquilino.contatos_store, caminho, formato)
+        return {"status": "success", "importacao": resumo}
+    except (ValueError, OSError) as e:
+        error_msg = f"Falha ao importar contatos de {arquivo}: {str(e)}"
+        logger.error("Falha ao importar contatos de %s: %s", arquivo, e)
+        return {
+            "status": "error",
+            "error": str(e),
+            "message": error_msg
+        }
+
+@mcp.tool()
+async def exportar_contatos(arquivo: str, formato: Optional[str] = None):
+    """
+    Exporta todos os contatos locais (sincronizados e importados) para um arquivo CSV ou JSON lines
+    
+    Args:
+        arquivo: Caminho do arquivo dentro do diretório de arquivos de contatos (ex: contatos.csv, contatos.jsonl.gz)
+        formato: csv ou jsonl (padrão: deduzido da extensão)
+    
+    Returns:
+        dict: Quantidade de contatos exportados
+    """
+    inquilino = atual()
+    try:
+        caminho = resolver_arquivo(inquilino.configuracao["contatos_arquivos_dir"], arquivo)
+        resumo = await em_thread(exportar_arquivo, inquilino.contatos_store, caminho, formato)
+        return {"status": "success", "exportacao": resumo}
+    except (ValueError, OSError) as e:
+        error_msg = f"Falha ao exportar contatos para {arquivo}: {str(e)}"
+        logger.error("Falha ao exportar contatos para %s: %s", arquivo, e)
+        return {
+            "status": "error",
+            "error": str(e),
+            "message": error_msg
+        }
+
+@mcp.tool()
+def buscar_contato(nome: str, limite: int = 10):
+    """
+    Busca contatos sincronizados do WhatsApp pelo início do nome
+    
+    Args:
+        nome: Nome ou início do nome do contato
+        limite: Quantidade máxima de resultados
+    
+    Returns:
+        dict: Contatos encontrados (nome e número)
+    """
+    return {"status": "success", "contatos": atual().contatos_store.pesquisar(nome, min(limite, 50))}
+
+def admin_autorizado(request):
+    """
+    Rotas administrativas exigem MCP_ADMIN_TOKEN no cabeçalho Authorization (Bearer)
+    """
+    if not MCP_ADMIN_TOKEN:
+        return False
+    return hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {MCP_ADMIN_TOKEN}")
+
+async def admin_perfil(request: Request):
+    """
+    GET consulta a captura de perfil; POST inicia (?chamadas=N ou ?segundos=N, &modo=cprofile|amostragem);
+    DELETE encerra a captura atual
+    """
+    if not admin_autorizado(request):
+        return JSONResponse({"status": "error", "error": "Não autorizado (defina MCP_ADMIN_TOKEN)"}, status_code=403)
+    if request.method == "DELETE":
+        return JSONResponse({"status": "success", "arquivo": perfilador.encerrar()})
+    if request.method == "POST":
+        parametros = request.query_params
+        try:
+            perfilador.iniciar(
+                chamadas=int(parametros["chamadas"]) if "chamadas" in parametros else None,
+                segundos=float(parametros["segundos"]) if "segundos" in parametros else None,
+                modo=parametros.get("modo", "cprofile")
+            )
+        except ValueError as e:
+            return JSONResponse({"status": "error", "error": str(e)}, status_code=400)
+        except RuntimeError as e:
+            return JSONResponse({"status": "error", "error": str(e)}, status_code=409)
+    return JSONResponse({"status": "success", "perfil": perfilador.estado()})
+
+async def admin_inquilinos(request: Request):
+    """
+    Inquilinos carregados, com as requisições abertas e a ocupação das filas do Waha de cada um
+    """
+    if not admin_autorizado(request):
+        return JSONResponse({"status": "error", "error": "Não autorizado (defina MCP_ADMIN_TOKEN)"}, status_code=403)
+    return JSONResponse({"status": "success", "inquilinos": registro_inquilinos.estatisticas()})
+
+async def despejar_inquilinos_ociosos():
+    """
+    Desmonta periodicamente os inquilinos ociosos
+    """
+    while True:
+        await asyncio.sleep(min(60, max(1, MCP_INQUILINO_OCIOSO)))
+        try:
+            await anyio.to_thread.run_sync(registro_inquilinos.despejar_ociosos)
+        except Exception as e:
+            logger.error("Erro ao descarregar inquilinos ociosos: %s", e)
+
+@contextlib.asynccontextmanager
+async def ciclo_de_vida(app):
+    """
+    Inicialização e encerramento da aplicação web
+    """
+    if MCP_PERFIL:
+        try:
+            perfilador.iniciar(modo=MCP_PERFIL_MODO, **analisar_configuracao(MCP_PERFIL))
+        except (ValueError, RuntimeError) as e:
+            logger.error("Perfilamento não iniciado: %s", e)
+    despejo = asyncio.create_task(despejar_inquilinos_ociosos())
+    yield
+    despejo.cancel()
+    perfilador.encerrar()
+    registro_inquilinos.fechar_todos()
+    logger.info("Pools de conexões com o Waha fechados")
+
+class ServidorUvicorn(uvicorn.Server):
+    """
+    Servidor uvicorn que drena as chamadas de ferramentas antes de fechar as conexões
+
+    As conexões SSE ficam abertas durante a drenagem para que os resultados das
+    chamadas em andamento ainda cheguem aos clientes.
+    """
+
+    def handle_exit(self, sig, frame):
+        # O sse_starlette fecha os streams SSE assim que o sinal chega, o que cortaria as
+        # respostas das chamadas em andamento; aqui eles só fecham ao fim da drenagem
+        AppStatus.disable_automatic_graceful_drain()
+        AppStatus.original_handler(self, sig, frame)
+
+    async def shutdown(self, sockets=None):
+        # Parar de aceitar conexões novas antes de drenar, como o uvicorn faz no início do shutdown
+        for servidor in self.servers:
+            servidor.close()
+        logger.info("Encerrando: aguardando %d chamadas em andamento", drenagem.em_andamento)
+        resumo = await drenagem.drenar(MCP_DRENAGEM_TIMEOUT)
+        if notificacoes_pendentes:
+            await asyncio.wait(list(notificacoes_pendentes), timeout=5)
+        # O resultado de cada chamada é escrito no stream SSE logo depois que a ferramenta retorna
+        await asyncio.sleep(0.2)
+        nivel = logging.WARNING if resumo["interrompidas"] else logging.INFO
+        logger.log(nivel, "Drenagem concluída em %ss: %d chamadas concluídas, %d interrompidas",
+                   resumo["duracao_s"], resumo["concluidas"], resumo["interrompidas"])
+        AppStatus.should_exit = True
+        await super().shutdown(sockets=sockets)
 
 @mcp.prompt()
 def mensagem_whatsapp(numero: str, corpo: str):
@@ -214,9 +1040,15 @@ Utilize a ferramenta enviar_mensagem_whatsapp.
 """
 
 if __name__ == "__main__":
-    # Verificar status do Waha ao iniciar
-    status = verificar_status_waha()
-    logger.info(f"Status do WhatsApp: {status['mensagem']}")
+    if registro_inquilinos.varios:
+        logger.info("Inquilinos configurados em %s, carregados sob demanda", MCP_INQUILINOS)
+    else:
+        # Inquilino único: carregado já na partida; sem a saída correspondente, nunca é descarregado
+        inquilino_atual.set(registro_inquilinos.entrar(INQUILINO_PADRAO))
+        
+        # Verificar status do Waha ao iniciar
+        status = verificar_status_waha()
+        logger.info("Status do WhatsApp: %s", status['mensagem'])
     
     # Configurar middleware CORS para permitir solicitações de qualquer origem
     middleware = [
@@ -225,16 +1057,27 @@ if __name__ == "__main__":
             allow_origins=["*"],
             allow_methods=["GET", "POST", "OPTIONS"],
             allow_headers=["*"],
-        )
+        ),
+        Middleware(MiddlewareInquilinos, registro=registro_inquilinos)
     ]
     
     # Criar aplicação Starlette com middleware e montagem do servidor SSE
     app = Starlette(
         middleware=middleware,
+        lifespan=ciclo_de_vida,
         routes=[
+            Route('/webhook', receber_webhook, methods=["POST"]),
+            Route('/midia/{chat}/{mensagem}', baixar_midia, methods=["GET"]),
+            Route('/admin/perfil', admin_perfil, methods=["GET", "POST", "DELETE"]),
+            Route('/admin/inquilinos', admin_inquilinos, methods=["GET"]),
             Mount('/', app=mcp.sse_app()),
         ]
     )
     
-    logger.info(f"Iniciando servidor MCP SSE na porta {MCP_PORT}")
-    uvicorn.run(app, host="0.0.0.0", port=MCP_PORT, log_level="info") 
\ No newline at end of file
+    logger.info("Iniciando servidor MCP SSE na porta %s", MCP_PORT)
+    # As conexões SSE nunca terminam sozinhas: após a drenagem, são encerradas em 1 segundo
+    # log_config=None: os logs do uvicorn seguem para a fila configurada acima
+    config = uvicorn.Config(
+        app, host="0.0.0.0", port=MCP_PORT, log_level="info", log_config=None, timeout_graceful_shutdown=1
+    )
+    ServidorUvicorn(config).run() 
\ No newline at end of file
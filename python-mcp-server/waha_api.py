@@ -0,0 +1,115 @@
+"""
+Cliente HTTP compartilhado para a API Waha
+
+Mantém um pool de conexões reaproveitado por todas as chamadas ao Waha, em vez de
+abrir uma conexão nova a cada requisição. Cada requisição ocupa uma vaga do
+Despachante, que reparte as vagas entre as classes de prioridade. Com um controle
+adaptativo (ver concorrencia.py), a latência e os erros dos envios ajustam o número
+de vagas.
+"""
+
+import re
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from requests.utils import quote
+from prioridades import Despachante
+
+# Sufixos de chat aceitos pelo Waha: contatos, grupos e listas de transmissão
+SUFIXOS_CHAT = ("@c.us", "@g.us", "@broadcast", "@lid")
+PADRAO_CHAT_ID = re.compile(r"^[0-9-]+@(c\.us|g\.us|broadcast|lid)$")
+
+def normalizar_chat_id(destino):
+    """
+    Converte um número (5511999999999) ou ID de chat (…@g.us, …@broadcast) no chatId do Waha
+
+    Levanta ValueError quando o destino não é reconhecido
+    """
+    destino = str(destino).strip()
+    if destino.isdigit():
+        return f"{destino}@c.us"
+    if PADRAO_CHAT_ID.match(destino):
+        return destino
+    raise ValueError(
+        f"Destino inválido: '{destino}'. Use apenas dígitos (ex: 5511999999999) "
+        f"ou um ID de chat terminado em {', '.join(SUFIXOS_CHAT)}"
+    )
+
+def rotulo_chat(chat_id):
+    """
+    Texto curto para identificar o chat em mensagens (o número, no caso de contatos)
+    """
+    return chat_id[:-len("@c.us")] if chat_id.endswith("@c.us") else chat_id
+
+class WahaAPI:
+    """
+    Acesso à API Waha com pool de conexões HTTP
+    """
+
+    def __init__(self, url, session_id, timeout=10, tamanho_pool=10, despachante=None, adaptador=None, controle=None):
+        self.url = url.rstrip("/")
+        self.session_id = session_id
+        self.timeout = timeout
+        self.despachante = despachante or Despachante()
+        self.controle = controle
+        if controle is not None:
+            tamanho_pool = max(tamanho_pool, controle.maximo)
+        self.http = requests.Session()
+        # Um adaptador próprio substitui o transporte padrão (ver gravacao.py)
+        adaptador = adaptador or HTTPAdapter(pool_connections=tamanho_pool, pool_maxsize=tamanho_pool)
+        self.http.mount("http://", adaptador)
+        self.http.mount("https://", adaptador)
+
+    def requisitar(self, metodo, caminho, consumir_taxa=False, **kwargs):
+        """
+        Faz a requisição ao Waha na classe de prioridade atual (ver prioridades.com_prioridade)
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        with self.despachante.vaga(consumir_taxa=consumir_taxa):
+            # Só os envios alimentam o controle adaptativo: têm latência homogênea, ao
+            # contrário de leituras como a lista completa de contatos
+            if self.controle is None or not consumir_taxa:
+                return self.http.request(metodo, f"{self.url}{caminho}", **kwargs)
+            inicio = time.monotonic()
+            erro = True
+            try:
+                response = self.http.request(metodo, f"{self.url}{caminho}", **kwargs)
+                erro = response.status_code >= 500 or response.status_code == 429
+                return response
+            finally:
+                self.controle.registrar(inicio, time.monotonic() - inicio, erro)
+
+    def get(self, caminho, **kwargs):
+        return self.requisitar("GET", caminho, **kwargs)
+
+    def post(self, caminho, **kwargs):
+        return self.requisitar("POST", caminho, **kwargs)
+
+    def caminho_sessao(self, *partes):
+        """
+        Monta caminhos no formato /api/{sessão}/..., escapando cada parte
+        """
+        return "/api/" + "/".join(quote(str(p), safe="@") for p in (self.session_id, *partes))
+
+    def enviar_texto(self, chat_id, texto):
+        """
+        Envia uma mensagem de texto para o chatId informado
+        """
+        return self.post(
+            "/api/sendText",
+            consumir_taxa=True,
+            json={
+                "chatId": chat_id,
+                "reply_to": None,
+                "text": texto,
+                "linkPreview": True,
+                "linkPreviewHighQuality": False,
+                "session": self.session_id
+            }
+        )
+
+    def fechar(self):
+        """
+        Fecha as conexões do pool
+        """
+        self.http.close()